@@ -1,47 +1,34 @@
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-from arxiv import Search, SortCriterion
 
-# --- New Import for Lazy Loading ---
-from rag_state import get_synthesis_model 
-# --- End New Import ---
+from agents.base import Agent
+import fetch_layer
+import llm_gateway
+from agents.context_packer import Passage, pack, CONTEXT_BUDGETS
 
 # Load environment. DO NOT configure genai globally here.
 load_dotenv()
 
-def handle_arxiv_query(query):
+async def handle_arxiv_query(query):
     """Search ArXiv and summarize top abstracts with Gemini."""
-    
-    # Use the lazy loader for the model
-    model = get_synthesis_model() # <--- LAZY LOAD CALL
-    
-    # Search for up to 5 papers, sorting by most recent update
-    search = Search(
-        query=query, 
-        max_results=5, 
-        sort_by=SortCriterion.SubmittedDate # Sort by submission date for relevance
-    )
 
     results = []
+    fetch_info = {}
     try:
-        # Collect results and format them
-        for r in search.results():
-            results.append({
-                "title": r.title,
-                "summary": r.summary,
-                "url": r.entry_id,
-                "published": str(r.published)
-            })
+        # Up to 5 papers, most recently submitted first (cached, over a shared arxiv.Client)
+        results = await fetch_layer.search_arxiv(query, max_results=5, sort_by="SubmittedDate", info=fetch_info)
     except Exception as e:
-        return {"summary": f"ArXiv search failed: {e}", "papers": []}
+        # "error" tells the registry's circuit breaker that the upstream failed
+        return {"summary": f"ArXiv search failed: {e}", "papers": [], "error": f"{type(e).__name__}: {e}"}
 
     if not results:
-        return {"summary": "No relevant papers found on ArXiv.", "papers": []}
+        return {"summary": "No relevant papers found on ArXiv.", "papers": [], "fetch": fetch_info}
 
     # Prepare context for the LLM
-    combined = "\n\n---\n\n".join(
-        [f"Title: {r['title']}\nAbstract: {r['summary']}" for r in results]
+    combined, context_stats = pack(
+        [Passage(r['summary'], f"Title: {r['title']}\nAbstract: ") for r in results],
+        CONTEXT_BUDGETS["Arxiv_Search"],
+        separator="\n\n---\n\n",
     )
 
     prompt = f"""
@@ -56,10 +43,10 @@ def handle_arxiv_query(query):
     ---
     """
 
+    llm_info = {}
     try:
-        # Synchronous Gemini call
-        response = model.generate_content(prompt)
-        summary = response.text.strip()
+        # Async Gemini call through the LLM gateway (rate limit, retries, coalescing)
+        summary = (await llm_gateway.generate(prompt, caller="Arxiv_Search", info=llm_info)).strip()
     except Exception as e:
         # Fallback summary with error
         summary = combined[:1000] + f"\n\n(Gemini summarization failed: {e})"
@@ -67,5 +54,20 @@ def handle_arxiv_query(query):
     # Return structured dictionary
     return {
         "papers": results,
-        "summary": summary
-    }
\ No newline at end of file
+        "summary": summary,
+        "context": context_stats,
+        "llm": llm_info,
+        "fetch": fetch_info,
+    }
+
+
+class ArxivAgent(Agent):
+    name = "Arxiv_Search"
+
+    async def run(self, query: str) -> dict:
+        return await handle_arxiv_query(query)
+
+    def trace_entry(self, result: dict):
+        # Log Arxiv titles and whether they came from the result cache
+        return {"Arxiv_Search_Titles": "\n\n".join([f"Title: {r['title']}" for r in result.get("papers", [])]),
+                "Arxiv_Search_Fetch": result.get("fetch")}
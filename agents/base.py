@@ -0,0 +1,49 @@
+import os, asyncio, contextvars, functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the shared thread pool used for blocking agent work
+# (FAISS search, SentenceTransformer encode, DDGS, arxiv). Bounded so a burst
+# of /ask traffic cannot spawn an unbounded number of threads.
+AGENT_EXECUTOR_WORKERS = int(os.getenv("AGENT_EXECUTOR_WORKERS", "8"))
+
+_EXECUTOR = None
+
+
+def get_blocking_executor():
+    """Creates the shared blocking-work thread pool only once."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(
+            max_workers=AGENT_EXECUTOR_WORKERS,
+            thread_name_prefix="agent-blocking",
+        )
+    return _EXECUTOR
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Runs a blocking callable in the shared agent pool without stalling the event loop.
+    It runs in a copy of the caller's context, so metrics spans reach the caller's trace.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_blocking_executor(), functools.partial(context.run, fn, *args, **kwargs))
+
+
+class Agent:
+    """
+    Common async interface implemented by every agent.
+
+    `run(query)` returns a dict that always contains a "summary" key; the rest of
+    the payload is agent-specific. An "error" key marks an upstream failure
+    (counted by the registry's retry policy and circuit breaker). `trace_entry(result)` turns that payload into
+    the raw-retrieval record stored in the trace log (or None).
+    """
+
+    name = ""
+
+    async def run(self, query: str) -> dict:
+        raise NotImplementedError
+
+    def trace_entry(self, result: dict):
+        return None
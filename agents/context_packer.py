@@ -0,0 +1,187 @@
+import os, re
+from collections import namedtuple
+
+# Token-budgeted context packing, shared by every Gemini call that carries
+# retrieved text (PDF chunks, web snippets, arXiv abstracts, agent outputs).
+#
+# Passages arrive in relevance order. Before anything reaches a prompt:
+#   1. adjacent chunks of the same page (consecutive positions) are merged and
+#      the splitter overlap (CHUNK_OVERLAP) they share is written only once;
+#   2. passages whose word shingles are mostly contained in a passage already
+#      kept are dropped as near-duplicates;
+#   3. what remains is packed best-first until the call's token budget is spent
+#      (the passage that straddles the limit is cut at a word boundary).
+# Tokens are estimated at ~4 characters each; close enough for Gemini's
+# tokenizer on English text and free to compute.
+
+# Per-call budgets in estimated tokens (0 = unlimited). Override with e.g. CONTEXT_BUDGET_WEB_SEARCH=800.
+CONTEXT_BUDGETS = {
+    "PDF_RAG": int(os.getenv("CONTEXT_BUDGET_PDF_RAG", "1500")),
+    "Web_Search": int(os.getenv("CONTEXT_BUDGET_WEB_SEARCH", "1000")),
+    "Arxiv_Search": int(os.getenv("CONTEXT_BUDGET_ARXIV_SEARCH", "1500")),
+    "synthesis": int(os.getenv("CONTEXT_BUDGET_SYNTHESIS", "2000")),
+}
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "1") == "1"
+DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))  # shingle containment that counts as a duplicate
+
+CHARS_PER_TOKEN = 4
+SHINGLE_WORDS = 5
+MIN_OVERLAP_CHARS = 20     # shorter suffix/prefix matches are coincidence, not splitter overlap
+MIN_TRUNCATE_TOKENS = 48   # a cut passage shorter than this is not worth its header
+
+# header is prepended when rendering (citation, title...); passages with the same
+# non-None group and consecutive positions are merge candidates.
+Passage = namedtuple("Passage", ["text", "header", "group", "position"], defaults=("", None, None))
+
+
+def estimate_tokens(text: str):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _render(passage: Passage):
+    return passage.header + passage.text
+
+
+def _overlap(a: str, b: str):
+    """Length of the longest suffix of `a` that is also a prefix of `b`."""
+    for size in range(min(len(a), len(b)), MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def _merge_adjacent(passages: list):
+    """
+    Merges runs of consecutive positions within a group into one passage, placed
+    where its best-ranked member was. Returns (passages, number of merges).
+    """
+    groups = {}
+    for rank, p in enumerate(passages):
+        if p.group is not None and p.position is not None:
+            groups.setdefault(p.group, []).append((p.position, rank))
+
+    absorbed, replacement, merges = set(), {}, 0
+    for members in groups.values():
+        members.sort()
+        run = [members[0]]
+        for member in members[1:] + [None]:
+            if member is not None and member[0] == run[-1][0] + 1:
+                run.append(member)
+                continue
+            if len(run) > 1:
+                first = passages[run[0][1]]
+                text = first.text
+                for _, rank in run[1:]:
+                    nxt = passages[rank].text
+                    cut = _overlap(text, nxt)
+                    text += nxt[cut:] if cut else "\n" + nxt
+                best = min(rank for _, rank in run)
+                replacement[best] = first._replace(text=text)
+                absorbed.update(rank for _, rank in run if rank != best)
+                merges += len(run) - 1
+            run = [member]
+
+    merged = [replacement.get(rank, p) for rank, p in enumerate(passages) if rank not in absorbed]
+    return merged, merges
+
+
+def _shingles(text: str):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _dedupe(passages: list):
+    """Drops passages mostly contained in a better-ranked one. Returns (passages, number dropped)."""
+    kept, kept_shingles = [], []
+    for p in passages:
+        shingles = _shingles(p.text)
+        if shingles and any(len(shingles & seen) / len(shingles) >= DEDUP_THRESHOLD for seen in kept_shingles):
+            continue
+        kept.append(p)
+        kept_shingles.append(shingles)
+    return kept, len(passages) - len(kept)
+
+
+def _truncate(passage: Passage, tokens: int):
+    """Cuts the passage text at a word boundary so the rendered passage fits in `tokens`."""
+    chars = tokens * CHARS_PER_TOKEN - len(passage.header) - 1
+    if chars <= 0:
+        return None
+    cut = passage.text[:chars]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return passage._replace(text=cut.rstrip() + "…")
+
+
+def _fair_caps(sizes: list, budget: int):
+    """Max-min fair split of `budget`: small passages keep their size, the rest share what is left."""
+    caps = [0] * len(sizes)
+    remaining, pending = budget, sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while pending:
+        share = remaining // len(pending)
+        i = pending.pop(0)
+        caps[i] = min(sizes[i], share)
+        remaining -= caps[i]
+    return caps
+
+
+def pack(passages: list, budget_tokens: int, separator: str = "\n\n", fair: bool = False):
+    """
+    Packs relevance-ordered Passages into one context string of at most
+    `budget_tokens` estimated tokens. With fair=True every passage gets a
+    fair share of the budget instead of best-first (used for agent outputs,
+    where a long first answer must not crowd out the others).
+    Returns (context, stats).
+    """
+    passages = [p for p in passages if p.text]
+    before = estimate_tokens(separator.join(_render(p) for p in passages))
+    stats = {"passages": len(passages), "merged": 0, "duplicates": 0, "truncated": 0, "dropped": 0}
+
+    if CONTEXT_PACKING_ENABLED:
+        passages, stats["merged"] = _merge_adjacent(passages)
+        passages, stats["duplicates"] = _dedupe(passages)
+
+    budget = budget_tokens if CONTEXT_PACKING_ENABLED and budget_tokens > 0 else None
+    if budget is not None and fair and passages:
+        sep_tokens = estimate_tokens(separator) * (len(passages) - 1)
+        sizes = [estimate_tokens(_render(p)) for p in passages]
+        caps = _fair_caps(sizes, max(budget - sep_tokens, 0))
+        fitted = []
+        for p, size, cap in zip(passages, sizes, caps):
+            if size > cap:
+                p = _truncate(p, cap) if cap >= MIN_TRUNCATE_TOKENS else None
+                stats["truncated" if p is not None else "dropped"] += 1
+            if p is not None:
+                fitted.append(p)
+        passages = fitted
+
+    packed, used = [], 0
+    for p in passages:
+        cost = estimate_tokens(_render(p)) + (estimate_tokens(separator) if packed else 0)
+        if budget is not None and used + cost > budget:
+            room = budget - used - (estimate_tokens(separator) if packed else 0)
+            # Always keep something: the best passage is cut rather than dropped.
+            if room >= MIN_TRUNCATE_TOKENS or not packed:
+                cut = _truncate(p, room)
+                if cut is not None:
+                    packed.append(cut)
+                    used = budget
+                    stats["truncated"] += 1
+                    continue
+            stats["dropped"] += 1
+            continue
+        packed.append(p)
+        used += cost
+
+    context = separator.join(_render(p) for p in packed)
+    after = estimate_tokens(context)
+    stats.update(tokens_before=before, tokens_after=after, tokens_saved=max(before - after, 0),
+                 budget=budget_tokens)
+    return context, stats
+
+
+def total_saved(context_stats: dict):
+    """Sum of tokens_saved over the per-call stats of one request."""
+    return sum(s.get("tokens_saved", 0) for s in context_stats.values() if isinstance(s, dict))
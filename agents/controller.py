@@ -1,57 +1,53 @@
-import os, json, datetime
+import json, datetime, time, asyncio
 from dotenv import load_dotenv
-import google.generativeai as genai
-from agents import pdf_agent, web_agent, arxiv_agent
 import re
 
 # --- New Import for Lazy Loading ---
-from rag_state import get_synthesis_model 
+from rag_state import get_index_handle
 # --- End New Import ---
+from agents.base import run_blocking
+import llm_gateway
+from agents.registry import AGENT_SPECS, AgentUnavailable, available_agents, call_agent
+from embedding_cache import embed_query
+from response_cache import RESPONSE_CACHE, RESPONSE_CACHE_ENABLED, GENERATION_SCOPED_AGENTS
+from agents.router import ROUTER_ENABLED, ensure_trained
+from trace_store import TRACE_STORE
+from agents.context_packer import Passage, pack, total_saved, CONTEXT_BUDGETS
+import metrics
 
 # Load environment. DO NOT configure genai globally here.
 load_dotenv()
 MODEL_NAME = "gemini-2.5-flash"
 
-LOG_FILE = "logs/trace.json"
-
 # ---------- Utilities ----------
 
 def save_log(entry):
-    os.makedirs("logs", exist_ok=True)
-
-    # Use try/except for reading to handle missing or corrupt file
-    try:
-        with open(LOG_FILE, "r") as f:
-            data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        data = []
-        
-    data.append(entry)
-
-    with open(LOG_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    # Queued for the background trace writer; never blocks the request on disk I/O.
+    TRACE_STORE.append(entry)
 
 
 # ---------- LLM decision maker ----------
 
-async def llm_decide(query: str):
+async def llm_decide(query: str, available: list = None):
     """
     Ask Gemini which agent(s) to call.
     Returns dict with 'agents_used' and 'reason'.
     Falls back to rule-based if parsing fails.
+    Only the `available` agents (default: all) are offered to the model.
+    The gateway's call info is returned under "llm".
     """
-    # Use the LAZY-LOADED model
-    model = get_synthesis_model() 
+    available = list(AGENT_SPECS) if available is None else available
+    agent_lines = "\n    ".join(
+        f"{i}. {name} — {AGENT_SPECS[name].capabilities}" for i, name in enumerate(available, 1)
+    )
 
     system_prompt = """
     You are a routing controller for a multi-agent AI system. 
     
     Your **PRIMARY DIRECTIVE** is to prioritize internal knowledge retrieval.
     
-    Available agents:
-    1. PDF_RAG — Use this to summarize or extract information from uploaded internal documents (PDFs, reports, meeting notes, or any company-specific data).
-    2. Web_Search — Use this to fetch external, general, or recent online information (news, public product details, generic topics).
-    3. Arxiv_Search — Use this specifically for queries about scientific papers, academic research, or topics related to ArXiv.
+    Available agents (choose ONLY from this list):
+    """ + agent_lines + """
 
     Return strict JSON:
     {"agents_used": ["PDF_RAG", "Web_Search"], "reason": "..."}
@@ -62,9 +58,9 @@ async def llm_decide(query: str):
     - **RULE 3 (Academic):** Use Arxiv_Search for 'paper', 'research', or 'scientific' questions.
     - Combine agents if necessary.
     """
+    llm_info = {}
     try:
-        response = await model.generate_content_async([system_prompt, f"User query: {query}"])
-        text = response.text.strip()
+        text = (await llm_gateway.generate([system_prompt, f"User query: {query}"], caller="routing", info=llm_info)).strip()
 
         # If structured output is used, we might not need the regex search
         try:
@@ -77,9 +73,9 @@ async def llm_decide(query: str):
             else:
                 raise ValueError("No valid JSON found in LLM output.")
 
-        return data
+        return dict(data, llm=llm_info)
     
-    except (genai.errors.APIError, Exception) as e: # Catch API errors too
+    except Exception as e: # Gemini API errors included
         # Fallback: rule-based
         agents_used = []
         reason = f"LLM routing failed ({type(e).__name__}: {e}); used rule-based fallback."
@@ -90,17 +86,16 @@ async def llm_decide(query: str):
             agents_used = ["Arxiv_Search"]
         else: # Default to Web_Search for everything else, covers news, latest, recent
             agents_used = ["Web_Search"] 
-        return {"agents_used": agents_used, "reason": reason}
+        return {"agents_used": agents_used, "reason": reason, "fallback": True, "llm": llm_info}
 
 # ---------- LLM summarizer ----------
 
-async def synthesize_answer(agent_outputs: list):
-    """
-    Combine multiple agent responses into a single summarized answer.
-    Each element of agent_outputs is a dict: {"agent": name, "content": text}
-    """
-    combined_text = "\n\n".join(
-        [f"From {a['agent']}:\n{a['content']}" for a in agent_outputs]
+def _synthesis_prompt(agent_outputs: list):
+    """Returns (prompt, combined_text, context_stats); every agent gets a fair share of the budget."""
+    combined_text, context_stats = pack(
+        [Passage(a['content'], f"From {a['agent']}:\n") for a in agent_outputs],
+        CONTEXT_BUDGETS["synthesis"],
+        fair=True,
     )
 
     prompt = f"""
@@ -116,17 +111,110 @@ async def synthesize_answer(agent_outputs: list):
     Agent Outputs to Synthesize:
     {combined_text}
     """
+    return prompt, combined_text, context_stats
+
+
+async def synthesize_answer_stream(agent_outputs: list, context_stats: dict = None, llm_info: dict = None):
+    """
+    Streams the combined answer as text fragments using Gemini's streaming generation.
+    Each element of agent_outputs is a dict: {"agent": name, "content": text}
+    If given, context_stats is filled with the prompt's context packing stats
+    and llm_info with the gateway's call info.
+    """
+    prompt, combined_text, stats = _synthesis_prompt(agent_outputs)
+    if context_stats is not None:
+        context_stats.update(stats)
     try:
-        # Use the LAZY-LOADED model
-        model = get_synthesis_model() 
-        response = await model.generate_content_async(prompt)
-        return response.text.strip()
+        async for text in llm_gateway.generate_stream(prompt, caller="synthesis", info=llm_info):
+            yield text
     except Exception as e:
-        return f"(Summarization failed: {e})\n\n" + combined_text
+        yield f"(Summarization failed: {e})\n\n" + combined_text
+
+
+async def synthesize_answer(agent_outputs: list):
+    """
+    Combine multiple agent responses into a single summarized answer.
+    Each element of agent_outputs is a dict: {"agent": name, "content": text}
+    """
+    parts = [part async for part in synthesize_answer_stream(agent_outputs)]
+    return "".join(parts).strip()
+
+# ---------- Agent fan-out ----------
+
+# Agents are imported on first use (agents/registry.py), not when the controller is.
+
+async def _run_agent(agent: str, query: str):
+    """
+    Runs a single agent under its registry limits (concurrency, timeout, retries, circuit breaker).
+    Never raises: failures and timeouts are reported in the returned dict
+    so one bad agent cannot take down the whole fan-out.
+    """
+    timeout = AGENT_SPECS[agent].timeout
+    start = time.perf_counter()
+    context = llm = None
+    with metrics.span(f"agent.{agent}") as span:
+        try:
+            handler, result = await call_agent(agent, query)
+            if isinstance(result, dict) and "summary" in result:
+                resp, raw = result["summary"], handler.trace_entry(result)
+                context, llm = result.get("context"), result.get("llm")
+            else:
+                resp, raw = str(result), None
+            status = "error" if isinstance(result, dict) and result.get("error") else "ok"
+        except AgentUnavailable as e:
+            resp, raw = f"({e})", None
+            status = "rejected"
+        except asyncio.TimeoutError:
+            resp, raw = f"({agent} timed out after {timeout:.0f}s)", None
+            status = "timeout"
+        except Exception as e:
+            resp, raw = f"({agent} failed: {type(e).__name__}: {e})", None
+            status = "error"
+        span.update(status=status, response_chars=len(resp))
+    metrics.AGENT_SECONDS.observe(time.perf_counter() - start, agent=agent, status=status)
+
+    return {
+        "agent": agent,
+        "content": resp,
+        "raw": raw,
+        "context": context,
+        "llm": llm,
+        "status": status,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
 
 # ---------- Main routing orchestrator ----------
 
-async def route_query(query: str):
+async def route_query(query: str, profile: bool = False):
+    """Runs the full pipeline and returns (final_answer, log_entry)."""
+    async for event in route_query_events(query, profile):
+        if event["type"] == "final":
+            return event["response"], event["logs"]
+
+
+async def route_query_events(query: str, profile: bool = False):
+    """
+    The routing pipeline as a stream of events, so /ask/stream can forward progress:
+      {"type": "routing", ...}  as soon as the agents are chosen (or a cache hit is found)
+      {"type": "agent", ...}    as each agent finishes, in completion order
+      {"type": "token", "text"} fragments of the final answer (streamed synthesis)
+      {"type": "final", "response", "logs"} last, with the complete trace entry
+    Stage timings are stored in the trace entry under "spans"; with `profile`
+    the request also runs under the sampling profiler (summary under "profile").
+    """
+    trace = metrics.start_trace()
+    profiler = metrics.SamplingProfiler() if profile else None
+    if profiler is not None and not profiler.start():
+        profiler = False  # another request is being profiled
+    try:
+        async for event in _pipeline_events(query, trace, profiler):
+            yield event
+    finally:
+        if profiler:
+            profiler.stop()  # no-op unless the client went away before the final event
+
+
+async def _pipeline_events(query: str, trace, profiler):
     log_entry = {
         "timestamp": str(datetime.datetime.now()),
         "query": query,
@@ -134,58 +222,159 @@ async def route_query(query: str):
         "agents_used": [],
         "reason": "",
         "retrieved_docs": [],
+        "agent_timings": {},
+        "cache": {"hit": False},
+        "context": {},
+        "llm": {},
         "final_answer": ""
     }
 
-    decision = await llm_decide(query)
-    agents_used = decision.get("agents_used", [])
-    log_entry["decision"] = "LLM decision"
+    if RESPONSE_CACHE_ENABLED or ROUTER_ENABLED:
+        with metrics.span("cache_context"):
+            query_emb = await run_blocking(embed_query, query)
+
+    # Agents whose circuit breaker is open are left out until they recover.
+    available = available_agents()
+    log_entry["agents_available"] = available
+    generation = None
+
+    # Semantic answer cache: a close enough earlier question skips routing, agents and synthesis.
+    # Answers are only reused under the same set of available agents.
+    if RESPONSE_CACHE_ENABLED:
+        cached, similarity = await run_blocking(RESPONSE_CACHE.lookup, query_emb, available, _index_generation)
+        metrics.cache_event("responses", cached is not None)
+        if cached is not None:
+            log_entry["decision"] = "Response cache"
+            log_entry["agents_used"] = list(cached["agents"])
+            log_entry["reason"] = f"Answer reused from a similar earlier query (cosine {similarity:.3f})."
+            log_entry["cache"] = {"hit": True, "similarity": round(similarity, 4), "matched_query": cached["query"]}
+            log_entry["final_answer"] = cached["final_answer"]
+            _finish_trace(log_entry, trace, profiler)
+            save_log(log_entry)
+            yield _routing_event(log_entry)
+            yield {"type": "token", "text": cached["final_answer"]}
+            yield {"type": "final", "response": cached["final_answer"], "logs": log_entry}
+            return
+        log_entry["cache"]["best_similarity"] = round(similarity, 4)
+
+    # Local pre-router first; the Gemini routing call only runs when it is unsure.
+    decision = None
+    if ROUTER_ENABLED:
+        with metrics.span("route.local") as span:
+            router = await run_blocking(ensure_trained, TRACE_STORE)
+            details, confident = router.route(query_emb)
+            span["bypassed_llm"] = confident
+        log_entry["router"] = {**details, "bypassed_llm": confident}
+        if confident:
+            decision = {
+                "agents_used": details["agents"],
+                "reason": f"Local pre-router (confidence {details['confidence']:.2f}).",
+            }
+            log_entry["decision"] = "Local router"
+
+    if decision is None:
+        with metrics.span("route.llm"):
+            decision = await llm_decide(query, available)
+        log_entry["decision"] = "LLM decision"
+        log_entry["llm"]["routing"] = decision.pop("llm", None)
+        # Every successful LLM decision becomes a new router example (unless agents were withheld from it).
+        if ROUTER_ENABLED and not decision.get("fallback") and len(available) == len(AGENT_SPECS):
+            router.add_embedded([(query_emb, decision.get("agents_used", []), query)])
+
+    agents_used = [a for a in decision.get("agents_used", []) if a in available]
+    skipped = [a for a in decision.get("agents_used", []) if a in AGENT_SPECS and a not in available]
+    if skipped:
+        log_entry["agents_skipped"] = skipped
+        if not agents_used and available:
+            agents_used = ["Web_Search" if "Web_Search" in available else available[0]]
     log_entry["agents_used"] = agents_used
     log_entry["reason"] = decision.get("reason", "")
+    yield _routing_event(log_entry)
+
+    # Only PDF answers are tied to an index generation; taken before the agents run.
+    if RESPONSE_CACHE_ENABLED and GENERATION_SCOPED_AGENTS & set(agents_used):
+        generation = await run_blocking(_index_generation)
 
     agent_outputs = []
 
-    for agent in agents_used:
-        # NOTE: Agent calls are synchronous, so they are NOT awaited
-        if agent == "PDF_RAG":
-            result = pdf_agent.handle_pdf_query(query)
-            # PDF_RAG now returns a dict
-            if isinstance(result, dict) and "summary" in result:
-                resp = result["summary"]
-                # Log raw chunks from the PDF agent
-                log_entry["retrieved_docs"].append({"PDF_RAG_Raw": "\n\n".join(result.get("raw_results", []))})
-            else:
-                resp = str(result)
+    # Fan out: every known agent runs concurrently, so latency tracks the slowest one.
+    selected = list(agents_used)
+    tasks = [asyncio.ensure_future(_run_agent(agent, query)) for agent in selected]
+    for next_done in asyncio.as_completed(tasks):
+        result = await next_done
+        yield {"type": "agent", "agent": result["agent"], "status": result["status"], "seconds": result["seconds"]}
 
-        elif agent == "Web_Search":
-            result = web_agent.handle_web_query(query)
-            if isinstance(result, dict) and "summary" in result:
-                resp = result["summary"]
-                # Log raw search bodies
-                log_entry["retrieved_docs"].append({"Web_Search_Raw": "\n\n".join([r.get("body", "N/A") for r in result.get("raw_results", [])])})
-            else:
-                resp = str(result)
+    # Results are merged in routing order, not completion order.
+    for result in (task.result() for task in tasks):
+        agent = result["agent"]
+        log_entry["agent_timings"][agent] = {"seconds": result["seconds"], "status": result["status"]}
+        if result["context"] is not None:
+            log_entry["context"][agent] = result["context"]
+        if result["llm"]:
+            log_entry["llm"][agent] = result["llm"]
+        if result["raw"] is not None:
+            log_entry["retrieved_docs"].append(result["raw"])
 
-        elif agent == "Arxiv_Search":
-            result = arxiv_agent.handle_arxiv_query(query)
-            if isinstance(result, dict) and "summary" in result:
-                resp = result["summary"]
-                # Log Arxiv titles
-                log_entry["retrieved_docs"].append({"Arxiv_Search_Titles": "\n\n".join([f"Title: {r['title']}" for r in result.get("papers", [])])})
-            else:
-                resp = str(result)
-        else:
-            continue
-            
+        resp = result["content"]
         agent_outputs.append({"agent": agent, "content": resp})
         log_entry["retrieved_docs"].append({agent: resp[:500]}) # sample snippet
 
     # Synthesize if multiple agents used
     if len(agent_outputs) > 1:
-        final_answer = await synthesize_answer(agent_outputs)
+        parts = []
+        synthesis_context, synthesis_llm = {}, {}
+        start = time.perf_counter()
+        async for part in synthesize_answer_stream(agent_outputs, synthesis_context, synthesis_llm):
+            parts.append(part)
+            yield {"type": "token", "text": part}
+        final_answer = "".join(parts).strip()
+        # Recorded, not a span: the stream yields to the client in between
+        metrics.record("synthesis", time.perf_counter() - start, agents=len(agent_outputs), response_chars=len(final_answer))
+        log_entry["context"]["synthesis"] = synthesis_context
+        log_entry["llm"]["synthesis"] = synthesis_llm
     else:
         final_answer = agent_outputs[0]["content"] if agent_outputs else "(No response)"
+        yield {"type": "token", "text": final_answer}
 
     log_entry["final_answer"] = final_answer
+    log_entry["context"]["tokens_saved"] = total_saved(log_entry["context"])
+
+    # Only complete, successful answers are worth reusing.
+    if RESPONSE_CACHE_ENABLED and agent_outputs and _is_cacheable(log_entry, agent_outputs):
+        RESPONSE_CACHE.store(query, query_emb, [o["agent"] for o in agent_outputs], available, generation, final_answer)
+
+    _finish_trace(log_entry, trace, profiler)
     save_log(log_entry)
-    return final_answer, log_entry
\ No newline at end of file
+    yield {"type": "final", "response": final_answer, "logs": log_entry}
+
+
+def _finish_trace(log_entry: dict, trace, profiler):
+    """Adds the request's spans (and profile) to the trace entry."""
+    metrics.record("request", time.perf_counter() - trace.start, cache_hit=log_entry["cache"]["hit"])
+    log_entry["spans"] = metrics.spans(trace)
+    if profiler:
+        log_entry["profile"] = profiler.stop()
+    elif profiler is False:
+        log_entry["profile"] = {"skipped": "another request is being profiled"}
+
+
+def _routing_event(log_entry: dict):
+    return {
+        "type": "routing",
+        "decision": log_entry["decision"],
+        "agents_used": log_entry["agents_used"],
+        "reason": log_entry["reason"],
+        "cache_hit": log_entry["cache"]["hit"],
+    }
+
+
+def _index_generation():
+    """Current PDF index generation: cached PDF_RAG answers are only valid within one."""
+    return get_index_handle().generation
+
+
+def _is_cacheable(log_entry: dict, agent_outputs: list):
+    if any(t["status"] != "ok" for t in log_entry["agent_timings"].values()):
+        return False
+    texts = [log_entry["final_answer"]] + [o["content"] for o in agent_outputs]
+    return not any("summarization failed" in text.lower() for text in texts)
\ No newline at end of file
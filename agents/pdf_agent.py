@@ -1,143 +1,415 @@
-import fitz # PyMuPDF
 import numpy as np
-import os, pickle
+import os, json, fcntl, hashlib, threading, time, asyncio
+from contextlib import contextmanager
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import faiss
 # Remove the global imports for genai, SentenceTransformer, and the models
 
 # --- New Import for Lazy Loading (ABSOLUTE IMPORT) ---
-from rag_state import get_embedding_model, get_synthesis_model, load_faiss_index_data
+from rag_state import get_index_handle, publish_index
 # --- End New Import ---
+from agents.base import Agent, run_blocking
+import llm_gateway
+from embedding_cache import (
+    encode_cached, embed_query, normalize_query, new_stats,
+    QUERY_EMBEDDING_CACHE, QUERY_CACHE_TTL_SECONDS, QUERY_CACHE_MAX_BYTES,
+)
+from cache_utils import TTLLRUCache
+from chunk_store import open_chunk_store
+from agents import reranker
+from agents.context_packer import Passage, pack, CONTEXT_BUDGETS
+import metrics
+from vector_index import (
+    build_index, remove_ids, maybe_rebuild, index_metadata, normalize_for, read_index, writable_copy,
+)
 
-# --- Advanced Chunking ---
-from langchain_text_splitters import RecursiveCharacterTextSplitter 
+# --- Advanced Chunking (kept in a light module so parse workers don't import torch/FAISS) ---
+from agents.pdf_parsing import page_count, parse_and_chunk_range
 
 # Vector Store/DB parameters
 DB_PATH = "pdf_store"
 
-# --- RAG/Chunking Parameters ---
-CHUNK_SIZE = 1000 
-CHUNK_OVERLAP = 200 
-SPLITTER_SEPARATORS = ["\n\n", "\n", " ", ""]
+# --- Streaming Ingestion Parameters ---
+PAGE_RANGE_SIZE = int(os.getenv("PDF_PAGE_RANGE_SIZE", "32"))     # pages parsed per worker task
+PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+EMBED_BATCH_SIZE = int(os.getenv("PDF_EMBED_BATCH_SIZE", "256"))  # chunks per encode() call
+
+_PARSE_POOL = None
+_PARSE_POOL_LOCK = threading.Lock()
+
+# --- Retrieval Cache (in-process; query embeddings are cached in embedding_cache) ---
+RETRIEVAL_CACHE = TTLLRUCache("retrieval", QUERY_CACHE_MAX_BYTES, QUERY_CACHE_TTL_SECONDS)
+
+# --- Hybrid Retrieval Parameters ---
+RETRIEVAL_MODE = os.getenv("PDF_RETRIEVAL_MODE", "hybrid")  # hybrid, vector or bm25
+TOP_K = int(os.getenv("PDF_TOP_K", "5"))                    # chunks passed to the LLM
+VECTOR_K = int(os.getenv("PDF_VECTOR_K", "20"))             # candidates from FAISS (hybrid)
+BM25_K = int(os.getenv("PDF_BM25_K", "20"))                 # candidates from the keyword index (hybrid)
+RRF_K = int(os.getenv("PDF_RRF_K", "60"))                   # reciprocal rank fusion damping constant
+
+# Serializes writers (ingest/delete), across threads and across uvicorn workers
+# (see _write_lock). Readers never take it: they search whatever generation is
+# current when their query starts.
+_WRITE_LOCK = threading.Lock()
+WRITE_LOCK_FILE = "write.lock"
 
 
 # ---------- Ingestion Pipeline (The New Logic) ----------
 
+# Stage names reported to the optional `progress(stage, status, seconds)` callback.
+INGEST_STAGES = ["parsing", "chunking", "embedding", "indexing"]
+
+
 def ingest_pdf(file_path: str):
+    """Synchronously ingests a single PDF (see ingest_pdfs)."""
+    return ingest_pdfs([file_path])
+
+
+def ingest_pdfs(file_paths: list, progress=None):
     """
-    Handles the entire PDF ingestion pipeline:
+    Handles the entire PDF ingestion pipeline incrementally for one or more files:
     1. Extracts text page-by-page, with metadata.
     2. Chunks the text using recursive splitting.
-    3. Embeds all chunks.
-    4. Builds and saves the FAISS index and the associated data/metadata.
+    3. Embeds the new documents' chunks in one shared batch.
+    4. Appends them to the existing FAISS index / data store under stable IDs,
+       replacing any previous version of the same file (by name or content hash).
     """
-    
-    # 1. Process and Chunk
-    print(f"Starting ingestion for {file_path}...")
-    chunk_data_list = _process_pdf_and_chunk(file_path)
-    if not chunk_data_list:
+    prepared = prepare_documents(file_paths, progress)
+    if not prepared["docs"]:
         print("Ingestion failed or no text found.")
+        return None
+    result = index_documents(prepared["docs"], prepared["embeddings"], progress)
+    result["embedding_cache"] = prepared["embedding_cache"]
+    return result
+
+
+def prepare_documents(file_paths: list, progress=None):
+    """
+    CPU-heavy half of ingestion (parse, chunk, embed). Has no side effects on the
+    store, so it can run in a worker process; index_documents does the rest.
+
+    Pages are parsed and chunked in parallel worker processes, PAGE_RANGE_SIZE pages
+    at a time, and the resulting chunks are streamed into the embedder in batches of
+    EMBED_BATCH_SIZE, so parsing of later pages overlaps with embedding of earlier
+    ones and only a bounded window of unembedded text is held at once.
+    Returns {"docs": [{source, content_hash, chunks, metadata}], "embeddings": ndarray,
+             "embedding_cache": {hits, misses, hit_rate, seconds_saved}}.
+    """
+    print(f"Starting ingestion for {', '.join(file_paths)}...")
+    for stage in ("parsing", "chunking", "embedding"):
+        _report(progress, stage, "running")
+
+    timings = {"parsing": 0.0, "chunking": 0.0, "embedding": 0.0}
+    cache_stats = new_stats()
+    docs = []
+    embedding_batches = []
+    pending = []  # (doc, chunk_data) not yet embedded; at most one batch
+
+    def flush():
+        start = time.perf_counter()
+        # Cached chunks skip the model entirely (USES LAZY-LOADED MODEL only on misses)
+        vectors = encode_cached([chunk_data["text"] for _, chunk_data in pending], cache_stats)
+        embedding_batches.append(vectors)
+        timings["embedding"] += time.perf_counter() - start
+        for doc, chunk_data in pending:
+            doc["chunks"].append(chunk_data["text"])
+            doc["metadata"].append(chunk_data["metadata"])
+        pending.clear()
+
+    for file_path in file_paths:
+        doc = {
+            "source": os.path.basename(file_path),
+            "content_hash": _file_hash(file_path),
+            "chunks": [],
+            "metadata": [],
+        }
+        for chunk_data in iter_document_chunks(file_path, timings):
+            pending.append((doc, chunk_data))
+            if len(pending) >= EMBED_BATCH_SIZE:
+                flush()
+        docs.append(doc)
+
+    if pending:
+        flush()
+
+    # Stages overlap, so each reports the time spent in it (summed across workers).
+    for stage in ("parsing", "chunking", "embedding"):
+        _report(progress, stage, "done", timings[stage])
+
+    docs = [doc for doc in docs if doc["chunks"]]
+    embeddings = np.concatenate(embedding_batches) if embedding_batches else None
+    if docs:
+        print(f"Generated embeddings for {len(embeddings)} chunks "
+              f"(cache hit rate {cache_stats['hit_rate']:.0%}, ~{cache_stats['seconds_saved']}s saved).")
+    return {"docs": docs, "embeddings": embeddings, "embedding_cache": cache_stats}
+
+
+def iter_document_chunks(file_path: str, timings: dict = None):
+    """
+    Generator over a PDF's chunk dicts in page order. Page ranges are parsed and
+    chunked in the parse process pool with a bounded number of ranges in flight;
+    small documents are handled inline to avoid the process round trip.
+    """
+    n_pages = page_count(file_path)
+    if not n_pages:
         return
-        
-    # 2. Separate Data for Embedding and Saving
-    chunks = [d["text"] for d in chunk_data_list]
-    metadata = [d["metadata"] for d in chunk_data_list]
-
-    # 3. Generate Embeddings (USES LAZY-LOADED MODEL)
-    print(f"Generating embeddings for {len(chunks)} chunks...")
-    embedding_model = get_embedding_model() # <--- LAZY LOAD CALL
-    embeddings = embedding_model.encode(chunks)
-    
-    # 4. Build and Save FAISS Index and Data
-    _build_and_save_index(chunks, metadata, embeddings)
-    print(f"Ingestion complete. Index saved to {DB_PATH}.")
 
+    ranges = [(start, min(start + PAGE_RANGE_SIZE, n_pages)) for start in range(0, n_pages, PAGE_RANGE_SIZE)]
 
-def _process_pdf_and_chunk(file_path: str):
-    """Internal function to handle PDF parsing and advanced chunking with metadata."""
+    if len(ranges) == 1 or PARSE_WORKERS <= 1:
+        results = (parse_and_chunk_range(file_path, start, end) for start, end in ranges)
+        for chunk_data_list, range_timings in results:
+            _add_timings(timings, range_timings)
+            yield from chunk_data_list
+        return
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=SPLITTER_SEPARATORS,
-        length_function=len
-    )
-    
-    final_chunks_data = []
-    
-    try:
-        doc = fitz.open(file_path)
-    except Exception as e:
-        print(f"Error opening PDF: {e}")
-        return []
+    pool = _get_parse_pool()
+    window = PARSE_WORKERS * 2
+    futures = deque()
+    next_range = 0
+    while next_range < len(ranges) or futures:
+        try:
+            while next_range < len(ranges) and len(futures) < window:
+                start, end = ranges[next_range]
+                futures.append(pool.submit(parse_and_chunk_range, file_path, start, end))
+                next_range += 1
+            chunk_data_list, range_timings = futures.popleft().result()
+        except BrokenProcessPool:
+            # A parser process died (OOM, crash in fitz); this document fails, the next one gets a new pool.
+            _replace_broken_parse_pool(pool)
+            raise
+        _add_timings(timings, range_timings)
+        yield from chunk_data_list
 
-    file_name = os.path.basename(file_path)
-    
-    for page_num, page in enumerate(doc):
-        page_text = page.get_text()
-        chunks = splitter.split_text(page_text)
-        
-        # Attach Metadata to each chunk
-        for i, chunk in enumerate(chunks):
-            chunk_data = {
-                "text": chunk,
-                "metadata": {
-                    "source": file_name,
-                    "page_number": page_num + 1,
-                    "chunk_id": f"{file_name}_{page_num+1}_{i}",
-                }
-            }
-            final_chunks_data.append(chunk_data)
-            
-    return final_chunks_data
-
-
-def _build_and_save_index(chunks: list, metadata: list, embeddings: np.ndarray):
-    """Internal function to build FAISS index and save the chunks + metadata."""
-    
+
+def index_documents(docs: list, embeddings: np.ndarray, progress=None):
+    """
+    Appends prepared documents to the store and publishes a new index generation.
+    Must run in the serving process so the in-memory generation is updated.
+    """
+    _report(progress, "indexing", "running")
+    start = time.perf_counter()
+    added = 0
+    stale_ids = []
+    with _write_lock():
+        chunk_store = open_chunk_store(DB_PATH)
+        index = _writable_index()
+        if index is None:
+            index = _new_index(embeddings.shape[1])
+
+        offset = 0
+        replaced = set()
+        for doc in docs:
+            n = len(doc["chunks"])
+            sources = _sources_to_replace(chunk_store, doc["source"], doc["content_hash"])
+            index, removed_ids = _remove_sources(index, chunk_store, sources, stale_ids)
+            _add_chunks(index, chunk_store, doc["source"], doc["content_hash"], doc["chunks"], doc["metadata"], embeddings[offset:offset + n])
+            offset += n
+            added += n
+            stale_ids.extend(removed_ids)
+            replaced.update(sources)
+            replaced.discard(doc["source"])
+
+        # Switches to the configured ANN index once the corpus is large enough.
+        index, rebuilt = maybe_rebuild(index)
+        index = _save_store(index)
+        handle = publish_index(index, chunk_store, DB_PATH, time.perf_counter() - start)
+        # Only now that the new index is saved and no new query can see the old vectors
+        # are their rows dropped (and replaced documents that were not re-added forgotten).
+        chunk_store.delete_chunks(stale_ids, sorted(replaced))
+    _report(progress, "indexing", "done", time.perf_counter() - start)
+
+    print(f"Ingestion complete ({added} chunks added, {len(stale_ids)} replaced). Index saved to {DB_PATH}.")
+    return {
+        "documents": [doc["source"] for doc in docs],
+        "chunks_added": added,
+        "chunks_replaced": len(stale_ids),
+        "generation": handle.generation,
+        "index": index_metadata(index),
+        "index_rebuilt": rebuilt,
+    }
+
+
+def delete_source(source: str):
+    """Removes every chunk of one ingested document. Returns the number of chunks removed."""
+    with _write_lock():
+        start = time.perf_counter()
+        chunk_store = open_chunk_store(DB_PATH)
+        index = _writable_index()
+        if index is None or source not in chunk_store.sources():
+            return 0
+        index, removed_ids = _remove_sources(index, chunk_store, [source])
+        index = _save_store(index)
+        publish_index(index, chunk_store, DB_PATH, time.perf_counter() - start)
+        chunk_store.delete_chunks(removed_ids, [source])
+    print(f"Removed {len(removed_ids)} chunks of {source} from {DB_PATH}.")
+    return len(removed_ids)
+
+
+@contextmanager
+def _write_lock():
+    """
+    Holds the writer lock for one read-modify-publish of the store: a thread lock for
+    this process plus an flock on pdf_store/write.lock, so two workers ingesting at
+    once don't both build on generation N and overwrite each other's index.faiss.
+    """
+    with _WRITE_LOCK:
+        os.makedirs(DB_PATH, exist_ok=True)
+        with open(os.path.join(DB_PATH, WRITE_LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _report(progress, stage: str, status: str, seconds: float = None):
+    if progress is not None:
+        progress(stage, status, None if seconds is None else round(seconds, 4))
+
+
+def _add_timings(timings, extra: dict):
+    if timings is not None:
+        for stage, seconds in extra.items():
+            timings[stage] += seconds
+
+
+def _get_parse_pool():
+    """Process pool for page-range parsing, created once per process (and again if it breaks)."""
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None:
+            _PARSE_POOL = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _PARSE_POOL
+
+
+def _replace_broken_parse_pool(broken):
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _PARSE_POOL = None
+    print("--- INGEST: A parser process died; replacing the parse pool. ---")
+
+
+# ---------- Incremental Store Helpers ----------
+
+def _file_hash(file_path: str):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _writable_index():
+    """
+    Copy-on-write: returns a private copy of the current generation's index that can
+    be modified and then published without disturbing readers (None if there is none).
+    Old positional flat indexes are wrapped with their implicit IDs on the way.
+    """
+    # Always compare against the file, in case another process wrote it very recently.
+    handle = get_index_handle(DB_PATH, force_check=True)
+    if handle.index is None:
+        return None
+
+    index = writable_copy(handle.index, f"{DB_PATH}/index.faiss")
+    if isinstance(faiss.downcast_index(index), faiss.IndexFlat):
+        return _upgrade_legacy_index(index)
+    return index
+
+
+def _upgrade_legacy_index(index):
+    """Wraps a positional IndexFlatL2 into an IndexIDMap; the chunk store imported positions as IDs."""
+    n = index.ntotal
+    new_index = faiss.IndexIDMap(faiss.IndexFlatL2(index.d))
+    if n:
+        new_index.add_with_ids(index.reconstruct_n(0, n), np.arange(n, dtype="int64"))
+    return new_index
+
+
+def _sources_to_replace(chunk_store, source: str, content_hash: str):
+    """A re-upload replaces the document with the same name and any copy with identical content."""
+    return [
+        name for name, entry in chunk_store.sources().items()
+        if name == source or entry.get("content_hash") == content_hash
+    ]
+
+
+def _remove_sources(index, chunk_store, sources: list, already_removed=()):
+    """
+    Drops the vectors of `sources`. Their chunk rows and source entries stay until
+    the caller has saved and published the new generation (see delete_chunks), so a
+    crash before that leaves the store pointing at vectors that are still on disk.
+    Returns (index, removed_ids); the index may be a new object (HNSW is rebuilt).
+    """
+    skip = set(already_removed)
+    ids = [i for i in chunk_store.source_ids(sources) if i not in skip]
+    if not ids:
+        return index, []
+    return remove_ids(index, np.array(ids, dtype="int64")), ids
+
+
+def _add_chunks(index, chunk_store, source: str, content_hash: str, chunks: list, metadata: list, embeddings: np.ndarray):
+    """Appends one document's chunks under fresh, never-reused integer IDs."""
+    ids = np.array(chunk_store.add_document(source, content_hash, chunks, metadata), dtype="int64")
+    index.add_with_ids(normalize_for(index, embeddings), ids)
+
+
+def _new_index(dim: int):
+    # Starts flat; maybe_rebuild switches type once there are enough vectors to train on.
+    return build_index("flat", np.zeros((0, dim), dtype="float32"), np.zeros(0, dtype="int64"))
+
+
+def _save_store(index):
+    """
+    Writes the index and its metadata atomically (temp file + rename); chunk rows are
+    already in the chunk store. Returns the index to publish: the saved file re-opened
+    (memory-mapped when enabled), so this process shares its pages with the other workers.
+    """
     os.makedirs(DB_PATH, exist_ok=True)
-    
-    # Save the index
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-    faiss.write_index(index, f"{DB_PATH}/index.faiss")
-    
-    # Save the ENTIRE data structure (chunks and metadata)
-    data_to_save = {"chunks": chunks, "metadata": metadata}
-    pickle.dump(data_to_save, open(f"{DB_PATH}/data.pkl", "wb"))
+
+    index_file = f"{DB_PATH}/index.faiss"
+    meta_file = f"{DB_PATH}/index_meta.json"
+    faiss.write_index(index, index_file + ".tmp")
+    with open(meta_file + ".tmp", "w") as f:
+        json.dump(index_metadata(index), f, indent=2)
+    os.replace(meta_file + ".tmp", meta_file)
+    os.replace(index_file + ".tmp", index_file)
+    return read_index(index_file)
 
 
 # ---------- Agent Query Entry Point (for controller.py) ----------
 
-def handle_pdf_query(query: str):
+async def handle_pdf_query(query: str):
     """Performs RAG: Retrieves context including full metadata, and synthesizes an answer."""
     
-    # Use the lazy loader to get the index and data (which handles the os.path.exists checks internally)
-    index, data_store = load_faiss_index_data(DB_PATH) # <--- LAZY LOAD CALL
+    # Pin the current index generation for the whole query (lazy-loaded on first use);
+    # a concurrent ingestion publishes a new generation without affecting this search.
+    handle = await run_blocking(get_index_handle, DB_PATH) # <--- LAZY LOAD CALL
     
-    if index is None or data_store is None:
+    if handle.index is None or handle.chunk_store is None:
         return {"summary": "No PDF ingested yet. Upload one first.", "raw_results": []} 
-        
-    all_chunks = data_store["chunks"]
-    all_metadata = data_store["metadata"] 
-    
-    # Encode the query (USES LAZY-LOADED MODEL)
-    embedding_model = get_embedding_model() # <--- LAZY LOAD CALL
-    query_emb = embedding_model.encode([query]) 
     
-    # Retrieval step (k=5)
-    D, I = index.search(query_emb, 5) 
+    # Vector and keyword retrieval run concurrently off the event loop; only the top-k rows are read
+    with metrics.span("pdf.retrieve", mode=RETRIEVAL_MODE) as span:
+        hits, rerank_info = await retrieve_context(handle, query)
+        span.update(chunks=len(hits), rerank=rerank_info["status"])
     
     retrieved_chunks_with_meta = []
-    combined_context = ""
+    passages = []
 
-    for chunk_index in I[0]:
-        chunk = all_chunks[chunk_index]
-        meta = all_metadata[chunk_index]
-        
-        # Format the context for the LLM to include the source citation
+    for chunk_id, chunk, meta in hits:
+        # Format the context for the LLM to include the source citation. Chunk IDs are
+        # assigned in document order, so consecutive IDs on one page are adjacent chunks.
         context_citation = f"[Source: {meta['source']}, Page: {meta['page_number']}]"
-        combined_context += f"{context_citation} {chunk}\n\n"
+        passages.append(Passage(chunk, f"{context_citation} ", (meta['source'], meta['page_number']), chunk_id))
         
         # Store for the 'raw_results' return
         retrieved_chunks_with_meta.append({
@@ -146,6 +418,9 @@ def handle_pdf_query(query: str):
             "page": meta['page_number']
         })
 
+    # Overlapping neighbours are merged, near-duplicates dropped, and the rest fitted to the budget
+    combined_context, context_stats = pack(passages, CONTEXT_BUDGETS["PDF_RAG"])
+
     # --- LLM Synthesis Step (USES LAZY-LOADED MODEL) ---
     prompt = f"""
     You are an expert document summarizer. Your task is to provide a concise and factual answer to the question based ONLY on the context provided below.
@@ -160,10 +435,10 @@ def handle_pdf_query(query: str):
     ---
     """
     
+    llm_info = {}
     try:
-        synthesis_model = get_synthesis_model() # <--- LAZY LOAD CALL
-        response = synthesis_model.generate_content(prompt)
-        summary = response.text.strip()
+        # Rate-limited, retried and coalesced by the LLM gateway
+        summary = (await llm_gateway.generate(prompt, caller="PDF_RAG", info=llm_info)).strip()
     except Exception as e:
         summary = f"**Summarization failed:** {e}. Raw context returned:\n\n{combined_context}"
         
@@ -174,5 +449,108 @@ def handle_pdf_query(query: str):
 
     return {
         "summary": summary,
-        "raw_results": final_raw_results
-    }
\ No newline at end of file
+        "raw_results": final_raw_results,
+        "retrieval": {"rerank": rerank_info, "chunks": len(hits), "context_chars": len(combined_context)},
+        "context": context_stats,
+        "llm": llm_info,
+    }
+
+
+async def retrieve_context(handle, query: str, rerank: bool = None):
+    """
+    The chunks that go into the prompt: top TOP_K of retrieve(), or, with the rerank
+    stage on, the best RERANK_TOP_N of RERANK_CANDIDATES by cross-encoder score.
+    Returns (rows, rerank_info).
+    """
+    if not (reranker.RERANK_ENABLED if rerank is None else rerank):
+        return await retrieve(handle, query), {"status": "disabled"}
+    candidates = await retrieve(handle, query, k=reranker.RERANK_CANDIDATES)
+    with metrics.span("pdf.rerank", candidates=len(candidates)) as span:
+        rows, info = await reranker.rerank(query, candidates, reranker.RERANK_TOP_N)
+        span.update(status=info["status"], cached=info.get("cached", 0))
+    return rows, info
+
+
+async def retrieve(handle, query: str, k: int = TOP_K, mode: str = RETRIEVAL_MODE):
+    """
+    Returns [(id, text, metadata)] of the top-k chunks of a pinned generation.
+    In hybrid mode FAISS and the BM25 keyword index are searched concurrently
+    (VECTOR_K / BM25_K candidates each) and merged with reciprocal rank fusion.
+    """
+    searches = []
+    if mode in ("vector", "hybrid"):
+        searches.append(run_blocking(_vector_search, handle, query, max(VECTOR_K, k) if mode == "hybrid" else k))
+    if mode in ("bm25", "hybrid"):
+        searches.append(run_blocking(_keyword_search, handle, query, max(BM25_K, k) if mode == "hybrid" else k))
+    rankings = await asyncio.gather(*searches)
+
+    ids = reciprocal_rank_fusion(rankings, RRF_K)[:k]
+    with metrics.span("pdf.fetch_rows", rows=len(ids)):
+        rows = await run_blocking(handle.chunk_store.get_many, ids)
+    # Rows of a document replaced since this generation was pinned may be gone.
+    return [(i, *rows[i]) for i in ids if i in rows]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K):
+    """Merges ranked ID lists: each ID scores sum(1 / (k + rank)); ties keep first-seen order."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _search_index(handle, query: str, k: int):
+    """
+    Blocking part of vector retrieval: query encoding + FAISS search, both cached.
+    Results are keyed on the index generation, so new ingestion invalidates them.
+    """
+    result_key = (normalize_query(query), handle.generation, k)
+    cached = RETRIEVAL_CACHE.get(result_key)
+    if cached is not None:
+        return cached
+
+    query_emb = embed_query(query) # in-process LRU, then disk cache, else LAZY-LOADED MODEL
+    result = handle.index.search(normalize_for(handle.index, query_emb), k)
+    RETRIEVAL_CACHE.put(result_key, result)
+    return result
+
+
+def _vector_search(handle, query: str, k: int):
+    with metrics.span("pdf.vector_search", k=k):
+        _, I = _search_index(handle, query, k)
+    return [int(i) for i in I[0] if i >= 0]  # -1 = fewer than k vectors in the index
+
+
+def _keyword_search(handle, query: str, k: int):
+    """BM25 over the chunk store's FTS index, cached per generation like vector results."""
+    result_key = ("bm25", normalize_query(query), handle.generation, k)
+    with metrics.span("pdf.bm25_search", k=k) as span:
+        cached = RETRIEVAL_CACHE.get(result_key)
+        span["cached"] = cached is not None
+        if cached is None:
+            cached = handle.chunk_store.keyword_search(query, k)
+            RETRIEVAL_CACHE.put(result_key, cached)
+    return cached
+
+
+def cache_stats():
+    return {
+        "query_embeddings": QUERY_EMBEDDING_CACHE.stats(),
+        "retrieval": RETRIEVAL_CACHE.stats(),
+        "rerank_scores": reranker.cache_stats(),
+    }
+
+
+class PDFAgent(Agent):
+    name = "PDF_RAG"
+
+    async def run(self, query: str) -> dict:
+        return await handle_pdf_query(query)
+
+    def trace_entry(self, result: dict):
+        # Log raw chunks from the PDF agent, plus rerank outcome and prompt context size
+        return {
+            "PDF_RAG_Raw": "\n\n".join(result.get("raw_results", [])),
+            "PDF_RAG_Retrieval": result.get("retrieval"),
+        }
@@ -0,0 +1,71 @@
+import os, time
+import fitz # PyMuPDF
+
+# --- Advanced Chunking ---
+from langchain_text_splitters import RecursiveCharacterTextSplitter 
+
+# PDF parsing and chunking. Deliberately free of torch/FAISS imports: these
+# functions run in spawned parse worker processes (see pdf_agent.iter_document_chunks).
+
+# --- RAG/Chunking Parameters ---
+CHUNK_SIZE = 1000 
+CHUNK_OVERLAP = 200 
+SPLITTER_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+_SPLITTER = None
+
+
+def page_count(file_path: str):
+    try:
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+    except Exception as e:
+        print(f"Error opening PDF: {e}")
+        return 0
+
+
+def _get_splitter():
+    """The splitter is stateless, so one instance per process is reused for every page."""
+    global _SPLITTER
+    if _SPLITTER is None:
+        _SPLITTER = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            separators=SPLITTER_SEPARATORS,
+            length_function=len
+        )
+    return _SPLITTER
+
+
+def parse_and_chunk_range(file_path: str, start: int, end: int):
+    """
+    Parses pages [start, end) and chunks them with metadata. Runs in a parse worker.
+    Returns (chunk_data_list, {"parsing": seconds, "chunking": seconds}).
+    """
+    file_name = os.path.basename(file_path)
+    splitter = _get_splitter()
+    parse_seconds = chunk_seconds = 0.0
+    final_chunks_data = []
+
+    with fitz.open(file_path) as doc:
+        for page_index in range(start, end):
+            t0 = time.perf_counter()
+            page_text = doc[page_index].get_text()
+            t1 = time.perf_counter()
+            chunks = splitter.split_text(page_text)
+            chunk_seconds += time.perf_counter() - t1
+            parse_seconds += t1 - t0
+
+            # Attach Metadata to each chunk
+            page_number = page_index + 1
+            for i, chunk in enumerate(chunks):
+                final_chunks_data.append({
+                    "text": chunk,
+                    "metadata": {
+                        "source": file_name,
+                        "page_number": page_number,
+                        "chunk_id": f"{file_name}_{page_number}_{i}",
+                    }
+                })
+
+    return final_chunks_data, {"parsing": parse_seconds, "chunking": chunk_seconds}
@@ -0,0 +1,291 @@
+import os, asyncio, importlib, threading, time
+from collections import namedtuple
+
+from agents.base import run_blocking
+
+# Agent registry.
+#
+# Each agent is declared by an AgentSpec: its import path, the capability text
+# the routing prompt shows Gemini, and its limits. Agents (and their heavy
+# dependencies: PyMuPDF, FAISS, torch, DuckDuckGo, arxiv, the Gemini SDK) are
+# imported the first time one is used or warmed, so importing the controller -
+# and starting the server or a CLI tool - stays cheap. Every agent implements the
+# async Agent protocol (agents/base.py).
+#
+# call_agent() runs an agent under its limits:
+#   - at most max_concurrency calls in flight; up to max_queue more wait for a
+#     slot, anything beyond that is rejected at once
+#   - one wall-clock timeout covering the queue wait and every attempt
+#   - failed attempts (exceptions, or a result carrying an "error") are retried
+#     `retries` times with exponential backoff; timeouts are not retried
+#   - a circuit breaker per agent: BREAKER_FAILURES consecutive failures open it,
+#     calls are rejected without touching the upstream for BREAKER_RESET_SECONDS,
+#     then a single probe call decides whether it closes again. The controller
+#     leaves agents with an open breaker out of routing decisions.
+#
+# Limits are set per agent from the environment, e.g. AGENT_TIMEOUT_WEB_SEARCH=15,
+# AGENT_MAX_CONCURRENCY_WEB_SEARCH=2, AGENT_MAX_QUEUE_WEB_SEARCH=4, AGENT_RETRIES_WEB_SEARCH=0.
+
+BREAKER_FAILURES = int(os.getenv("AGENT_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("AGENT_BREAKER_RESET_SECONDS", "30"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("AGENT_RETRY_BACKOFF_SECONDS", "0.5"))
+
+AgentSpec = namedtuple(
+    "AgentSpec",
+    ["name", "target", "capabilities", "max_concurrency", "max_queue", "timeout", "retries"],
+)
+
+
+def _spec(name: str, target: str, capabilities: str, timeout: float, max_concurrency: int, max_queue: int, retries: int):
+    env = name.upper()
+    return AgentSpec(
+        name=name,
+        target=target,
+        capabilities=capabilities,
+        max_concurrency=int(os.getenv(f"AGENT_MAX_CONCURRENCY_{env}", str(max_concurrency))),
+        max_queue=int(os.getenv(f"AGENT_MAX_QUEUE_{env}", str(max_queue))),
+        timeout=float(os.getenv(f"AGENT_TIMEOUT_{env}", str(timeout))),
+        retries=int(os.getenv(f"AGENT_RETRIES_{env}", str(retries))),
+    )
+
+
+AGENT_SPECS = {
+    spec.name: spec
+    for spec in (
+        _spec(
+            "PDF_RAG", "agents.pdf_agent:PDFAgent",
+            "Use this to summarize or extract information from uploaded internal documents (PDFs, reports, meeting notes, or any company-specific data).",
+            timeout=60, max_concurrency=8, max_queue=32, retries=0,
+        ),
+        _spec(
+            "Web_Search", "agents.web_agent:WebAgent",
+            "Use this to fetch external, general, or recent online information (news, public product details, generic topics).",
+            timeout=30, max_concurrency=4, max_queue=16, retries=1,
+        ),
+        _spec(
+            "Arxiv_Search", "agents.arxiv_agent:ArxivAgent",
+            "Use this specifically for queries about scientific papers, academic research, or topics related to ArXiv.",
+            timeout=30, max_concurrency=2, max_queue=8, retries=1,
+        ),
+    )
+}
+
+
+class AgentUnavailable(Exception):
+    """Raised by call_agent when a call is rejected without running the agent."""
+
+    def __init__(self, agent: str, reason: str):
+        super().__init__(f"{agent} unavailable: {reason}")
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half_open after `reset_seconds` (one probe)."""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probe_started = None  # a probe whose caller vanished (cancelled) expires after reset_seconds
+        self._lock = threading.Lock()
+
+    def _refresh(self, now):
+        if self.state == "open" and now - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            self._probe_started = None
+        elif self.state == "half_open" and self._probe_started is not None and now - self._probe_started >= self.reset_seconds:
+            self._probe_started = None
+
+    def available(self):
+        """True unless open (a half-open breaker has a probe to give)."""
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self.state == "closed" or (self.state == "half_open" and self._probe_started is None)
+
+    def allow(self):
+        """Claims permission for one call; in half_open only the first caller gets the probe."""
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and self._probe_started is None:
+                self._probe_started = now
+                return True
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.state, self.consecutive_failures, self._probe_started = "closed", 0, None
+                return
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failures:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state, self.opened_at, self._probe_started = "open", time.monotonic(), None
+
+    def stats(self):
+        with self._lock:
+            self._refresh(time.monotonic())
+            retry_in = None
+            if self.state == "open":
+                retry_in = round(max(self.reset_seconds - (time.monotonic() - self.opened_at), 0.0), 1)
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures,
+                    "times_opened": self.times_opened, "retry_in_seconds": retry_in}
+
+
+class _AgentRuntime:
+    """Limits and counters of one agent. The semaphore is bound to the running event loop."""
+
+    def __init__(self, spec: AgentSpec):
+        self.spec = spec
+        self.breaker = CircuitBreaker()
+        self.in_flight = 0
+        self.queued = 0
+        self.counts = {"calls": 0, "ok": 0, "errors": 0, "timeouts": 0, "retries": 0,
+                       "rejected_open": 0, "rejected_queue_full": 0, "rejected_queue_timeout": 0}
+        self._semaphore = None
+        self._loop = None
+
+    def semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore, self._loop = asyncio.Semaphore(self.spec.max_concurrency), loop
+        return self._semaphore
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "queued": self.queued, **self.counts, "breaker": self.breaker.stats()}
+
+
+_AGENTS = {}
+_IMPORT_SECONDS = {}
+_RUNTIMES = {name: _AgentRuntime(spec) for name, spec in AGENT_SPECS.items()}
+_LOCK = threading.Lock()
+
+
+def get_agent(name: str):
+    """Returns the agent instance for `name`, importing its module on first use. KeyError if unknown."""
+    agent = _AGENTS.get(name)
+    if agent is not None:
+        return agent
+    spec = AGENT_SPECS[name]
+    with _LOCK:
+        if name not in _AGENTS:
+            module_name, class_name = spec.target.split(":")
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            _AGENTS[name] = getattr(module, class_name)()
+            _IMPORT_SECONDS[name] = round(time.perf_counter() - start, 3)
+            print(f"--- REGISTRY: Loaded agent {name} in {_IMPORT_SECONDS[name]:.2f}s ---")
+        return _AGENTS[name]
+
+
+def load_all():
+    """Imports every agent (startup warm-up)."""
+    return [get_agent(name) for name in AGENT_SPECS]
+
+
+def loaded_agents():
+    """{name: import seconds} of the agents imported so far."""
+    return dict(_IMPORT_SECONDS)
+
+
+def available_agents():
+    """Names of the agents whose circuit breaker currently lets calls through, in declaration order."""
+    return [name for name, runtime in _RUNTIMES.items() if runtime.breaker.available()]
+
+
+async def call_agent(name: str, query: str):
+    """
+    Runs agent `name` under its concurrency limit, timeout, retry policy and
+    circuit breaker. Returns (agent, result). Raises AgentUnavailable when the
+    call is rejected, asyncio.TimeoutError, or the last attempt's exception.
+    """
+    runtime = _RUNTIMES[name]
+    spec = runtime.spec
+    deadline = time.monotonic() + spec.timeout
+    runtime.counts["calls"] += 1
+
+    if not runtime.breaker.available():
+        runtime.counts["rejected_open"] += 1
+        raise AgentUnavailable(name, "circuit open after repeated failures")
+
+    semaphore = runtime.semaphore()
+    # `queued` counts every call waiting for (or about to take) a slot, so a burst is bounded too
+    if runtime.in_flight + runtime.queued >= spec.max_concurrency + spec.max_queue:
+        runtime.counts["rejected_queue_full"] += 1
+        raise AgentUnavailable(name, f"{runtime.in_flight} in flight and {runtime.queued} queued")
+
+    runtime.queued += 1
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=max(deadline - time.monotonic(), 0))
+    except asyncio.TimeoutError:
+        runtime.counts["rejected_queue_timeout"] += 1
+        raise AgentUnavailable(name, f"no free slot within {spec.timeout:.0f}s")
+    finally:
+        runtime.queued -= 1
+
+    try:
+        # Checked again after queueing (failures may have opened it meanwhile); claims the half-open probe
+        if not runtime.breaker.allow():
+            runtime.counts["rejected_open"] += 1
+            raise AgentUnavailable(name, "circuit open after repeated failures")
+
+        runtime.in_flight += 1
+        try:
+            return await _attempts(runtime, name, query, deadline)
+        finally:
+            runtime.in_flight -= 1
+    finally:
+        semaphore.release()
+
+
+async def _attempts(runtime: _AgentRuntime, name: str, query: str, deadline: float):
+    # First use imports the agent module; keep that off the event loop
+    agent = _AGENTS.get(name) or await run_blocking(get_agent, name)
+    for attempt in range(runtime.spec.retries + 1):
+        if attempt:
+            runtime.counts["retries"] += 1
+            await asyncio.sleep(min(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), max(deadline - time.monotonic(), 0)))
+        try:
+            result = await asyncio.wait_for(agent.run(query), timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            runtime.counts["timeouts"] += 1
+            runtime.breaker.record(False)
+            raise
+        except Exception:
+            runtime.counts["errors"] += 1
+            if attempt == runtime.spec.retries or time.monotonic() >= deadline:
+                runtime.breaker.record(False)
+                raise
+            continue
+
+        # Agents report an upstream failure (search API down, rate limited) with an "error" key
+        if isinstance(result, dict) and result.get("error"):
+            runtime.counts["errors"] += 1
+            if attempt < runtime.spec.retries and time.monotonic() < deadline:
+                continue
+            runtime.breaker.record(False)
+            return agent, result
+
+        runtime.counts["ok"] += 1
+        runtime.breaker.record(True)
+        return agent, result
+
+
+def agent_stats():
+    """Per-agent limits, in-flight/queued/rejected counts and breaker state (for /agents)."""
+    return {
+        name: {
+            "capabilities": runtime.spec.capabilities,
+            "limits": {"max_concurrency": runtime.spec.max_concurrency, "max_queue": runtime.spec.max_queue,
+                       "timeout": runtime.spec.timeout, "retries": runtime.spec.retries},
+            "loaded": name in _AGENTS,
+            **runtime.stats(),
+        }
+        for name, runtime in _RUNTIMES.items()
+    }
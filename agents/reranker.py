@@ -0,0 +1,116 @@
+import os, asyncio, contextvars, functools, time
+from concurrent.futures import ThreadPoolExecutor
+
+from rag_state import RAG_STATE, get_rerank_model
+from agents.base import run_blocking
+from embedding_cache import normalize_query
+from cache_utils import TTLLRUCache
+
+# Optional cross-encoder rerank stage for PDF retrieval.
+#
+# Hybrid retrieval returns a wide candidate set (RERANK_CANDIDATES); a small CPU
+# cross-encoder scores every (query, chunk) pair in one batch and only the best
+# RERANK_TOP_N chunks go into the Gemini prompt. Scoring has a hard per-query budget: if
+# it does not finish in RERANK_BUDGET_MS the query continues with retrieval order,
+# while the batch keeps running and fills the pair-score cache for next time.
+# Batches run on a dedicated scoring thread, so batches that outlive their budget
+# queue there instead of holding threads of the shared blocking pool. At most
+# RERANK_MAX_QUEUED batches wait behind the running one; past that a query skips
+# scoring (status "busy") instead of queueing a batch that could only time out.
+
+RERANK_ENABLED = os.getenv("PDF_RERANK_ENABLED", "0") == "1"
+RERANK_CANDIDATES = int(os.getenv("PDF_RERANK_CANDIDATES", "50"))
+RERANK_TOP_N = int(os.getenv("PDF_RERANK_TOP_N", "3"))
+RERANK_BUDGET_MS = float(os.getenv("PDF_RERANK_BUDGET_MS", "400"))
+RERANK_MAX_QUEUED = int(os.getenv("PDF_RERANK_MAX_QUEUED", "1"))
+
+# Chunk IDs are never reused, so (query, chunk ID) identifies a pair across generations.
+PAIR_SCORE_CACHE = TTLLRUCache(
+    "rerank_scores",
+    int(os.getenv("PDF_RERANK_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    float(os.getenv("PDF_RERANK_CACHE_TTL_SECONDS", "3600")),
+)
+
+
+_SCORER = None
+_IN_FLIGHT = 0  # batches submitted to the scoring thread and not finished (event-loop side)
+
+
+def _get_scorer():
+    """Creates the single rerank scoring thread only once."""
+    global _SCORER
+    if _SCORER is None:
+        _SCORER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+    return _SCORER
+
+
+async def _run_scorer(fn, *args):
+    """Like run_blocking, but on the rerank scoring thread."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_scorer(), functools.partial(context.run, fn, *args))
+
+
+def _batch_done(task):
+    global _IN_FLIGHT
+    _IN_FLIGHT -= 1
+    # Retrieve the outcome so an error (or cancellation) of a timed-out batch isn't reported as unhandled
+    task.cancelled() or task.exception()
+
+
+def _score_pairs(norm_query: str, query: str, rows: list):
+    """Blocking: scores [(id, text, metadata)] against the query in one batch and caches the scores."""
+    model = get_rerank_model() # loaded by rerank() before the budget starts
+    scores = model.predict([(query, text) for _, text, _ in rows], batch_size=max(len(rows), 1))
+    result = {}
+    for (chunk_id, _, _), score in zip(rows, scores):
+        result[chunk_id] = float(score)
+        PAIR_SCORE_CACHE.put((norm_query, chunk_id), float(score))
+    return result
+
+
+async def rerank(query: str, candidates: list, top_n: int, budget_ms: float = RERANK_BUDGET_MS):
+    """
+    Reorders [(id, text, metadata)] by cross-encoder score and keeps `top_n`.
+    Returns (rows, info); on timeout or error rows are the first `top_n` candidates.
+    """
+    norm = normalize_query(query)
+    scores, missing = {}, []
+    for row in candidates:
+        score = PAIR_SCORE_CACHE.get((norm, row[0]))
+        if score is None:
+            missing.append(row)
+        else:
+            scores[row[0]] = score
+
+    info = {"candidates": len(candidates), "cached": len(scores), "kept": min(top_n, len(candidates))}
+    if missing and RAG_STATE["rerank_model"] is None:
+        # A first-use model load is not scoring time; it doesn't count against the budget.
+        try:
+            await run_blocking(get_rerank_model)
+        except Exception as e:
+            return candidates[:top_n], dict(info, status="error", error=str(e), seconds=0.0)
+
+    start = time.perf_counter()
+    if missing:
+        global _IN_FLIGHT
+        if _IN_FLIGHT > RERANK_MAX_QUEUED:
+            # The scorer is behind: a new batch would only wait out its budget and grow the queue
+            return candidates[:top_n], dict(info, status="busy", seconds=0.0)
+        # shield: a timed-out batch keeps running so its scores still reach the cache
+        _IN_FLIGHT += 1
+        task = asyncio.ensure_future(_run_scorer(_score_pairs, norm, query, missing))
+        task.add_done_callback(_batch_done)
+        try:
+            scores.update(await asyncio.wait_for(asyncio.shield(task), timeout=budget_ms / 1000))
+        except asyncio.TimeoutError:
+            return candidates[:top_n], dict(info, status="timeout", seconds=round(time.perf_counter() - start, 4))
+        except Exception as e:
+            return candidates[:top_n], dict(info, status="error", error=str(e), seconds=round(time.perf_counter() - start, 4))
+
+    ranked = sorted(candidates, key=lambda row: scores[row[0]], reverse=True)
+    return ranked[:top_n], dict(info, status="ok", seconds=round(time.perf_counter() - start, 4))
+
+
+def cache_stats():
+    return PAIR_SCORE_CACHE.stats()
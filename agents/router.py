@@ -0,0 +1,173 @@
+import os, threading
+import numpy as np
+
+from embedding_cache import encode_cached, normalize_query
+
+# Local pre-router: k-nearest-neighbour vote over MiniLM query embeddings.
+#
+# Examples are a small hand-labelled seed set plus every past routing decision the
+# LLM made (read from the trace log and added live as new decisions come in). When
+# the vote is confident the controller uses it directly and skips the Gemini routing
+# call; otherwise it falls back to llm_decide as before.
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+ROUTER_K = int(os.getenv("ROUTER_K", "7"))
+# Share of the (similarity-weighted) neighbour vote the winning agent set needs.
+ROUTER_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", "0.8"))
+# The nearest example must be at least this similar, or the query is "unfamiliar".
+ROUTER_MIN_SIMILARITY = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.5"))
+
+AGENT_ORDER = ["PDF_RAG", "Web_Search", "Arxiv_Search"]
+
+SEED_EXAMPLES = [
+    ("What does the uploaded PDF say about the product roadmap?", ["PDF_RAG"]),
+    ("Summarize the meeting notes document", ["PDF_RAG"]),
+    ("According to the internal report, which embedding model was selected?", ["PDF_RAG"]),
+    ("What are the action items in our Q1 meeting minutes?", ["PDF_RAG"]),
+    ("Find the chunk overlap setting mentioned in the document", ["PDF_RAG"]),
+    ("What did the CEO update say about partnerships?", ["PDF_RAG"]),
+    ("latest news about the stock market today", ["Web_Search"]),
+    ("Who is the current prime minister of Nepal?", ["Web_Search"]),
+    ("What is the weather forecast for tomorrow in Delhi?", ["Web_Search"]),
+    ("recent announcements from OpenAI", ["Web_Search"]),
+    ("What is the capital of France?", ["Web_Search"]),
+    ("price of the new iPhone", ["Web_Search"]),
+    ("recent arxiv papers on graph neural networks", ["Arxiv_Search"]),
+    ("summarize recent research in astrophysics", ["Arxiv_Search"]),
+    ("scientific papers about retrieval augmented generation", ["Arxiv_Search"]),
+    ("latest academic research on transformer efficiency", ["Arxiv_Search"]),
+    ("find papers on reinforcement learning from human feedback", ["Arxiv_Search"]),
+    ("Compare our internal AI strategy report with the latest research papers on multi-agent systems", ["PDF_RAG", "Arxiv_Search"]),
+    ("How does the product overview in our documents compare to current news about competitors?", ["PDF_RAG", "Web_Search"]),
+]
+
+
+def canonical_agents(agents):
+    """Agent sets are compared order-insensitively; returns them in a fixed order."""
+    return tuple(a for a in AGENT_ORDER if a in set(agents))
+
+
+def is_llm_decision(entry: dict):
+    """
+    True for trace entries whose routing came from a successful Gemini call with every
+    agent available. Decisions made while a circuit breaker was open (and their
+    substitutions for skipped agents) were only right during that outage.
+    """
+    available = entry.get("agents_available")  # absent in entries from before the breakers
+    return (
+        entry.get("decision") == "LLM decision"
+        and not entry.get("reason", "").startswith("LLM routing failed")
+        and not entry.get("agents_skipped")
+        and (available is None or set(AGENT_ORDER) <= set(available))
+        and bool(canonical_agents(entry.get("agents_used", [])))
+    )
+
+
+def load_trace_examples(trace_store):
+    """Returns [(query, agents)] for every LLM routing decision in the trace store."""
+    return [(e["query"], e["agents_used"]) for e in trace_store.iter_entries() if is_llm_decision(e)]
+
+
+class LocalRouter:
+    def __init__(self, k=ROUTER_K, confidence=ROUTER_CONFIDENCE, min_similarity=ROUTER_MIN_SIMILARITY):
+        self.k = k
+        self.confidence = confidence
+        self.min_similarity = min_similarity
+        self._embeddings = np.zeros((0, 0), dtype="float32")
+        self._labels = []
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.decisions = 0
+        self.bypassed = 0
+
+    def fit(self, examples: list):
+        """Replaces the example set with [(query, agents)]."""
+        with self._lock:
+            self._embeddings = np.zeros((0, 0), dtype="float32")
+            self._labels = []
+            self._seen = set()
+        self.add_examples(examples)
+
+    def add_examples(self, examples: list):
+        examples = [(q, canonical_agents(a)) for q, a in examples]
+        examples = [(q, a) for q, a in examples if a and (normalize_query(q), a) not in self._seen]
+        if not examples:
+            return
+        vectors = encode_cached([normalize_query(q) for q, _ in examples])
+        self.add_embedded([(v, a, q) for v, (q, a) in zip(vectors, examples)])
+
+    def add_embedded(self, items: list):
+        """Adds [(embedding, agents, query)] without re-encoding (used for live LLM decisions)."""
+        with self._lock:
+            rows, labels = [], []
+            for vector, agents, query in items:
+                key = (normalize_query(query), canonical_agents(agents))
+                if not key[1] or key in self._seen:
+                    continue
+                self._seen.add(key)
+                vector = np.asarray(vector, dtype="float32").reshape(-1)
+                rows.append(vector / (np.linalg.norm(vector) or 1.0))
+                labels.append(key[1])
+            if not rows:
+                return
+            new = np.stack(rows)
+            self._embeddings = new if self._embeddings.size == 0 else np.vstack([self._embeddings, new])
+            self._labels.extend(labels)
+
+    def predict(self, query_emb):
+        """Returns (agents, confidence, nearest_similarity); agents is () if there are no examples."""
+        with self._lock:
+            if not self._labels:
+                return (), 0.0, 0.0
+            query_emb = np.asarray(query_emb, dtype="float32").reshape(-1)
+            query_emb = query_emb / (np.linalg.norm(query_emb) or 1.0)
+            similarities = self._embeddings @ query_emb
+            nearest = np.argsort(-similarities)[: self.k]
+            labels = [self._labels[i] for i in nearest]
+
+        votes = {}
+        for i, label in zip(nearest, labels):
+            votes[label] = votes.get(label, 0.0) + max(float(similarities[i]), 0.0)
+        total = sum(votes.values()) or 1.0
+        best = max(votes, key=votes.get)
+        return best, votes[best] / total, float(similarities[nearest[0]])
+
+    def route(self, query_emb):
+        """
+        Returns (details, confident). When not confident the caller should ask the LLM.
+        Every call counts towards the bypass metrics.
+        """
+        agents, confidence, nearest = self.predict(query_emb)
+        confident = bool(agents) and confidence >= self.confidence and nearest >= self.min_similarity
+        with self._lock:
+            self.decisions += 1
+            self.bypassed += int(confident)
+        details = {"agents": list(agents), "confidence": round(confidence, 4), "nearest_similarity": round(nearest, 4)}
+        return details, confident
+
+    def stats(self):
+        with self._lock:
+            return {
+                "examples": len(self._labels),
+                "decisions": self.decisions,
+                "llm_bypassed": self.bypassed,
+                "bypass_rate": round(self.bypassed / self.decisions, 4) if self.decisions else 0.0,
+                "confidence_threshold": self.confidence,
+                "min_similarity": self.min_similarity,
+            }
+
+
+ROUTER = LocalRouter()
+_TRAINED = threading.Event()
+_TRAIN_LOCK = threading.Lock()
+
+
+def ensure_trained(trace_store):
+    """Fits the router on seed examples + past LLM decisions the first time it is needed."""
+    if _TRAINED.is_set():
+        return ROUTER
+    with _TRAIN_LOCK:
+        if not _TRAINED.is_set():
+            ROUTER.fit(SEED_EXAMPLES + load_trace_examples(trace_store))
+            _TRAINED.set()
+    return ROUTER
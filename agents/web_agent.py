@@ -1,40 +1,31 @@
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
-from duckduckgo_search import DDGS
 
-# --- New Import for Lazy Loading ---
-from rag_state import get_synthesis_model 
-# --- End New Import ---
+from agents.base import Agent
+import fetch_layer
+import llm_gateway
+from agents.context_packer import Passage, pack, CONTEXT_BUDGETS
 
 # Load environment. DO NOT configure genai globally here.
 load_dotenv()
 
-def handle_web_query(query):
+async def handle_web_query(query):
     """Fetch top web results and summarize them using Gemini."""
 
-    # Use the lazy loader for the model
-    model = get_synthesis_model()
-
     results = []
+    fetch_info = {}
     try:
-        # Use DDGS context manager for web search
-        with DDGS() as ddgs:
-            # TWEAK 1: Increase max_results for higher relevance coverage
-            results = list(ddgs.text(
-                query,          # Use the exact query for general search
-                region = "wt-wt",
-                max_results=10,       # Increased from 5 to 10
-                safesearch="moderate"
-            ))
+        # TWEAK 1: max_results=10 for higher relevance coverage (cached, over a persistent DDGS session)
+        results = await fetch_layer.search_web(query, max_results=10, info=fetch_info)
     except Exception as e:
-        return {"summary": f"Web search failed: {e}", "raw_results": []}
+        # "error" tells the registry's circuit breaker that the upstream failed
+        return {"summary": f"Web search failed: {e}", "raw_results": [], "error": f"{type(e).__name__}: {e}"}
 
     if not results:
-        return {"summary": "No relevant web results found.", "raw_results": []}
+        return {"summary": "No relevant web results found.", "raw_results": [], "fetch": fetch_info}
 
     # TWEAK 2: Standardize and improve context structure
-    combined_snippets = []
+    passages = []
     for i, r in enumerate(results):
         title = r.get("title", f"Document {i+1} (Title Missing)")
         url = r.get("href", "URL Missing")
@@ -42,9 +33,10 @@ def handle_web_query(query):
         snippet_text = r.get("body", r.get("description", "Snippet not available.")) 
         
         # Structure the context clearly for the LLM
-        combined_snippets.append(f"--- DOCUMENT {i+1} ---\nTITLE: {title}\nURL: {url}\nSNIPPET: {snippet_text}")
+        passages.append(Passage(snippet_text, f"--- DOCUMENT {i+1} ---\nTITLE: {title}\nURL: {url}\nSNIPPET: "))
 
-    combined = "\n\n".join(combined_snippets)
+    # Syndicated copies of the same snippet are dropped; results are packed in search-rank order
+    combined, context_stats = pack(passages, CONTEXT_BUDGETS["Web_Search"])
 
     # TWEAK 3: Simplify and focus the summarization prompt
     summary_prompt = f"""
@@ -56,10 +48,10 @@ def handle_web_query(query):
     {combined}
     """
 
+    llm_info = {}
     try:
-        # Synchronous Gemini call
-        response = model.generate_content(summary_prompt)
-        summary = response.text.strip()
+        # Async Gemini call through the LLM gateway (rate limit, retries, coalescing)
+        summary = (await llm_gateway.generate(summary_prompt, caller="Web_Search", info=llm_info)).strip()
     except Exception as e:
         # Fallback summary with error
         summary = combined[:1500] + f"\n\n(Gemini summarization failed: {e})"
@@ -67,5 +59,20 @@ def handle_web_query(query):
     # Return structured dictionary
     return {
         "raw_results": results,
-        "summary": summary
-    }
\ No newline at end of file
+        "summary": summary,
+        "context": context_stats,
+        "llm": llm_info,
+        "fetch": fetch_info,
+    }
+
+
+class WebAgent(Agent):
+    name = "Web_Search"
+
+    async def run(self, query: str) -> dict:
+        return await handle_web_query(query)
+
+    def trace_entry(self, result: dict):
+        # Log raw search bodies and whether they came from the result cache
+        return {"Web_Search_Raw": "\n\n".join([r.get("body", "N/A") for r in result.get("raw_results", [])]),
+                "Web_Search_Fetch": result.get("fetch")}
@@ -0,0 +1,120 @@
+# Recall@5 vs. latency of the PDF store's index types. (OPTIONAL developer tool)
+#
+# Builds synthetic corpora shaped like MiniLM embeddings (384-d, clustered) at several
+# sizes, computes exact top-5 neighbours with a flat index, then builds each index
+# type from vector_index.build_index and sweeps its search breadth (nprobe for IVF,
+# efSearch for HNSW). Reports build time, recall@5, per-query latency and index size,
+# so PDF_INDEX_TYPE / PDF_ANN_THRESHOLD / PDF_IVF_NPROBE / PDF_HNSW_EF_SEARCH can be picked.
+#
+#   python benchmarks/ann_recall.py --sizes 10000,100000,1000000
+#
+# The 1M corpus needs ~1.5 GB for the raw vectors plus the index under test.
+
+import argparse, json, os, sys, time, datetime
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import faiss
+import vector_index
+from vector_index import build_index, configure_search
+
+DIM = 384
+K = 5
+SWEEPS = {
+    "flat": [None],
+    "ivf_flat": [1, 4, 16, 64],
+    "ivf_pq": [1, 4, 16, 64],
+    "hnsw": [16, 32, 64, 128],
+}
+
+
+def synthetic_corpus(n: int, n_queries: int, dim: int = DIM, seed: int = 0):
+    """Unit vectors scattered around random cluster centres, plus held-out queries near them."""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(16, int(np.sqrt(n)))
+    centres = rng.standard_normal((n_clusters, dim)).astype("float32")
+
+    def sample(count):
+        points = centres[rng.integers(0, n_clusters, size=count)]
+        points = points + 0.6 * rng.standard_normal((count, dim)).astype("float32")
+        return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+    return sample(n), sample(n_queries)
+
+
+def ground_truth(corpus: np.ndarray, queries: np.ndarray):
+    exact = faiss.IndexFlatL2(corpus.shape[1])
+    exact.add(corpus)
+    return exact.search(queries, K)[1]
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found.tolist(), truth.tolist()))
+    return hits / truth.size
+
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).size)
+
+
+def bench_type(kind: str, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray):
+    ids = np.arange(len(corpus), dtype="int64")
+    start = time.perf_counter()
+    index = build_index(kind, corpus, ids)
+    build_seconds = time.perf_counter() - start
+    built_as = vector_index.index_type(index)
+    size = index_bytes(index)
+
+    rows = []
+    for breadth in SWEEPS[kind]:
+        if breadth is not None:
+            configure_search(index, nprobe=breadth, ef_search=breadth)
+        index.search(queries[:10], K)  # warm up
+        start = time.perf_counter()
+        _, found = index.search(queries, K)
+        seconds = time.perf_counter() - start
+        rows.append({
+            "type": kind,
+            "built_as": built_as,
+            "vectors": len(corpus),
+            "breadth": breadth,
+            "recall_at_5": round(recall_at_k(found, truth), 4),
+            "ms_per_query": round(1000 * seconds / len(queries), 4),
+            "build_seconds": round(build_seconds, 2),
+            "index_mb": round(size / 2 ** 20, 1),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@5 vs. latency for flat, IVF-Flat, IVF-PQ and HNSW indexes.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated corpus sizes.")
+    parser.add_argument("--types", default=",".join(vector_index.INDEX_TYPES))
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads (1 = per-query latency).")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    kinds = [k for k in args.types.split(",") if k.strip()]
+
+    print(f"{'vectors':>9} {'type':>9} {'breadth':>8} {'recall@5':>9} {'ms/query':>9} {'build s':>8} {'MB':>8}")
+    results = []
+    for n in sizes:
+        corpus, queries = synthetic_corpus(n, args.queries)
+        truth = ground_truth(corpus, queries)
+        for kind in kinds:
+            for row in bench_type(kind, corpus, queries, truth):
+                results.append(row)
+                print(f"{row['vectors']:>9} {row['built_as']:>9} {row['breadth']!s:>8} {row['recall_at_5']:>9} "
+                      f"{row['ms_per_query']:>9} {row['build_seconds']:>8} {row['index_mb']:>8}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/ann_recall.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "threads": args.threads, "results": results}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
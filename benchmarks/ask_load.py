@@ -0,0 +1,114 @@
+# Load benchmark for the /ask endpoint. (OPTIONAL developer tool)
+#
+# Fires a fixed number of /ask requests at several concurrency levels and reports
+# throughput and latency percentiles. Uses only the standard library so it can
+# be pointed at any running server.
+#
+# Before/after comparison:
+#   git stash / git checkout <old-commit>  ->  uvicorn main:app --port 8000
+#   python benchmarks/ask_load.py --label before
+#   git checkout <new-commit>              ->  uvicorn main:app --port 8000
+#   python benchmarks/ask_load.py --label after
+#
+# --stream targets /ask/stream instead and also reports time to the first event
+# (the routing decision), which is what users see before the answer starts.
+#
+# Results are appended to benchmarks/results/ask_load.jsonl so runs can be compared.
+
+import argparse, json, os, statistics, time, datetime
+import urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_QUERIES = [
+    "What embedding model does NebulaByte use according to the PDF?",
+    "latest news on large language models",
+    "recent arxiv papers on graph neural networks",
+]
+
+
+def _ask(base_url: str, query: str, timeout: float, stream: bool = False):
+    """Returns (ok, total_seconds, first_byte_seconds)."""
+    path = "/ask/stream" if stream else "/ask"
+    url = f"{base_url}{path}?query={urllib.parse.quote(query)}"
+    req = urllib.request.Request(url, method="POST")
+    start = time.perf_counter()
+    first_byte = None
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            if stream:
+                resp.readline()
+                first_byte = time.perf_counter() - start
+            resp.read()
+            ok = resp.status == 200
+    except Exception:
+        ok = False
+    total = time.perf_counter() - start
+    return ok, total, first_byte if first_byte is not None else total
+
+
+def run_level(base_url: str, concurrency: int, total: int, queries: list, timeout: float, stream: bool = False):
+    """Runs `total` requests with `concurrency` clients; returns a summary dict."""
+    jobs = [queries[i % len(queries)] for i in range(total)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda q: _ask(base_url, q, timeout, stream), jobs))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(lat for ok, lat, _ in results if ok)
+    first_bytes = sorted(fb for ok, _, fb in results if ok)
+    errors = sum(1 for ok, _, _ in results if not ok)
+
+    def pct(p, values=latencies):
+        if not values:
+            return None
+        return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "p50": pct(50),
+        "p95": pct(95),
+        "mean": round(statistics.mean(latencies), 3) if latencies else None,
+        "ttfb_p50": pct(50, first_bytes),
+        "ttfb_p95": pct(95, first_bytes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure /ask throughput at several concurrency levels.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--levels", default="1,8,32", help="Comma-separated client counts.")
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--label", default="", help="Tag stored with the results (e.g. before/after).")
+    parser.add_argument("--query", action="append", help="Query to send (repeatable).")
+    parser.add_argument("--stream", action="store_true", help="Use /ask/stream and report time to first event.")
+    args = parser.parse_args()
+
+    queries = args.query or DEFAULT_QUERIES
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+
+    print(f"{'clients':>8} {'reqs':>6} {'errors':>7} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'ttfb p50':>9}")
+    rows = []
+    for level in levels:
+        row = run_level(args.url, level, level * args.requests_per_client, queries, args.timeout, args.stream)
+        rows.append(row)
+        print(f"{row['concurrency']:>8} {row['requests']:>6} {row['errors']:>7} "
+              f"{row['throughput_rps']:>8} {row['p50']!s:>8} {row['p95']!s:>8} {row['ttfb_p50']!s:>9}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/ask_load.jsonl", "a") as f:
+        f.write(json.dumps({
+            "timestamp": str(datetime.datetime.now()),
+            "label": args.label,
+            "stream": args.stream,
+            "url": args.url,
+            "levels": rows,
+        }) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Cold-start cost of the PDF chunk store: pickle vs. sqlite. (OPTIONAL developer tool)
+#
+# Writes a synthetic corpus of --chunks chunks (~1000 characters each, like the
+# splitter output) both as the old pickled data.pkl and as chunk_store's sqlite
+# file, then in a fresh process per mode measures:
+#   open_seconds    - time until the first query can be answered
+#   fetch_ms        - mean time to fetch the 5 chunks of one retrieval
+#   rss_growth_mb   - resident memory added by opening the store and serving lookups
+#
+#   python benchmarks/chunk_store_load.py --chunks 100000
+
+import argparse, json, os, pickle, random, resource, subprocess, sys, tempfile, time, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ["pickle", "sqlite"]
+LOOKUPS = 200
+
+
+def _rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build(db_path: str, n_chunks: int):
+    from chunk_store import ChunkStore, CHUNK_STORE_FILE
+
+    rng = random.Random(0)
+    words = ["retrieval", "agent", "vector", "index", "report", "roadmap", "latency", "model", "quarter", "document"]
+    data_store = {"chunks": {}, "metadata": {}, "sources": {}, "next_id": n_chunks}
+    for i in range(n_chunks):
+        source = f"doc_{i // 500}.pdf"
+        data_store["chunks"][i] = " ".join(rng.choice(words) for _ in range(130))[:1000]
+        data_store["metadata"][i] = {"source": source, "page_number": (i % 500) // 4 + 1, "chunk_index": i % 4}
+        data_store["sources"].setdefault(source, {"content_hash": None, "ids": []})["ids"].append(i)
+
+    with open(os.path.join(db_path, "data.pkl"), "wb") as f:
+        pickle.dump(data_store, f)
+    ChunkStore(os.path.join(db_path, CHUNK_STORE_FILE)).import_data_store(data_store)
+
+
+def measure(mode: str, db_path: str, n_chunks: int):
+    """Runs in a fresh process: open the store, then serve LOOKUPS top-5 fetches."""
+    rng = random.Random(1)
+    lookups = [rng.sample(range(n_chunks), 5) for _ in range(LOOKUPS)]
+    before = _rss_mb()
+
+    start = time.perf_counter()
+    if mode == "pickle":
+        with open(os.path.join(db_path, "data.pkl"), "rb") as f:
+            data_store = pickle.load(f)
+        fetch = lambda ids: [(data_store["chunks"][i], data_store["metadata"][i]) for i in ids]
+    else:
+        from chunk_store import ChunkStore, CHUNK_STORE_FILE
+        store = ChunkStore(os.path.join(db_path, CHUNK_STORE_FILE))
+        fetch = store.get_many
+    fetch(lookups[0])
+    open_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ids in lookups:
+        fetch(ids)
+    fetch_ms = 1000 * (time.perf_counter() - start) / len(lookups)
+
+    return {
+        "mode": mode,
+        "chunks": n_chunks,
+        "open_seconds": round(open_seconds, 4),
+        "fetch_ms": round(fetch_ms, 4),
+        "rss_growth_mb": round(_rss_mb() - before, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pickle and sqlite chunk store cold start and lookups.")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--measure", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--db-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.db_path, args.chunks)))
+        return
+
+    rows = []
+    with tempfile.TemporaryDirectory() as db_path:
+        build(db_path, args.chunks)
+        sizes = {"pickle": os.path.getsize(os.path.join(db_path, "data.pkl")),
+                 "sqlite": os.path.getsize(os.path.join(db_path, "chunks.sqlite"))}
+        print(f"{'mode':>7} {'chunks':>8} {'file MB':>8} {'open s':>8} {'fetch ms':>9} {'RSS +MB':>8}")
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, __file__, "--measure", mode, "--db-path", db_path, "--chunks", str(args.chunks)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            row = json.loads(out.strip().splitlines()[-1])
+            row["file_mb"] = round(sizes[mode] / 2 ** 20, 1)
+            rows.append(row)
+            print(f"{mode:>7} {row['chunks']:>8} {row['file_mb']:>8} {row['open_seconds']:>8} "
+                  f"{row['fetch_ms']:>9} {row['rss_growth_mb']:>8}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/chunk_store_load.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "results": rows}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# First-query latency with and without the startup warm-up. (OPTIONAL developer tool)
+#
+# Ingests sample_pdfs/ into a throwaway store, then in a fresh process per mode
+# answers the labeled retrieval queries through the PDF retrieval path
+# (index handle + query embedding + hybrid search) and reports:
+#   warmup_seconds  - time spent in warmup.warm_up() before the first query (warm only)
+#   first_ms        - latency of the first query
+#   p50_ms          - median latency of the following queries
+#
+# Modes:
+#   lazy  - STARTUP_WARMUP=off: the first query loads the model, index and chunk store
+#   warm  - warmup.warm_up() ran first, as the lifespan hook does
+#
+#   python benchmarks/cold_start.py
+#   python benchmarks/cold_start.py --queries 100
+
+import argparse, asyncio, glob, json, os, subprocess, sys, tempfile, time, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ["lazy", "warm"]
+
+
+def measure(mode: str, db_path: str, n_queries: int, queries_file: str):
+    """Runs in a fresh process so nothing is loaded yet."""
+    with open(queries_file) as f:
+        queries = [label["query"] for label in json.load(f)]
+
+    from agents import pdf_agent
+    from rag_state import get_index_handle
+    import warmup
+
+    pdf_agent.DB_PATH = db_path
+    warmup_seconds = None
+    if mode == "warm":
+        start = time.perf_counter()
+        asyncio.run(warmup.warm_up(db_path))
+        warmup_seconds = time.perf_counter() - start
+
+    async def one(query):
+        start = time.perf_counter()
+        handle = get_index_handle(db_path)
+        await pdf_agent.retrieve(handle, query)
+        return 1000 * (time.perf_counter() - start)
+
+    async def run_all():
+        latencies = []
+        for i in range(n_queries):
+            # Distinct query text each time, so later queries can't be served from the result caches
+            latencies.append(await one(f"{queries[i % len(queries)]} ({i})"))
+        return latencies
+
+    latencies = asyncio.run(run_all())
+    rest = sorted(latencies[1:]) or latencies
+    return {
+        "mode": mode,
+        "queries": n_queries,
+        "warmup_seconds": round(warmup_seconds, 3) if warmup_seconds is not None else None,
+        "first_ms": round(latencies[0], 2),
+        "p50_ms": round(rest[len(rest) // 2], 2),
+        "components": warmup.WARMUP_STATE["components"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="First-query latency with and without startup warm-up.")
+    parser.add_argument("--pdf-dir", default="sample_pdfs")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--queries-file", default="benchmarks/retrieval_queries.json")
+    parser.add_argument("--measure", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--db-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.db_path, args.queries, args.queries_file)))
+        return
+
+    rows = []
+    with tempfile.TemporaryDirectory() as db_path:
+        from agents import pdf_agent
+
+        pdf_agent.DB_PATH = db_path
+        pdf_agent.ingest_pdfs(sorted(glob.glob(os.path.join(args.pdf_dir, "*.pdf"))))
+
+        print(f"{'mode':>5} {'warmup s':>9} {'first ms':>9} {'p50 ms':>8}")
+        for mode in MODES:
+            # Separate embedding caches, so the second mode doesn't find the first one's query vectors
+            env = {**os.environ, "STARTUP_WARMUP": "off" if mode == "lazy" else "background",
+                   "EMBEDDING_CACHE_PATH": os.path.join(db_path, f"embedding_cache_{mode}.sqlite")}
+            out = subprocess.run(
+                [sys.executable, __file__, "--measure", mode, "--db-path", db_path,
+                 "--queries", str(args.queries), "--queries-file", args.queries_file],
+                capture_output=True, text=True, check=True, env=env,
+            ).stdout
+            row = json.loads(out.strip().splitlines()[-1])
+            rows.append(row)
+            print(f"{mode:>5} {row['warmup_seconds']!s:>9} {row['first_ms']:>9} {row['p50_ms']:>8}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/cold_start.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "pdf_dir": args.pdf_dir, "results": rows}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
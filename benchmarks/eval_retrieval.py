@@ -0,0 +1,135 @@
+# Offline retrieval evaluation for the PDF agent. (OPTIONAL developer tool)
+#
+# Ingests sample_pdfs/ into a throwaway store and runs the labeled queries in
+# benchmarks/retrieval_queries.json through pdf_agent.retrieve in each mode.
+# A query counts as found at k if one of its top-k chunks comes from the labeled
+# source and contains the labeled answer text. Reports recall@1/3/5, the mean
+# and p95 retrieval latency (query embedding is warmed first, result caches are
+# cleared, so latency is the search itself), the mean context size that would
+# go into the Gemini prompt, and its estimated tokens after context packing.
+#
+# hybrid+rerank retrieves PDF_RERANK_CANDIDATES chunks and keeps the cross-encoder's
+# best PDF_RERANK_TOP_N (pair-score cache cleared, so every query pays for scoring;
+# the model is loaded beforehand so it does not eat the first query's budget). --end-to-end
+# also times the full handle_pdf_query (Gemini call included) with and without
+# reranking; it needs GOOGLE_API_KEY.
+#
+#   python benchmarks/eval_retrieval.py
+#   python benchmarks/eval_retrieval.py --end-to-end
+#   python benchmarks/eval_retrieval.py --pdf-dir sample_pdfs --queries benchmarks/retrieval_queries.json
+
+import argparse, asyncio, glob, json, os, sys, tempfile, time, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ["vector", "bm25", "hybrid", "hybrid+rerank"]
+KS = [1, 3, 5]
+
+
+def _is_hit(row, label):
+    _, text, meta = row
+    return meta["source"] == label["source"] and label["answer"].lower() in " ".join(text.split()).lower()
+
+
+async def evaluate(handle, labels: list, mode: str):
+    from agents import pdf_agent, reranker
+    from agents.context_packer import Passage, pack, CONTEXT_BUDGETS
+    from embedding_cache import embed_query
+
+    if mode == "hybrid+rerank":
+        from rag_state import get_rerank_model
+        get_rerank_model()
+
+    found = {k: 0 for k in KS}
+    latencies = []
+    context_chars = packed_tokens = 0
+    statuses = {}
+    for label in labels:
+        embed_query(label["query"])
+        pdf_agent.RETRIEVAL_CACHE.clear()
+        reranker.PAIR_SCORE_CACHE.clear()
+        start = time.perf_counter()
+        if mode == "hybrid+rerank":
+            rows, info = await pdf_agent.retrieve_context(handle, label["query"], rerank=True)
+            statuses[info["status"]] = statuses.get(info["status"], 0) + 1
+        else:
+            rows = await pdf_agent.retrieve(handle, label["query"], k=max(KS), mode=mode)
+        latencies.append(time.perf_counter() - start)
+        prompt_rows = rows if mode == "hybrid+rerank" else rows[:pdf_agent.TOP_K]
+        context_chars += sum(len(text) for _, text, _ in prompt_rows)
+        _, stats = pack([Passage(text, f"[Source: {meta['source']}, Page: {meta['page_number']}] ",
+                                 (meta["source"], meta["page_number"]), chunk_id) for chunk_id, text, meta in prompt_rows],
+                        CONTEXT_BUDGETS["PDF_RAG"])
+        packed_tokens += stats["tokens_after"]
+        for k in KS:
+            found[k] += any(_is_hit(row, label) for row in rows[:k])
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "queries": len(labels),
+        **{f"recall@{k}": round(found[k] / len(labels), 3) for k in KS},
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 2),
+        "p95_ms": round(1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 2),
+        "context_chars": round(context_chars / len(labels)),
+        "packed_tokens": round(packed_tokens / len(labels)),
+        **({"rerank_status": statuses} if statuses else {}),
+    }
+
+
+async def end_to_end(labels: list, rerank: bool):
+    """Mean handle_pdf_query seconds and prompt context chars with the rerank stage on or off."""
+    from agents import pdf_agent, reranker
+
+    reranker.RERANK_ENABLED = rerank
+    seconds, chars = [], []
+    for label in labels:
+        pdf_agent.RETRIEVAL_CACHE.clear()
+        start = time.perf_counter()
+        result = await pdf_agent.handle_pdf_query(label["query"])
+        seconds.append(time.perf_counter() - start)
+        chars.append(result["retrieval"]["context_chars"])
+    return {"rerank": rerank, "mean_seconds": round(sum(seconds) / len(seconds), 3),
+            "mean_context_chars": round(sum(chars) / len(chars))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of vector, BM25 and hybrid PDF retrieval.")
+    parser.add_argument("--pdf-dir", default="sample_pdfs")
+    parser.add_argument("--queries", default="benchmarks/retrieval_queries.json")
+    parser.add_argument("--end-to-end", action="store_true", help="Also time handle_pdf_query with/without rerank.")
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        labels = json.load(f)
+
+    from agents import pdf_agent
+    from rag_state import get_index_handle
+
+    results = []
+    with tempfile.TemporaryDirectory() as db_path:
+        pdf_agent.DB_PATH = db_path
+        pdf_agent.ingest_pdfs(sorted(glob.glob(os.path.join(args.pdf_dir, "*.pdf"))))
+        handle = get_index_handle(db_path)
+
+        print(f"{'mode':>14} {'R@1':>6} {'R@3':>6} {'R@5':>6} {'mean ms':>8} {'p95 ms':>8} {'ctx chars':>10} {'packed tok':>10}")
+        for mode in MODES:
+            row = asyncio.run(evaluate(handle, labels, mode))
+            results.append(row)
+            print(f"{mode:>14} {row['recall@1']:>6} {row['recall@3']:>6} {row['recall@5']:>6} "
+                  f"{row['mean_ms']:>8} {row['p95_ms']:>8} {row['context_chars']:>10} {row['packed_tokens']:>10}")
+
+        if args.end_to_end:
+            for rerank in (False, True):
+                row = asyncio.run(end_to_end(labels, rerank))
+                results.append(row)
+                print(f"end-to-end rerank={rerank}: {row['mean_seconds']}s, {row['mean_context_chars']} context chars")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/eval_retrieval.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "pdf_dir": args.pdf_dir, "results": results}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
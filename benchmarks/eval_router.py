@@ -0,0 +1,76 @@
+# Offline evaluation of the local pre-router against past LLM routing decisions.
+# (OPTIONAL developer tool)
+#
+# Replays the trace log in time order. For every entry routed by Gemini, the local
+# router (seed examples + all *earlier* LLM decisions, exactly as it would have been
+# live) predicts an agent set; we record whether it would have bypassed the LLM and
+# whether it agrees with the LLM's choice. A threshold sweep shows the trade-off
+# between bypass rate and agreement so ROUTER_CONFIDENCE can be tuned.
+#
+#   python benchmarks/eval_router.py --log-dir logs
+
+import argparse, json, os, sys, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agents.router import LocalRouter, SEED_EXAMPLES, canonical_agents, load_trace_examples
+from embedding_cache import encode_cached, normalize_query
+from trace_store import TraceStore
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95]
+
+
+def replay(examples: list, min_similarity: float):
+    """Returns [(llm_agents, predicted_agents, confidence, nearest_similarity)] in log order."""
+    router = LocalRouter(min_similarity=min_similarity)
+    router.fit(SEED_EXAMPLES)
+    vectors = encode_cached([normalize_query(q) for q, _ in examples]) if examples else []
+
+    rows = []
+    for vector, (query, agents) in zip(vectors, examples):
+        predicted, confidence, nearest = router.predict(vector)
+        rows.append((canonical_agents(agents), predicted, confidence, nearest))
+        router.add_embedded([(vector, agents, query)])  # the LLM's answer becomes an example
+    return rows
+
+
+def summarize(rows: list, threshold: float, min_similarity: float):
+    bypassed = [r for r in rows if r[1] and r[2] >= threshold and r[3] >= min_similarity]
+    agree_bypassed = sum(1 for llm, pred, _, _ in bypassed if llm == pred)
+    agree_all = sum(1 for llm, pred, _, _ in rows if llm == pred)
+    return {
+        "threshold": threshold,
+        "decisions": len(rows),
+        "bypass_rate": round(len(bypassed) / len(rows), 4) if rows else 0.0,
+        "agreement_when_bypassed": round(agree_bypassed / len(bypassed), 4) if bypassed else None,
+        "agreement_overall": round(agree_all / len(rows), 4) if rows else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the trace log to measure local-router agreement with the LLM.")
+    parser.add_argument("--log-dir", default="logs", help="Trace store directory.")
+    parser.add_argument("--min-similarity", type=float, default=LocalRouter().min_similarity)
+    args = parser.parse_args()
+
+    examples = load_trace_examples(TraceStore(args.log_dir))
+    if not examples:
+        print(f"No LLM routing decisions found in {args.log_dir}.")
+        return
+
+    rows = replay(examples, args.min_similarity)
+    results = [summarize(rows, t, args.min_similarity) for t in THRESHOLDS]
+
+    print(f"Replayed {len(rows)} LLM routing decisions from {args.log_dir}")
+    print(f"{'threshold':>10} {'bypass':>8} {'agree(bypassed)':>16} {'agree(all)':>11}")
+    for r in results:
+        print(f"{r['threshold']:>10} {r['bypass_rate']:>8} {r['agreement_when_bypassed']!s:>16} {r['agreement_overall']!s:>11}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/eval_router.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "log_dir": args.log_dir, "results": results}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Local stand-in for Gemini, for load tests without an API key. (OPTIONAL developer tool)
+#
+# Speaks the protocol of llm_gateway.HTTPBackend:
+#   POST /generate  {"contents": ..., "stream": bool}
+#                   -> {"text": ...}, or NDJSON lines {"text": ...} when streaming
+#   GET  /stats     -> request, rejection and distinct-prompt counts
+# Every answer takes --latency-ms. Like the real API it answers 429 once more
+# than --rpm requests arrived in the last 60 seconds (0 = no limit), and 503 for
+# a random --error-rate fraction of requests.
+#
+#   python benchmarks/fake_llm_server.py --port 8100 --rpm 60
+#   LLM_BACKEND=http LLM_BACKEND_URL=http://127.0.0.1:8100 uvicorn main:app
+
+import argparse, hashlib, json, random, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLLM:
+    def __init__(self, latency_ms: float = 500, rpm: int = 0, error_rate: float = 0.0, stream_chunks: int = 8):
+        self.latency = latency_ms / 1000
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.counts = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0}
+        self.prompts = set()
+
+    def admit(self, contents):
+        """Returns None to answer, or the HTTP status to fail with."""
+        now = time.monotonic()
+        with self._lock:
+            self.counts["requests"] += 1
+            self.prompts.add(hashlib.sha256(json.dumps(contents, default=str).encode()).hexdigest())
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if self.rpm and len(self._recent) >= self.rpm:
+                self.counts["rate_limited"] += 1
+                return 429
+            self._recent.append(now)
+            if random.random() < self.error_rate:
+                self.counts["errors"] += 1
+                return 503
+            self.counts["ok"] += 1
+        return None
+
+    def answer(self, contents):
+        prompt = contents if isinstance(contents, str) else "\n".join(str(c) for c in contents)
+        words = prompt.split()
+        return f"Fake answer for a {len(words)}-word prompt: " + " ".join(words[-12:])
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "distinct_prompts": len(self.prompts)}
+
+
+def make_handler(llm: FakeLLM):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._json(200, llm.stats())
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/generate":
+                return self._json(404, {"error": "not found"})
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            status = llm.admit(body["contents"])
+            if status is not None:
+                return self._json(status, {"error": "Resource exhausted" if status == 429 else "Unavailable"})
+
+            text = llm.answer(body["contents"])
+            if not body.get("stream"):
+                time.sleep(llm.latency)
+                return self._json(200, {"text": text})
+
+            # Stream: the latency is spread over the fragments, like a token stream
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = text.split(" ")
+            step = max(1, len(words) // llm.stream_chunks)
+            for i in range(0, len(words), step):
+                time.sleep(llm.latency / llm.stream_chunks)
+                self.wfile.write((json.dumps({"text": " ".join(words[i:i + step]) + " "}) + "\n").encode())
+                self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(port: int, llm: FakeLLM):
+    """Starts the server in a daemon thread and returns it (call .shutdown() to stop)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(llm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake LLM server for llm_gateway's http backend.")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--rpm", type=int, default=0, help="Answer 429 above this many requests per minute.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--stream-chunks", type=int, default=8)
+    args = parser.parse_args()
+
+    llm = FakeLLM(args.latency_ms, args.rpm, args.error_rate, args.stream_chunks)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(llm))
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port} (latency {args.latency_ms:.0f} ms, rpm {args.rpm or 'unlimited'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
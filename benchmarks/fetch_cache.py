@@ -0,0 +1,119 @@
+# Repeated web/arXiv searches through fetch_layer against the local search stub. (OPTIONAL developer tool)
+#
+# Starts benchmarks/search_stub_server.py in-process with --latency-ms per
+# request, points fetch_layer at it (WEB_SEARCH_BACKEND=http, ARXIV_API_URL) and
+# sends --queries searches over --distinct different queries (with varied case
+# and spacing, like repeated user questions) in four modes:
+#   uncached  - result cache off (previous behaviour, minus the per-query session)
+#   cached    - fresh entries: the first query of each kind fetches, the rest hit
+#   stale     - every entry past its TTL: served at once, refreshed in the background
+#   outage    - entries expired and the stub answering 503: served from the cache
+# and reports p50/p95 latency, upstream requests and TCP connections opened.
+#
+#   python benchmarks/fetch_cache.py --queries 200 --distinct 20 --latency-ms 400
+
+import argparse, asyncio, json, os, sys, tempfile, time, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ["uncached", "cached", "stale", "outage"]
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def _variant(i: int, distinct: int):
+    topic = f"recent results on topic {i % distinct}"
+    return topic.upper() if i % 3 == 1 else ("  " + topic.replace(" ", "  ") if i % 3 == 2 else topic)
+
+
+async def run_queries(n: int, distinct: int):
+    import fetch_layer
+
+    latencies, outcomes, failures = [], {}, 0
+    for i in range(n):
+        info = {}
+        search = fetch_layer.search_web if i % 2 == 0 else fetch_layer.search_arxiv
+        start = time.perf_counter()
+        try:
+            await search(_variant(i // 2, distinct), info=info)
+            latencies.append((time.perf_counter() - start) * 1000)
+            outcome = info.get("cache", "uncached")
+        except Exception:
+            failures += 1
+            outcome = "error"
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    # Let background refreshes finish before the stub is stopped
+    while fetch_layer._TASKS:
+        await asyncio.sleep(0.05)
+    return latencies, outcomes, failures
+
+
+def run_mode(mode: str, args, port: int):
+    import fetch_layer
+    from search_stub_server import SearchStub, serve
+
+    stub = SearchStub(args.latency_ms)
+    server = serve(port, stub)
+    fetch_layer.WEB_SEARCH_BACKEND, fetch_layer.WEB_SEARCH_URL = "http", f"http://127.0.0.1:{port}"
+    fetch_layer.ARXIV_API_URL, fetch_layer._ARXIV_CLIENT = f"http://127.0.0.1:{port}", None
+    fetch_layer.ARXIV_DELAY_SECONDS = 0  # the stub has no rate limit to respect
+    fetch_layer._LOCAL.__dict__.clear()
+    fetch_layer._CACHE = fetch_layer.FetchCache(os.path.join(args.cache_dir, f"{mode}.sqlite"))
+    fetch_layer.FETCH_CACHE_ENABLED = mode != "uncached"
+    fetch_layer.FETCH_TTLS = {"web": 900.0, "arxiv": 86400.0}
+    fetch_layer.FETCH_STALE_SECONDS = {"web": 3600.0, "arxiv": 604800.0}
+
+    try:
+        if mode in ("stale", "outage"):
+            # Fill the cache, then age every entry past its TTL
+            asyncio.run(run_queries(args.distinct * 2, args.distinct))
+            fetch_layer.FETCH_TTLS = {"web": 0.0, "arxiv": 0.0}
+            if mode == "outage":
+                fetch_layer.FETCH_STALE_SECONDS = {"web": 0.0, "arxiv": 0.0}
+                stub.fail = True
+            stub.counts = {name: 0 for name in stub.counts}
+        latencies, outcomes, failures = asyncio.run(run_queries(args.queries, args.distinct))
+    finally:
+        server.shutdown()
+
+    counts = stub.stats()
+    return {
+        "mode": mode, "queries": args.queries, "distinct": args.distinct, "failed": failures,
+        "p50_ms": round(_pct(latencies, 0.5), 2) if latencies else None,
+        "p95_ms": round(_pct(latencies, 0.95), 2) if latencies else None,
+        "upstream_requests": counts["web"] + counts["arxiv"] + counts["errors"],
+        "connections": counts["connections"],
+        "outcomes": outcomes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search latency with and without the fetch_layer result cache.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=400)
+    parser.add_argument("--port", type=int, default=8110)
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        args.cache_dir = cache_dir
+        print(f"{'mode':>9} {'p50 ms':>8} {'p95 ms':>8} {'upstream':>9} {'conns':>6} {'failed':>7}  outcomes")
+        for i, mode in enumerate(MODES):
+            row = run_mode(mode, args, args.port + i)
+            rows.append(row)
+            print(f"{mode:>9} {row['p50_ms']!s:>8} {row['p95_ms']!s:>8} {row['upstream_requests']:>9} "
+                  f"{row['connections']:>6} {row['failed']:>7}  {row['outcomes']}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/fetch_cache.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "results": rows}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Cold-import cost of the server and CLI entry points. (OPTIONAL developer tool)
+#
+# Runs `python -X importtime -c "import <module>"` in fresh processes and reports
+# the total import time (best of --runs) and the packages that cost the most.
+# Agents and their heavy dependencies are meant to be imported on first use
+# (agents/registry.py, rag_state loaders), so any of HEAVY_PACKAGES showing up at
+# import time is reported as a regression, as is a total more than --tolerance
+# above the previous run recorded in benchmarks/results/import_time.jsonl.
+#
+#   python benchmarks/import_time.py
+#   python benchmarks/import_time.py --module main --module agents.controller --check
+
+import argparse, json, os, re, subprocess, sys, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = "benchmarks/results/import_time.jsonl"
+
+HEAVY_PACKAGES = [
+    "fitz", "faiss", "torch", "transformers", "sentence_transformers",
+    "langchain_text_splitters", "duckduckgo_search", "arxiv", "google.generativeai",
+]
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)")
+
+
+def profile(module: str):
+    """One fresh-process import. Returns (total_ms, {package: self_ms}, imported module names)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+
+    total_us, by_package, imported = 0, {}, set()
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), match[3], match[4]
+        imported.add(name)
+        if len(indent) == 1:  # top level: its cumulative time includes everything below it
+            total_us += cumulative_us
+        package = name.split(".")[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+    return total_us / 1000, {p: us / 1000 for p, us in by_package.items()}, imported
+
+
+def _previous(module: str):
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE) as f:
+        for line in f:
+            for row in json.loads(line)["results"]:
+                if row["module"] == module:
+                    previous = row
+    return previous
+
+
+def measure(module: str, runs: int, top: int, tolerance: float):
+    best = None
+    for _ in range(runs):
+        result = profile(module)
+        if best is None or result[0] < best[0]:
+            best = result
+    total_ms, by_package, imported = best
+
+    heavy = [p for p in HEAVY_PACKAGES if p in imported]
+    previous = _previous(module)
+    regressions = [f"imports {p} at startup" for p in heavy]
+    if previous and total_ms > previous["total_ms"] * (1 + tolerance):
+        regressions.append(f"total {total_ms:.0f} ms vs. {previous['total_ms']:.0f} ms in the previous run")
+
+    return {
+        "module": module,
+        "total_ms": round(total_ms, 1),
+        "previous_total_ms": previous["total_ms"] if previous else None,
+        "heavy_imports": heavy,
+        "top_packages": {p: round(ms, 1) for p, ms in sorted(by_package.items(), key=lambda kv: -kv[1])[:top]},
+        "regressions": regressions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-import time of the server and tooling entry points.")
+    parser.add_argument("--module", action="append", help="Module to import (repeatable; default: main).")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed growth over the previous run.")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 on a regression.")
+    args = parser.parse_args()
+
+    rows = []
+    for module in args.module or ["main"]:
+        row = measure(module, args.runs, args.top, args.tolerance)
+        rows.append(row)
+        prev = f" (previous {row['previous_total_ms']} ms)" if row["previous_total_ms"] is not None else ""
+        print(f"import {module}: {row['total_ms']} ms{prev}")
+        for package, ms in row["top_packages"].items():
+            print(f"  {package:<28} {ms:>8} ms")
+        for regression in row["regressions"]:
+            print(f"  REGRESSION: {regression}")
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "results": rows}) + "\n")
+
+    if args.check and any(row["regressions"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Per-worker memory of the PDF vector index. (OPTIONAL developer tool)
+#
+# Builds a synthetic store index in each storage configuration, then starts
+# --workers processes that load it the way rag_state does and run a few searches,
+# like uvicorn workers serving /ask. While all of them are alive each reports:
+#   rss_mb      - resident memory, including shared file pages
+#   anon_mb     - private (anonymous) memory: what each extra worker really costs
+#   pss_mb      - proportional share: shared pages are split between the workers
+#
+#   python benchmarks/index_memory.py --vectors 500000 --workers 4
+#
+# Configurations:
+#   before     - fp32 vectors, L2, read fully into each process (previous behaviour)
+#   fp32_mmap  - fp32 vectors, cosine, memory-mapped
+#   fp16_mmap  - float16 vectors, cosine, memory-mapped
+#   sq8_mmap   - 8-bit scalar-quantized vectors, cosine, memory-mapped
+
+import argparse, json, os, subprocess, sys, tempfile, time, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CONFIGS = {
+    "before": {"PDF_INDEX_METRIC": "l2", "PDF_VECTOR_STORAGE": "fp32", "PDF_INDEX_MMAP": "0"},
+    "fp32_mmap": {"PDF_INDEX_METRIC": "cosine", "PDF_VECTOR_STORAGE": "fp32", "PDF_INDEX_MMAP": "1"},
+    "fp16_mmap": {"PDF_INDEX_METRIC": "cosine", "PDF_VECTOR_STORAGE": "fp16", "PDF_INDEX_MMAP": "1"},
+    "sq8_mmap": {"PDF_INDEX_METRIC": "cosine", "PDF_VECTOR_STORAGE": "sq8", "PDF_INDEX_MMAP": "1"},
+}
+
+
+def _memory_mb():
+    """VmRSS / RssAnon from /proc/self/status and Pss from smaps_rollup (Linux only)."""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon"):
+                fields[name] = int(value.split()[0]) / 1024
+    pss = None
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return {"rss_mb": round(fields.get("VmRSS", 0), 1), "anon_mb": round(fields.get("RssAnon", 0), 1),
+            "pss_mb": round(pss, 1) if pss is not None else None}
+
+
+def worker(index_path: str, queries: int):
+    """Loads the index like rag_state, searches, then waits so all workers are measured together."""
+    import numpy as np
+    from vector_index import read_index, normalize_for
+
+    baseline = _memory_mb()
+    start = time.perf_counter()
+    index = read_index(index_path)
+    load_seconds = time.perf_counter() - start
+    rng = np.random.default_rng(1)
+    index.search(normalize_for(index, rng.standard_normal((queries, index.d))), 5)
+
+    print("ready", flush=True)
+    sys.stdin.readline()
+    print(json.dumps({"baseline": baseline, "loaded": _memory_mb(), "load_seconds": round(load_seconds, 3)}), flush=True)
+
+
+def build(path: str, config: dict, n_vectors: int, dim: int):
+    import numpy as np
+    import faiss
+    import vector_index
+
+    vector_index.INDEX_METRIC = config["PDF_INDEX_METRIC"]
+    vector_index.VECTOR_STORAGE = config["PDF_VECTOR_STORAGE"]
+    vectors = np.random.default_rng(0).standard_normal((n_vectors, dim)).astype("float32")
+    index = vector_index.build_index("flat", vectors, np.arange(n_vectors, dtype="int64"))
+    faiss.write_index(index, path)
+    return os.path.getsize(path)
+
+
+def run_config(name: str, n_vectors: int, dim: int, workers: int, queries: int, tmp_dir: str):
+    config = CONFIGS[name]
+    path = os.path.join(tmp_dir, f"{name}.faiss")
+    file_bytes = build(path, config, n_vectors, dim)
+
+    env = {**os.environ, **config}
+    procs = [
+        subprocess.Popen([sys.executable, __file__, "--worker", path, "--queries", str(queries)],
+                         env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    for p in procs:
+        line = p.stdout.readline()
+        while line and line.strip() != "ready":
+            line = p.stdout.readline()
+        if not line:
+            raise RuntimeError(f"{name} worker exited before loading the index")
+    reports = []
+    for p in procs:
+        p.stdin.write("\n")
+        p.stdin.flush()
+    for p in procs:
+        reports.append(json.loads(p.stdout.readline()))
+        p.wait()
+
+    def mean(key):
+        values = [r["loaded"][key] - r["baseline"][key] for r in reports if r["loaded"][key] is not None]
+        return round(sum(values) / len(values), 1) if values else None
+
+    return {
+        "config": name,
+        "vectors": n_vectors,
+        "workers": workers,
+        "file_mb": round(file_bytes / 2 ** 20, 1),
+        "rss_mb_per_worker": mean("rss_mb"),
+        "anon_mb_per_worker": mean("anon_mb"),
+        "pss_mb_per_worker": mean("pss_mb"),
+        "load_seconds": round(max(r["load_seconds"] for r in reports), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory of the PDF index per storage configuration.")
+    parser.add_argument("--vectors", type=int, default=500000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--configs", default=",".join(CONFIGS))
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.queries)
+        return
+
+    print(f"{'config':>10} {'file MB':>8} {'RSS MB':>8} {'anon MB':>8} {'PSS MB':>8} {'load s':>7}   (per worker, index only)")
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in [c for c in args.configs.split(",") if c.strip()]:
+            row = run_config(name, args.vectors, args.dim, args.workers, args.queries, tmp_dir)
+            rows.append(row)
+            print(f"{name:>10} {row['file_mb']:>8} {row['rss_mb_per_worker']!s:>8} {row['anon_mb_per_worker']!s:>8} "
+                  f"{row['pss_mb_per_worker']!s:>8} {row['load_seconds']:>7}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/index_memory.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "results": rows}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Burst of LLM calls through llm_gateway against the fake LLM server. (OPTIONAL developer tool)
+#
+# Starts benchmarks/fake_llm_server.py in-process with a server-side rate limit,
+# then fires --calls concurrent calls over --distinct different prompts (so
+# some are identical, like a burst of the same popular question) in two modes:
+#   direct   - no client-side limiter, no retries, no coalescing (previous behaviour)
+#   gateway  - token-bucket limiter, backoff with jitter and single-flight
+# and reports successful answers, upstream requests, 429s returned by the
+# server, latency and the gateway's queueing delay and retries.
+#
+#   python benchmarks/llm_burst.py --calls 200 --distinct 40 --server-rpm 60
+
+import argparse, asyncio, json, os, sys, time, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ["direct", "gateway"]
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+async def burst(calls: int, distinct: int):
+    import llm_gateway
+
+    infos = [{} for _ in range(calls)]
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            await llm_gateway.generate(f"Summarize topic {i % distinct} for the user.", caller="bench", info=infos[i])
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            failures += 1
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    queue_ms = [info.get("queue_ms", 0) for info in infos if info]
+    return {
+        "answered": calls - failures,
+        "failed": failures,
+        "p50_s": round(_pct(latencies, 0.5), 3) if latencies else None,
+        "p95_s": round(_pct(latencies, 0.95), 3) if latencies else None,
+        "mean_queue_ms": round(sum(queue_ms) / len(queue_ms), 1) if queue_ms else 0,
+        "retries": sum(info.get("retries", 0) for info in infos),
+        "coalesced": sum(1 for info in infos if info.get("coalesced")),
+    }
+
+
+def run_mode(mode: str, args, port: int):
+    import llm_gateway
+    from fake_llm_server import FakeLLM, serve
+
+    llm = FakeLLM(args.latency_ms, args.server_rpm)
+    server = serve(port, llm)
+    llm_gateway.set_backend(llm_gateway.HTTPBackend(f"http://127.0.0.1:{port}"))
+    if mode == "direct":
+        llm_gateway.LIMITER = llm_gateway.RateLimiter(rpm=0, tpm=0)
+        llm_gateway.LLM_MAX_RETRIES, llm_gateway.LLM_COALESCE = 0, False
+    else:
+        # Client-side limit just under the server's, so the bucket absorbs the burst instead of the 429s
+        llm_gateway.LIMITER = llm_gateway.RateLimiter(rpm=args.server_rpm * 0.9 if args.server_rpm else 0, tpm=0)
+        llm_gateway.LLM_MAX_RETRIES, llm_gateway.LLM_COALESCE = 4, True
+    llm_gateway.LLM_MAX_QUEUE_SECONDS = args.max_queue_seconds
+
+    try:
+        row = asyncio.run(burst(args.calls, args.distinct))
+    finally:
+        server.shutdown()
+    server_stats = llm.stats()
+    return {"mode": mode, "calls": args.calls, "distinct": args.distinct, **row,
+            "upstream_requests": server_stats["requests"], "server_429": server_stats["rate_limited"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM call burst: direct vs. through llm_gateway.")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=40)
+    parser.add_argument("--server-rpm", type=int, default=60)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--max-queue-seconds", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8101)
+    args = parser.parse_args()
+
+    # The thread pool behind the HTTP backend bounds concurrent upstream requests
+    os.environ.setdefault("AGENT_EXECUTOR_WORKERS", "64")
+
+    rows = []
+    print(f"{'mode':>8} {'answered':>9} {'upstream':>9} {'429s':>6} {'p50 s':>7} {'p95 s':>7} {'queue ms':>9} {'retries':>8} {'coalesced':>10}")
+    for i, mode in enumerate(MODES):
+        row = run_mode(mode, args, args.port + i)
+        rows.append(row)
+        print(f"{mode:>8} {row['answered']:>9} {row['upstream_requests']:>9} {row['server_429']:>6} {row['p50_s']!s:>7} "
+              f"{row['p95_s']!s:>7} {row['mean_queue_ms']:>9} {row['retries']:>8} {row['coalesced']:>10}")
+
+    os.makedirs("benchmarks/results", exist_ok=True)
+    with open("benchmarks/results/llm_burst.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "results": rows}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# PDF ingestion pipeline benchmark. (OPTIONAL developer tool)
+#
+# Generates a large report with generate_pdfs.generate_large_pdf and runs the
+# parse -> chunk -> embed half of ingestion on it, reporting pages/sec and peak RSS.
+# Each mode runs in a fresh subprocess so peak-RSS numbers don't contaminate each other.
+#
+#   python benchmarks/pdf_pipeline.py --pages 500
+#
+# Modes:
+#   sequential - single process: parse every page, then encode every chunk in one call
+#   streaming  - pdf_agent.prepare_documents (parallel page ranges + batched embedding)
+
+import argparse, json, os, resource, subprocess, sys, time, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ["sequential", "streaming"]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux. Children = largest single worker process.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(own, 1), round(children, 1)
+
+
+def _run_sequential(pdf_path):
+    from agents.pdf_parsing import page_count, parse_and_chunk_range
+    from rag_state import get_embedding_model
+
+    chunk_data_list, _ = parse_and_chunk_range(pdf_path, 0, page_count(pdf_path))
+    get_embedding_model().encode([d["text"] for d in chunk_data_list])
+    return len(chunk_data_list)
+
+
+def _run_streaming(pdf_path):
+    from agents.pdf_agent import prepare_documents
+
+    prepared = prepare_documents([pdf_path])
+    return sum(len(doc["chunks"]) for doc in prepared["docs"])
+
+
+def run_mode(mode, pdf_path, pages):
+    """Runs one mode in this process and returns its measurements."""
+    from rag_state import get_embedding_model
+
+    get_embedding_model()  # model load is not part of the pipeline cost
+    start = time.perf_counter()
+    chunks = _run_sequential(pdf_path) if mode == "sequential" else _run_streaming(pdf_path)
+    seconds = time.perf_counter() - start
+    own_rss, child_rss = _peak_rss_mb()
+    return {
+        "mode": mode,
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "pages_per_sec": round(pages / seconds, 2),
+        "peak_rss_mb": own_rss,
+        "peak_worker_rss_mb": child_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF parse/chunk/embed throughput and memory.")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--pdf", default="benchmarks/results/large_report.pdf")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--run-mode", choices=MODES, help=argparse.SUPPRESS)  # internal: child process
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.pdf, args.pages)))
+        return
+
+    from generate_pdfs import generate_large_pdf
+
+    os.makedirs(os.path.dirname(args.pdf), exist_ok=True)
+    print(f"Generating {args.pages}-page PDF at {args.pdf}...")
+    generate_large_pdf(args.pdf, args.pages)
+
+    rows = []
+    for mode in args.modes.split(","):
+        out = subprocess.run(
+            [sys.executable, __file__, "--run-mode", mode, "--pdf", args.pdf, "--pages", str(args.pages)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':>12} {'chunks':>7} {'seconds':>8} {'pages/s':>8} {'peak RSS MB':>12} {'worker RSS MB':>14}")
+    for row in rows:
+        print(f"{row['mode']:>12} {row['chunks']:>7} {row['seconds']:>8} {row['pages_per_sec']:>8} "
+              f"{row['peak_rss_mb']:>12} {row['peak_worker_rss_mb']:>14}")
+
+    with open("benchmarks/results/pdf_pipeline.jsonl", "a") as f:
+        f.write(json.dumps({"timestamp": str(datetime.datetime.now()), "results": rows}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
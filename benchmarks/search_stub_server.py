@@ -0,0 +1,137 @@
+# Local stand-in for DuckDuckGo and the arXiv API, for fetch-layer tests without network. (OPTIONAL developer tool)
+#
+# Speaks what fetch_layer sends with WEB_SEARCH_BACKEND=http / ARXIV_API_URL:
+#   GET /search?q=...&max_results=N    -> {"results": [{"title", "href", "body"}, ...]}
+#   GET /api/query?search_query=...&max_results=N&start=0
+#                                      -> an arXiv Atom feed (parsed by the arxiv package)
+#   GET /stats                         -> request counts and open connections
+# Every answer takes --latency-ms, like a slow remote API. Results are derived
+# from the query, so repeated queries get identical answers.
+#
+#   python benchmarks/search_stub_server.py --port 8102
+#   WEB_SEARCH_BACKEND=http WEB_SEARCH_URL=http://127.0.0.1:8102 ARXIV_API_URL=http://127.0.0.1:8102 uvicorn main:app
+
+import argparse, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+
+class SearchStub:
+    def __init__(self, latency_ms: float = 400, fail: bool = False):
+        self.latency = latency_ms / 1000
+        self.fail = fail  # answer 503 to every search (to test serving stale entries)
+        self._lock = threading.Lock()
+        self.counts = {"web": 0, "arxiv": 0, "connections": 0, "errors": 0}
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def web_results(self, query: str, max_results: int):
+        return [
+            {"title": f"{query.title()} - result {i + 1}",
+             "href": f"https://example.com/{'-'.join(query.lower().split())}/{i + 1}",
+             "body": f"Result {i + 1} about {query}: a snippet of a page that mentions {query} in passing."}
+            for i in range(max_results)
+        ]
+
+    def arxiv_feed(self, query: str, start: int, max_results: int):
+        entries = []
+        for i in range(start, start + max_results):
+            paper_id = f"2401.{10000 + i:05d}v1"
+            entries.append(f"""
+  <entry>
+    <id>http://arxiv.org/abs/{paper_id}</id>
+    <updated>2024-01-{i % 28 + 1:02d}T00:00:00Z</updated>
+    <published>2024-01-{i % 28 + 1:02d}T00:00:00Z</published>
+    <title>{escape(query.title())}: paper {i + 1}</title>
+    <summary>We study {escape(query)}. This abstract of paper {i + 1} describes a method and its results.</summary>
+    <author><name>A. Author</name></author>
+    <link href="http://arxiv.org/abs/{paper_id}" rel="alternate" type="text/html"/>
+    <link title="pdf" href="http://arxiv.org/pdf/{paper_id}" rel="related" type="application/pdf"/>
+    <arxiv:primary_category xmlns:arxiv="http://arxiv.org/schemas/atom" term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+  </entry>""")
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <id>http://arxiv.org/api/stub</id>
+  <title type="html">ArXiv Query: {escape(query)}</title>
+  <updated>2024-01-01T00:00:00Z</updated>
+  <opensearch:totalResults>{max_results}</opensearch:totalResults>
+  <opensearch:startIndex>{start}</opensearch:startIndex>
+  <opensearch:itemsPerPage>{max_results}</opensearch:itemsPerPage>{"".join(entries)}
+</feed>
+"""
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def make_handler(stub: SearchStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so reused client sessions reuse the connection
+
+        def setup(self):
+            super().setup()
+            stub.count("connections")
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == "/stats":
+                return self._send(200, json.dumps(stub.stats()).encode(), "application/json")
+            if url.path not in ("/search", "/api/query"):
+                return self._send(404, b'{"error": "not found"}', "application/json")
+
+            time.sleep(stub.latency)
+            if stub.fail:
+                stub.count("errors")
+                return self._send(503, b'{"error": "Unavailable"}', "application/json")
+            max_results = int(params.get("max_results", 10))
+            if url.path == "/search":
+                stub.count("web")
+                body = json.dumps({"results": stub.web_results(params.get("q", ""), max_results)}).encode()
+                return self._send(200, body, "application/json")
+            stub.count("arxiv")
+            feed = stub.arxiv_feed(params.get("search_query", ""), int(params.get("start", 0)), max_results)
+            self._send(200, feed.encode(), "application/atom+xml")
+
+    return Handler
+
+
+def serve(port: int, stub: SearchStub):
+    """Starts the server in a daemon thread and returns it (call .shutdown() to stop)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub web-search and arXiv API server for fetch_layer.")
+    parser.add_argument("--port", type=int, default=8102)
+    parser.add_argument("--latency-ms", type=float, default=400)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(SearchStub(args.latency_ms)))
+    print(f"Search stub listening on http://127.0.0.1:{args.port} (latency {args.latency_ms:.0f} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
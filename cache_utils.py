@@ -0,0 +1,88 @@
+import sys, time, threading
+from collections import OrderedDict
+
+import metrics
+
+# Small in-process caches shared by the agents and the controller.
+
+
+def estimate_size(value):
+    """Rough byte size of a cached value (numpy arrays, strings, tuples/lists/dicts of them)."""
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class TTLLRUCache:
+    """
+    Thread-safe LRU cache bounded by total (estimated) bytes, with a per-entry TTL.
+    Keeps hit/miss/eviction counters for the /cache/stats endpoint (hits and
+    misses are also counted in /metrics under the cache's name).
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl_seconds: float, sizeof=estimate_size):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        metrics.cache_event(self.name, entry is not None)
+        return default if entry is None else entry[2]
+
+    def put(self, key, value):
+        size = self._sizeof(key) + self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
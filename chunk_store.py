@@ -0,0 +1,236 @@
+import os, re, json, pickle, sqlite3, threading
+
+# sqlite chunk store for the PDF index.
+#
+# One row per chunk, keyed by the chunk's FAISS ID, with its source file and page
+# in indexed columns. Queries fetch only the k rows they retrieved, so nothing
+# proportional to the corpus text is held in memory and opening the store takes
+# constant time. Replaces the pickled pdf_store/data.pkl, which is imported once
+# and renamed to data.pkl.migrated.
+#
+# Chunk IDs are never reused, so rows can be written before the index generation
+# that refers to them is published. Rows of replaced documents are deleted after
+# the new generation is published; a query still on the old generation simply
+# skips IDs whose rows are gone.
+#
+# An FTS5 table over the chunk text is the keyword (BM25) index for hybrid
+# retrieval; triggers keep it in step with every insert and delete.
+
+CHUNK_STORE_FILE = "chunks.sqlite"
+
+# Dropped from keyword queries; BM25's IDF would mostly ignore them anyway.
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "does", "did", "do", "for", "from", "how", "in", "is",
+    "it", "its", "of", "on", "or", "our", "that", "the", "this", "to", "was", "we", "what", "when",
+    "where", "which", "who", "why", "with", "according", "say", "says", "about",
+}
+
+
+def keyword_query(query: str):
+    """
+    FTS5 MATCH expression for a free-text query: an OR of its terms, where tokens
+    with inner punctuation (product codes, IPs, dates like NB-300) become phrases
+    so their parts must appear together. Returns "" if nothing is searchable.
+    """
+    terms = []
+    for token in query.split():
+        words = re.findall(r"\w+", token.lower())
+        if len(words) == 1 and words[0] in _STOPWORDS:
+            continue
+        if words:
+            terms.append('"' + " ".join(words) + '"')
+    return " OR ".join(dict.fromkeys(terms))
+
+
+class ChunkStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.keyword_enabled = False
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id INTEGER PRIMARY KEY, source TEXT NOT NULL, page INTEGER, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_source_page ON chunks(source, page)")
+            conn.execute("CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, content_hash TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self.keyword_enabled = self._create_keyword_index(conn)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _create_keyword_index(self, conn):
+        """Creates the FTS5 index (backfilling stores from before it existed). False if FTS5 is unavailable."""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+                " text, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+        except sqlite3.OperationalError as e:
+            print(f"--- CHUNK_STORE: Keyword index unavailable ({e}); retrieval is vector-only. ---")
+            return False
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN"
+            " INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text); END"
+        )
+        conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN"
+            " INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text); END"
+        )
+        if not exists:
+            conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        return True
+
+    # ---------- Reads ----------
+
+    def get_many(self, ids: list):
+        """Returns {id: (text, metadata)} for the IDs that exist."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        return {chunk_id: (text, json.loads(meta)) for chunk_id, text, meta in rows}
+
+    def by_source(self, source: str, page: int = None):
+        """Returns [(id, text, metadata)] of one document (optionally one page), in page order."""
+        query = "SELECT id, text, metadata FROM chunks WHERE source = ?"
+        params = [source]
+        if page is not None:
+            query += " AND page = ?"
+            params.append(page)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY page, id", params).fetchall()
+        return [(chunk_id, text, json.loads(meta)) for chunk_id, text, meta in rows]
+
+    def sources(self):
+        """Returns {name: {"content_hash", "chunks"}} for every ingested document."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT s.name, s.content_hash, COUNT(c.id) FROM sources s"
+                " LEFT JOIN chunks c ON c.source = s.name GROUP BY s.name"
+            ).fetchall()
+        return {name: {"content_hash": content_hash, "chunks": n} for name, content_hash, n in rows}
+
+    def source_ids(self, sources: list):
+        if not sources:
+            return []
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT id FROM chunks WHERE source IN ({','.join('?' * len(sources))})", list(sources)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def keyword_search(self, query: str, k: int):
+        """Returns the IDs of the k best BM25 matches for `query`, best first."""
+        match = keyword_query(query)
+        with self._lock:
+            conn = self._connect()
+            if not match or not self.keyword_enabled:
+                return []
+            rows = conn.execute(
+                "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?", (match, k)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            chunks = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            documents = conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {"documents": documents, "chunks": chunks, "file_mb": round(size / 2 ** 20, 2)}
+
+    # ---------- Writes (callers serialize these) ----------
+
+    def add_document(self, source: str, content_hash: str, chunks: list, metadata: list):
+        """Stores one document's chunks under fresh, never-reused IDs and returns the IDs."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM meta WHERE name = 'next_id'").fetchone()
+            start = row[0] if row else 0
+            ids = list(range(start, start + len(chunks)))
+            conn.executemany(
+                "INSERT INTO chunks (id, source, page, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(i, source, meta.get("page_number"), text, json.dumps(meta)) for i, text, meta in zip(ids, chunks, metadata)],
+            )
+            conn.execute("INSERT OR REPLACE INTO sources (name, content_hash) VALUES (?, ?)", (source, content_hash))
+            conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('next_id', ?)", (start + len(chunks),))
+            conn.commit()
+        return ids
+
+    def delete_chunks(self, ids: list, sources: list = ()):
+        """Deletes chunk rows and drops `sources` from the document list, in one transaction."""
+        if not ids and not sources:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM chunks WHERE id = ?", [(int(i),) for i in ids])
+            conn.executemany("DELETE FROM sources WHERE name = ?", [(name,) for name in sources])
+            conn.commit()
+
+    def import_data_store(self, data_store: dict):
+        """Imports a pickled data store (ID-keyed dicts, or the original positional lists)."""
+        if isinstance(data_store.get("chunks"), list):
+            items = list(enumerate(zip(data_store["chunks"], data_store["metadata"])))
+            hashes = {}
+            next_id = len(items)
+        else:
+            items = [(i, (data_store["chunks"][i], data_store["metadata"][i])) for i in data_store["chunks"]]
+            hashes = {name: entry.get("content_hash") for name, entry in data_store["sources"].items()}
+            next_id = data_store["next_id"]
+
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, source, page, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(int(i), meta["source"], meta.get("page_number"), text, json.dumps(meta)) for i, (text, meta) in items],
+            )
+            names = {meta["source"] for _, (_, meta) in items} | set(hashes)
+            conn.executemany(
+                "INSERT OR REPLACE INTO sources (name, content_hash) VALUES (?, ?)",
+                [(name, hashes.get(name)) for name in names],
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('next_id', ?)", (next_id,))
+            conn.commit()
+        return len(items)
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def open_chunk_store(db_path: str = "pdf_store"):
+    """Returns the process-wide ChunkStore for `db_path`, importing a legacy data.pkl on first use."""
+    with _STORES_LOCK:
+        store = _STORES.get(db_path)
+        if store is None:
+            store = ChunkStore(os.path.join(db_path, CHUNK_STORE_FILE))
+            _migrate_pickle(store, db_path)
+            _STORES[db_path] = store
+    return store
+
+
+def _migrate_pickle(store: ChunkStore, db_path: str):
+    data_file = os.path.join(db_path, "data.pkl")
+    if not os.path.exists(data_file):
+        return
+    print(f"--- CHUNK_STORE: Importing {data_file} into {store.path}... ---")
+    try:
+        with open(data_file, "rb") as f:
+            n = store.import_data_store(pickle.load(f))
+        os.replace(data_file, data_file + ".migrated")
+    except FileNotFoundError:
+        return  # another worker process migrated it first
+    print(f"--- CHUNK_STORE: Imported {n} chunks. ---")
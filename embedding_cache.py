@@ -0,0 +1,200 @@
+import os, hashlib, sqlite3, threading, time
+import numpy as np
+
+from rag_state import get_embedding_model, EMBEDDING_MODEL_NAME
+from cache_utils import TTLLRUCache
+import metrics
+
+# Content-addressed embedding cache.
+#
+# Vectors are stored as raw float32 blobs in sqlite, keyed by
+# sha256(model name, normalized chunk text), so an unchanged chunk is never
+# re-encoded no matter which file or upload it came from. Least-recently-used
+# rows are evicted once the stored vectors exceed EMBEDDING_CACHE_MAX_BYTES.
+# WAL mode lets the server and the ingestion worker processes share the file.
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "pdf_store/embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# In-process LRU in front of the disk cache for query embeddings.
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+QUERY_EMBEDDING_CACHE = TTLLRUCache("query_embeddings", QUERY_CACHE_MAX_BYTES, QUERY_CACHE_TTL_SECONDS)
+
+# Eviction trims down to this fraction of the budget so it doesn't run on every insert.
+_EVICT_TARGET = 0.9
+
+
+def normalize_text(text: str):
+    """Whitespace differences (e.g. from PDF extraction) should not change the cache key."""
+    return " ".join(text.split())
+
+
+def normalize_query(query: str):
+    """Queries that differ only in case or spacing share cache entries."""
+    return " ".join(query.lower().split())
+
+
+def cache_key(text: str, model_name: str = EMBEDDING_MODEL_NAME):
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+            conn.commit()
+            self._total_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: list):
+        """Returns {key: float32 vector} for the keys present in the cache."""
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            # sqlite limits the number of bound parameters per statement
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[bytes(key)] = np.frombuffer(blob, dtype="float32")
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                conn.commit()
+        return found
+
+    def put_many(self, items: list):
+        """Stores [(key, vector)] and evicts least-recently-used rows if over budget."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype="float32").tobytes(), now) for key, vector in items]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._total_bytes += sum(len(blob) for _, blob, _ in rows)
+            if self._total_bytes > self.max_bytes:
+                self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        target = int(self.max_bytes * _EVICT_TARGET)
+        self._total_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        while self._total_bytes > target:
+            rows = conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key, _ in rows])
+            self._total_bytes -= sum(size for _, size in rows)
+
+    def seconds_per_text(self):
+        """Running average model cost per encoded text, used to estimate time saved by hits."""
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM stats WHERE name = 'seconds_per_text'").fetchone()
+        return row[0] if row else 0.0
+
+    def record_encode(self, n_texts: int, seconds: float):
+        if n_texts <= 0:
+            return
+        per_text = seconds / n_texts
+        previous = self.seconds_per_text()
+        value = per_text if previous == 0.0 else 0.8 * previous + 0.2 * per_text
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO stats (name, value) VALUES ('seconds_per_text', ?)", (value,))
+            conn.commit()
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_embedding_cache():
+    """Returns the process-wide EmbeddingCache (opened lazily)."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = EmbeddingCache()
+    return _CACHE
+
+
+def new_stats():
+    return {"hits": 0, "misses": 0, "hit_rate": 0.0, "seconds_saved": 0.0}
+
+
+def encode_cached(texts: list, stats: dict = None):
+    """
+    Drop-in for embedding_model.encode(texts) that consults the cache first and
+    only sends misses to the model (the model is not even loaded if all texts hit).
+    Updates `stats` in place with hits/misses/hit_rate/seconds_saved.
+    """
+    cache = get_embedding_cache()
+    keys = [cache_key(t) for t in texts]
+    found = cache.get_many(list(set(keys)))
+
+    # Encode each distinct missing text once, even if it repeats within the batch.
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+
+    hits = sum(1 for key in keys if key not in missing)
+    metrics.cache_event("embeddings", True, hits)
+    metrics.cache_event("embeddings", False, len(keys) - hits)
+
+    if missing:
+        embedding_model = get_embedding_model() # <--- LAZY LOAD CALL
+        # Timed after the load: a cold model must not inflate the persisted per-text cost.
+        start = time.perf_counter()
+        with metrics.span("embed.encode", texts=len(missing)):
+            vectors = np.asarray(embedding_model.encode(list(missing.values())), dtype="float32")
+        cache.record_encode(len(missing), time.perf_counter() - start)
+        new_items = list(zip(missing.keys(), vectors))
+        cache.put_many(new_items)
+        found.update(new_items)
+
+    if stats is not None:
+        stats["hits"] += hits
+        stats["misses"] += len(keys) - hits
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+        stats["seconds_saved"] = round(stats["seconds_saved"] + hits * cache.seconds_per_text(), 4)
+
+    if not keys:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack([found[key] for key in keys])
+
+
+def embed_query(query: str):
+    """Returns the (1, dim) embedding of a normalized query, checking the in-process LRU first."""
+    norm = normalize_query(query)
+    with metrics.span("embed.query") as span:
+        query_emb = QUERY_EMBEDDING_CACHE.get(norm)
+        span["cached"] = query_emb is not None
+        if query_emb is None:
+            query_emb = encode_cached([norm])
+            QUERY_EMBEDDING_CACHE.put(norm, query_emb)
+    return query_emb
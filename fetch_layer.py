@@ -0,0 +1,325 @@
+import os, json, time, sqlite3, hashlib, asyncio, threading, contextvars
+
+from agents.base import run_blocking
+import metrics
+
+# Shared fetch layer for the external search agents.
+#
+# Connections are reused instead of opened per query: one DDGS client per
+# worker thread (its HTTP client keeps connections alive; the client is not
+# thread-safe) and one process-wide arxiv.Client, whose requests.Session is
+# reused. arXiv's API terms ask for a pause between requests: callers reserve
+# the next request slot under a lock and wait for it on the event loop, so
+# queued searches don't hold pool threads while they wait.
+#
+# Results are cached on disk (sqlite, WAL) keyed by kind, normalized query and
+# request parameters, with a TTL per kind: web results go stale quickly (news),
+# papers don't. Within FETCH_STALE_SECONDS_<KIND> after the TTL an entry is
+# still served at once while a single background refresh replaces it
+# (stale-while-revalidate). Past that window the query is fetched again; if the
+# upstream fails, an expired entry is returned rather than an error.
+#
+# WEB_SEARCH_BACKEND=http and ARXIV_API_URL point both kinds at
+# benchmarks/search_stub_server.py instead of DuckDuckGo and export.arxiv.org.
+
+FETCH_CACHE_ENABLED = os.getenv("FETCH_CACHE_ENABLED", "1") == "1"
+FETCH_CACHE_PATH = os.getenv("FETCH_CACHE_PATH", "pdf_store/fetch_cache.sqlite")
+FETCH_CACHE_MAX_ROWS = int(os.getenv("FETCH_CACHE_MAX_ROWS", "20000"))
+
+FETCH_TTLS = {
+    "web": float(os.getenv("FETCH_TTL_WEB_SECONDS", "900")),
+    "arxiv": float(os.getenv("FETCH_TTL_ARXIV_SECONDS", "86400")),
+}
+FETCH_STALE_SECONDS = {
+    "web": float(os.getenv("FETCH_STALE_SECONDS_WEB", "3600")),
+    "arxiv": float(os.getenv("FETCH_STALE_SECONDS_ARXIV", "604800")),
+}
+
+WEB_SEARCH_BACKEND = os.getenv("WEB_SEARCH_BACKEND", "ddgs")  # ddgs | http
+WEB_SEARCH_URL = os.getenv("WEB_SEARCH_URL", "http://127.0.0.1:8102")
+ARXIV_API_URL = os.getenv("ARXIV_API_URL", "")  # e.g. http://127.0.0.1:8102 (stub server); empty = export.arxiv.org
+FETCH_HTTP_TIMEOUT = float(os.getenv("FETCH_HTTP_TIMEOUT", "15"))
+ARXIV_DELAY_SECONDS = float(os.getenv("ARXIV_DELAY_SECONDS", "3"))
+
+_EVICT_TARGET = 0.9
+
+
+def normalize_query(query: str):
+    """Queries that differ only in case or spacing share cache entries."""
+    return " ".join(query.lower().split())
+
+
+def cache_key(kind: str, query: str, params: dict):
+    payload = json.dumps([kind, normalize_query(query), params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).digest()
+
+
+# ---------- Disk cache ----------
+
+class FetchCache:
+    def __init__(self, path=FETCH_CACHE_PATH, max_rows=FETCH_CACHE_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = None
+        self._rows = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key BLOB PRIMARY KEY, kind TEXT NOT NULL, query TEXT NOT NULL,"
+                " value TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_fetched_at ON results(fetched_at)")
+            conn.commit()
+            self._rows = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: bytes):
+        """Returns (value, fetched_at) or None."""
+        with self._lock:
+            row = self._connect().execute("SELECT value, fetched_at FROM results WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: bytes, kind: str, query: str, value):
+        with self._lock:
+            conn = self._connect()
+            exists = conn.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, kind, query, value, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, normalize_query(query), json.dumps(value), time.time()),
+            )
+            if not exists:
+                self._rows += 1
+            if self._rows > self.max_rows:
+                # Oldest fetches go first; they are the most likely to be expired anyway
+                drop = self._rows - int(self.max_rows * _EVICT_TARGET)
+                conn.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY fetched_at LIMIT ?)", (drop,))
+                self._rows = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            conn.commit()
+
+    def size(self):
+        with self._lock:
+            self._connect()
+            return self._rows
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_fetch_cache():
+    """Returns the process-wide FetchCache (opened lazily)."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = FetchCache()
+    return _CACHE
+
+
+# ---------- Persistent clients (blocking; run in the agent thread pool) ----------
+
+_LOCAL = threading.local()
+_ARXIV_CLIENT = None
+_ARXIV_LOCK = threading.Lock()  # guards _arxiv_next_at
+_arxiv_next_at = 0.0
+
+
+def _ddgs():
+    client = getattr(_LOCAL, "ddgs", None)
+    if client is None:
+        from duckduckgo_search import DDGS
+
+        client = _LOCAL.ddgs = DDGS(timeout=int(FETCH_HTTP_TIMEOUT))
+    return client
+
+
+def _http_session():
+    session = getattr(_LOCAL, "session", None)
+    if session is None:
+        import requests
+
+        session = _LOCAL.session = requests.Session()
+    return session
+
+
+def fetch_web(query: str, max_results: int, region: str, safesearch: str):
+    """Blocking web search over this thread's persistent client."""
+    if WEB_SEARCH_BACKEND == "http":
+        response = _http_session().get(
+            WEB_SEARCH_URL.rstrip("/") + "/search",
+            params={"q": query, "max_results": max_results, "region": region, "safesearch": safesearch},
+            timeout=FETCH_HTTP_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()["results"]
+    try:
+        return list(_ddgs().text(query, region=region, max_results=max_results, safesearch=safesearch))
+    except Exception:
+        # Don't keep a client whose session may be broken (e.g. after a rate-limit block)
+        _LOCAL.ddgs = None
+        raise
+
+
+def _arxiv_client():
+    global _ARXIV_CLIENT
+    if _ARXIV_CLIENT is None:
+        import arxiv
+
+        # No delay of its own: requests are paced by _arxiv_slot()
+        client = arxiv.Client(page_size=100, delay_seconds=0, num_retries=2)
+        if ARXIV_API_URL:
+            client.query_url_format = ARXIV_API_URL.rstrip("/") + "/api/query?{}"
+        _ARXIV_CLIENT = client
+    return _ARXIV_CLIENT
+
+
+def _arxiv_slot():
+    """Reserves the next arXiv request slot; returns the seconds until it starts."""
+    global _arxiv_next_at
+    with _ARXIV_LOCK:
+        now = time.monotonic()
+        start = max(now, _arxiv_next_at)
+        _arxiv_next_at = start + ARXIV_DELAY_SECONDS
+    return start - now
+
+
+def _fetch_arxiv(query: str, max_results: int, sort_by: str):
+    """Blocking arXiv search over the shared client."""
+    import arxiv
+
+    search = arxiv.Search(query=query, max_results=max_results, sort_by=getattr(arxiv.SortCriterion, sort_by))
+    return [
+        {
+            "title": r.title,
+            "summary": r.summary,
+            "url": r.entry_id,
+            "published": str(r.published),
+        }
+        for r in _arxiv_client().results(search)
+    ]
+
+
+async def fetch_arxiv(query: str, max_results: int, sort_by: str):
+    """arXiv search, at most one request per ARXIV_DELAY_SECONDS; waits without holding a thread."""
+    await asyncio.sleep(_arxiv_slot())
+    return await run_blocking(_fetch_arxiv, query, max_results, sort_by)
+
+
+# ---------- Cached fetch with stale-while-revalidate ----------
+
+_STATS = {kind: {"hits": 0, "stale_hits": 0, "misses": 0, "stale_on_error": 0,
+                 "refreshes": 0, "refresh_errors": 0, "fetch_seconds": 0.0}
+          for kind in FETCH_TTLS}
+_REFRESHING = set()
+_TASKS = set()
+
+
+async def _fetch_and_store(kind: str, key: bytes, query: str, fetch_fn, args):
+    start = time.perf_counter()
+    with metrics.span(f"fetch.{kind}.upstream") as span:
+        value = await fetch_fn(*args) if asyncio.iscoroutinefunction(fetch_fn) else await run_blocking(fetch_fn, *args)
+        span["results"] = len(value)
+    _STATS[kind]["fetch_seconds"] = round(_STATS[kind]["fetch_seconds"] + time.perf_counter() - start, 3)
+    # An empty answer is often a soft block or a transient hiccup; don't pin it for a whole TTL
+    if FETCH_CACHE_ENABLED and value:
+        await run_blocking(get_fetch_cache().put, key, kind, query, value)
+    return value
+
+
+async def _refresh(kind: str, key: bytes, query: str, fetch_fn, args):
+    try:
+        await _fetch_and_store(kind, key, query, fetch_fn, args)
+        _STATS[kind]["refreshes"] += 1
+    except Exception as e:
+        _STATS[kind]["refresh_errors"] += 1
+        print(f"--- FETCH: Background refresh of {kind} '{query[:60]}' failed: {e} ---")
+    finally:
+        _REFRESHING.discard(key)
+
+
+async def cached_fetch(kind: str, query: str, params: dict, fetch_fn, info: dict = None):
+    """
+    Returns fetch_fn(query, *params.values()) through the result cache (fetch_fn is
+    blocking, or a coroutine function that handles its own blocking work).
+    Fills `info` with cache ("hit", "stale", "miss", "stale_on_error") and age_seconds.
+    """
+    info = {} if info is None else info
+    with metrics.span(f"fetch.{kind}") as span:
+        try:
+            return await _cached_fetch(kind, query, params, fetch_fn, info)
+        finally:
+            span["cache"] = info.get("cache", "error")
+            metrics.cache_event(f"search_{kind}", info.get("cache") in ("hit", "stale", "stale_on_error"))
+
+
+async def _cached_fetch(kind: str, query: str, params: dict, fetch_fn, info: dict):
+    args = (query, *params.values())
+    key = cache_key(kind, query, params)
+    stats = _STATS[kind]
+
+    entry = await run_blocking(get_fetch_cache().get, key) if FETCH_CACHE_ENABLED else None
+    if entry is not None:
+        value, fetched_at = entry
+        age = time.time() - fetched_at
+        info["age_seconds"] = round(age, 1)
+        if age < FETCH_TTLS[kind]:
+            stats["hits"] += 1
+            info["cache"] = "hit"
+            return value
+        if age < FETCH_TTLS[kind] + FETCH_STALE_SECONDS[kind]:
+            stats["stale_hits"] += 1
+            info["cache"] = "stale"
+            if key not in _REFRESHING:
+                _REFRESHING.add(key)
+                # A fresh context: the refresh outlives this request and must not add spans to its trace
+                task = contextvars.Context().run(asyncio.ensure_future, _refresh(kind, key, query, fetch_fn, args))
+                _TASKS.add(task)
+                task.add_done_callback(_TASKS.discard)
+            return value
+
+    stats["misses"] += 1
+    try:
+        value = await _fetch_and_store(kind, key, query, fetch_fn, args)
+    except Exception:
+        if entry is None:
+            raise
+        stats["stale_on_error"] += 1
+        info["cache"] = "stale_on_error"
+        return entry[0]
+    info["cache"] = "miss"
+    info.pop("age_seconds", None)
+    return value
+
+
+async def search_web(query: str, max_results: int = 10, region: str = "wt-wt", safesearch: str = "moderate", info: dict = None):
+    """Web results for `query` (list of DDGS dicts: title, href, body)."""
+    params = {"max_results": max_results, "region": region, "safesearch": safesearch}
+    return await cached_fetch("web", query, params, fetch_web, info)
+
+
+async def search_arxiv(query: str, max_results: int = 5, sort_by: str = "SubmittedDate", info: dict = None):
+    """arXiv papers for `query` (list of dicts: title, summary, url, published)."""
+    params = {"max_results": max_results, "sort_by": sort_by}
+    return await cached_fetch("arxiv", query, params, fetch_arxiv, info)
+
+
+def stats():
+    """Per-kind hit/stale/miss counters, TTLs and cache size (for /cache/stats)."""
+    report = {}
+    for kind, counts in _STATS.items():
+        total = counts["hits"] + counts["stale_hits"] + counts["misses"]
+        report[kind] = {
+            **counts,
+            "hit_rate": round((counts["hits"] + counts["stale_hits"]) / total, 4) if total else 0.0,
+            "ttl_seconds": FETCH_TTLS[kind],
+            "stale_seconds": FETCH_STALE_SECONDS[kind],
+        }
+    report["rows"] = get_fetch_cache().size() if FETCH_CACHE_ENABLED else 0
+    return report
@@ -5,14 +5,47 @@ async function sendQuery() {
  const query = document.getElementById("queryInput").value;
  if (!query) return alert("Please enter a query!");
 
- // We use 'API_BASE' + '/ask' which resolves to just '/ask'
- const res = await fetch(`${API_BASE}/ask?query=${encodeURIComponent(query)}`, {
+ const responseOutput = document.getElementById("responseOutput");
+ const logsOutput = document.getElementById("logsOutput");
+ responseOutput.innerText = "";
+ logsOutput.innerText = "Routing...";
+
+ // /ask/stream sends one JSON event per line: routing, agent progress, answer tokens, final.
+ const res = await fetch(`${API_BASE}/ask/stream?query=${encodeURIComponent(query)}`, {
   method: "POST"
  });
 
- const data = await res.json();
- document.getElementById("responseOutput").innerText = data.response;
- document.getElementById("logsOutput").innerText = JSON.stringify(data.logs, null, 2);
+ const reader = res.body.getReader();
+ const decoder = new TextDecoder();
+ let buffer = "";
+ let progress = [];
+
+ const handleEvent = (event) => {
+  if (event.type === "routing") {
+   progress = [`${event.decision}: ${event.agents_used.join(", ")}`];
+  } else if (event.type === "agent") {
+   progress.push(`${event.agent} ${event.status} (${event.seconds}s)`);
+  } else if (event.type === "token") {
+   responseOutput.innerText += event.text;
+  } else if (event.type === "final") {
+   responseOutput.innerText = event.response;
+   logsOutput.innerText = JSON.stringify(event.logs, null, 2);
+   return;
+  }
+  logsOutput.innerText = progress.join("\n");
+ };
+
+ while (true) {
+  const { done, value } = await reader.read();
+  if (done) break;
+  buffer += decoder.decode(value, { stream: true });
+  const lines = buffer.split("\n");
+  buffer = lines.pop();
+  for (const line of lines) {
+   if (line.trim()) handleEvent(JSON.parse(line));
+  }
+ }
+ if (buffer.trim()) handleEvent(JSON.parse(buffer));
 }
 
 // Upload PDF to /upload_pdf
@@ -30,5 +63,29 @@ async function uploadPDF() {
  });
 
  const data = await res.json();
- alert(data.status || "PDF uploaded!");
+ if (!data.job_id) return alert(data.status || "PDF uploaded!");
+
+ // Ingestion runs in the background; poll the job until it finishes.
+ const job = await waitForJob(data.job_id);
+ if (job.status === "done") {
+  const cache = job.result.embedding_cache;
+  alert(`PDF processed and indexed (${job.result.chunks_added} chunks in ${job.total_seconds}s, ` +
+        `embedding cache hit rate ${Math.round(cache.hit_rate * 100)}%)`);
+ } else {
+  alert(`PDF indexing failed: ${job.error}`);
+ }
+}
+
+// Poll /jobs/{id} until the ingestion job is done or failed
+async function waitForJob(jobId, intervalMs = 1000) {
+ while (true) {
+  const res = await fetch(`${API_BASE}/jobs/${jobId}`);
+  if (!res.ok) {
+   // Unknown job: the server restarted or the job was evicted
+   return { status: "failed", error: `job status unavailable (HTTP ${res.status})` };
+  }
+  const job = await res.json();
+  if (job.status === "done" || job.status === "failed") return job;
+  await new Promise(resolve => setTimeout(resolve, intervalMs));
+ }
 }
\ No newline at end of file
@@ -3,9 +3,6 @@ from reportlab.pdfgen import canvas
 import os
 import textwrap
 
-# Create folder if it doesn't exist
-os.makedirs("sample_pdfs", exist_ok=True)
-
 # --- Define the function to draw wrapped text (Unchanged from last fix) ---
 def draw_wrapped_text(c, text, x, y_start, font_size, max_width):
     """
@@ -114,9 +111,8 @@ docs = {
     """
 }
 
-# Generate the PDFs
-for filename, text in docs.items():
-    path = os.path.join("sample_pdfs", filename)
+def write_pdf(path, title, text):
+    """Writes one document: a bold title followed by wrapped body text (one page)."""
     c = canvas.Canvas(path, pagesize=A4)
     width, height = A4
     margin = 50
@@ -125,7 +121,7 @@ for filename, text in docs.items():
 
     # Draw Title
     c.setFont("Helvetica-Bold", 14)
-    c.drawString(text_x, text_y_start, filename.replace(".pdf", ""))
+    c.drawString(text_x, text_y_start, title)
     
     # Adjust Y position down for the body text
     body_y_start = text_y_start - 30
@@ -136,6 +132,37 @@ for filename, text in docs.items():
             
     c.save()
 
-print("\n----------------------------------------------------------------------")
-print(" 5 NebulaByte sample PDFs generated successfully in 'sample_pdfs/' folder.")
-print("----------------------------------------------------------------------\n")
\ No newline at end of file
+
+def generate_large_pdf(path, pages=500):
+    """
+    Builds a many-page report for ingestion benchmarks by cycling through the
+    sample documents, one section per page (used by benchmarks/pdf_pipeline.py).
+    """
+    c = canvas.Canvas(path, pagesize=A4)
+    width, height = A4
+    margin = 50
+    sections = list(docs.items())
+
+    for page in range(pages):
+        filename, text = sections[page % len(sections)]
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(margin, height - margin, f"{filename.replace('.pdf', '')} - Part {page + 1}")
+        c.setFont("Helvetica", 10)
+        draw_wrapped_text(c, text, margin, height - margin - 30, 10, width - margin)
+        c.showPage()
+
+    c.save()
+    return path
+
+
+if __name__ == "__main__":
+    # Create folder if it doesn't exist
+    os.makedirs("sample_pdfs", exist_ok=True)
+
+    # Generate the PDFs
+    for filename, text in docs.items():
+        write_pdf(os.path.join("sample_pdfs", filename), filename.replace(".pdf", ""), text)
+
+    print("\n----------------------------------------------------------------------")
+    print(" 5 NebulaByte sample PDFs generated successfully in 'sample_pdfs/' folder.")
+    print("----------------------------------------------------------------------\n")
@@ -0,0 +1,243 @@
+import os, uuid, time, datetime, threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Background PDF ingestion.
+#
+# /upload_pdf only streams the file to disk and enqueues a job. The CPU-heavy half
+# (PyMuPDF parsing, chunking, SentenceTransformer encoding) runs in a process pool so
+# it never competes with the event loop for the GIL; the indexing half runs on a
+# single thread in the server process because it has to publish the new in-memory
+# index generation (and a single writer keeps ingestion ordered).
+#
+# A worker that dies (OOM on a huge PDF, a crash in PyMuPDF) breaks the whole process
+# pool: it is then replaced, and the jobs it failed are retried once on the new pool.
+# A job that breaks the pool a second time is marked failed.
+
+# Number of worker processes. Each one loads its own embedding model, so keep it small.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+
+# Attempts per job when worker processes die under it (the first one included).
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "2"))
+
+# Finished (done/failed) jobs stay visible at /jobs/{id} for this long, and at most
+# this many of them are kept.
+JOB_TTL_SECONDS = float(os.getenv("INGEST_JOB_TTL_SECONDS", "3600"))
+MAX_FINISHED_JOBS = int(os.getenv("INGEST_MAX_FINISHED_JOBS", "1000"))
+
+JOB_STAGES = ["parsing", "chunking", "embedding", "indexing"]
+
+# --- Global Job State ---
+JOBS = {}
+_JOBS_LOCK = threading.Lock()
+
+_POOLS = {"process": None, "index": None, "progress_queue": None, "progress_thread": None}
+_POOLS_LOCK = threading.Lock()
+
+# Set inside worker processes by _init_worker.
+_WORKER_PROGRESS_QUEUE = None
+
+
+# ---------- Worker-process side ----------
+
+def _init_worker(progress_queue):
+    global _WORKER_PROGRESS_QUEUE
+    _WORKER_PROGRESS_QUEUE = progress_queue
+
+
+def _prepare_in_worker(job_id: str, file_paths: list):
+    """Runs in a worker process: parse, chunk and embed, streaming stage events back."""
+    from agents.pdf_agent import prepare_documents
+
+    def progress(stage, status, seconds=None):
+        _WORKER_PROGRESS_QUEUE.put((job_id, stage, status, seconds))
+
+    return prepare_documents(file_paths, progress)
+
+
+# ---------- Server-process side ----------
+
+def _ensure_pools():
+    with _POOLS_LOCK:
+        if _POOLS["process"] is None:
+            # spawn, not fork: the server process may already hold torch/FAISS threads.
+            ctx = multiprocessing.get_context("spawn")
+            progress_queue = ctx.Queue()
+            _POOLS["progress_queue"] = progress_queue
+            _POOLS["process"] = ProcessPoolExecutor(
+                max_workers=INGEST_WORKERS,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(progress_queue,),
+            )
+            if _POOLS["index"] is None:
+                _POOLS["index"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-index")
+            _POOLS["progress_thread"] = threading.Thread(
+                target=_drain_progress, args=(progress_queue,), name="ingest-progress", daemon=True
+            )
+            _POOLS["progress_thread"].start()
+    return _POOLS["process"], _POOLS["index"]
+
+
+def _replace_broken_pool(broken):
+    """Drops a process pool broken by a dead worker; the next _ensure_pools builds a new one."""
+    with _POOLS_LOCK:
+        if _POOLS["process"] is not broken:
+            return  # already replaced
+        broken.shutdown(wait=False, cancel_futures=True)
+        _POOLS["progress_queue"].put(None)
+        _POOLS.update(process=None, progress_queue=None, progress_thread=None)
+    print("--- INGEST: A worker process died; replacing the process pool. ---")
+
+
+def _drain_progress(progress_queue):
+    while True:
+        event = progress_queue.get()
+        if event is None:
+            return
+        _update_stage(*event)
+
+
+def _update_stage(job_id: str, stage: str, status: str, seconds=None):
+    with _JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if job is None:
+            return
+        job["stages"][stage] = {"status": status, "seconds": seconds}
+        if status == "running" and job["status"] not in ("done", "failed"):
+            job["status"] = "running"
+            job["current_stage"] = stage
+
+
+def _finish(job_id: str, status: str, result=None, error=None):
+    with _JOBS_LOCK:
+        job = JOBS[job_id]
+        job["status"] = status
+        job["current_stage"] = None
+        job["result"] = result
+        job["error"] = error
+        job["finished_at"] = datetime.datetime.now().isoformat()
+        job["total_seconds"] = round(time.monotonic() - job["_started"], 4)
+        job["_finished"] = time.monotonic()
+
+
+def _evict_finished_jobs():
+    """Drops finished jobs past JOB_TTL_SECONDS, then the oldest beyond MAX_FINISHED_JOBS. Caller holds _JOBS_LOCK."""
+    now = time.monotonic()
+    finished = sorted((job["_finished"], job_id) for job_id, job in JOBS.items() if "_finished" in job)
+    excess = len(finished) - MAX_FINISHED_JOBS
+    for i, (finished_at, job_id) in enumerate(finished):
+        if i < excess or now - finished_at > JOB_TTL_SECONDS:
+            del JOBS[job_id]
+
+
+def _on_prepared(job_id: str, process_pool, future):
+    """Called when the worker process is done; hands the result to the indexing thread."""
+    try:
+        prepared = future.result()
+    except BrokenProcessPool as e:
+        # Every job on the pool fails this way, not just the one whose worker died.
+        _replace_broken_pool(process_pool)
+        with _JOBS_LOCK:
+            retry = JOBS[job_id]["_attempts"] < INGEST_MAX_ATTEMPTS
+        if retry:
+            try:
+                _submit_prepare(job_id)
+                return
+            except Exception as retry_error:
+                e = retry_error
+        _finish(job_id, "failed", error=f"Worker process died while preparing the job ({type(e).__name__}: {e})")
+        return
+    except Exception as e:
+        _finish(job_id, "failed", error=f"{type(e).__name__}: {e}")
+        return
+
+    if not prepared["docs"]:
+        _finish(job_id, "failed", error="No text found in the uploaded PDF(s).")
+        return
+
+    _, index_pool = _ensure_pools()
+    index_pool.submit(_index_prepared, job_id, prepared)
+
+
+def _index_prepared(job_id: str, prepared: dict):
+    from agents.pdf_agent import index_documents
+
+    try:
+        result = index_documents(
+            prepared["docs"], prepared["embeddings"],
+            lambda stage, status, seconds=None: _update_stage(job_id, stage, status, seconds),
+        )
+        result["embedding_cache"] = prepared["embedding_cache"]
+        _finish(job_id, "done", result=result)
+    except Exception as e:
+        _finish(job_id, "failed", error=f"{type(e).__name__}: {e}")
+
+
+def submit_ingest_job(file_paths: list):
+    """Enqueues ingestion of one or more files (one shared embedding batch). Returns the job ID."""
+    job_id = uuid.uuid4().hex
+    with _JOBS_LOCK:
+        _evict_finished_jobs()
+        JOBS[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "current_stage": None,
+            "files": [os.path.basename(p) for p in file_paths],
+            "created_at": datetime.datetime.now().isoformat(),
+            "finished_at": None,
+            "total_seconds": None,
+            "stages": {stage: {"status": "pending", "seconds": None} for stage in JOB_STAGES},
+            "result": None,
+            "error": None,
+            "_started": time.monotonic(),
+            "_file_paths": list(file_paths),
+            "_attempts": 0,
+        }
+
+    try:
+        _submit_prepare(job_id)
+    except Exception as e:
+        _finish(job_id, "failed", error=f"{type(e).__name__}: {e}")
+    return job_id
+
+
+def _submit_prepare(job_id: str):
+    """Sends the job to the worker processes, replacing the pool first if it is broken."""
+    with _JOBS_LOCK:
+        job = JOBS[job_id]
+        job["_attempts"] += 1
+        file_paths = job["_file_paths"]
+
+    process_pool, _ = _ensure_pools()
+    try:
+        future = process_pool.submit(_prepare_in_worker, job_id, file_paths)
+    except BrokenProcessPool:
+        _replace_broken_pool(process_pool)
+        process_pool, _ = _ensure_pools()
+        future = process_pool.submit(_prepare_in_worker, job_id, file_paths)
+    future.add_done_callback(lambda f: _on_prepared(job_id, process_pool, f))
+
+
+def get_job(job_id: str):
+    """Returns a snapshot of the job's status, or None if the ID is unknown (or evicted)."""
+    with _JOBS_LOCK:
+        _evict_finished_jobs()
+        job = JOBS.get(job_id)
+        if job is None:
+            return None
+        snapshot = {k: v for k, v in job.items() if not k.startswith("_")}
+        snapshot["stages"] = {stage: dict(info) for stage, info in job["stages"].items()}
+        return snapshot
+
+
+def shutdown():
+    """Stops the worker pools (called on application shutdown)."""
+    with _POOLS_LOCK:
+        if _POOLS["process"] is not None:
+            _POOLS["process"].shutdown(wait=False, cancel_futures=True)
+            _POOLS["progress_queue"].put(None)
+        if _POOLS["index"] is not None:
+            _POOLS["index"].shutdown(wait=False)
+        _POOLS.update(process=None, index=None, progress_queue=None, progress_thread=None)
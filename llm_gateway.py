@@ -0,0 +1,365 @@
+import os, json, time, random, asyncio, hashlib, threading
+import urllib.request, urllib.error
+
+from agents.base import run_blocking
+from agents.context_packer import estimate_tokens
+import metrics
+
+# Gateway for every LLM call (routing, agent summaries, synthesis).
+#
+#   - rate limiting: token buckets for requests and tokens per minute (LLM_RPM,
+#     LLM_TPM), filled for LLM_BURST_SECONDS of traffic. Calls wait their turn
+#     in FIFO order; a call that would wait more than LLM_MAX_QUEUE_SECONDS
+#     fails at once with LLMRateLimited instead of piling up.
+#   - retries: 429/5xx/deadline errors are retried up to LLM_MAX_RETRIES times
+#     with exponential backoff and full jitter. A stream is only retried before
+#     its first fragment.
+#   - single-flight: identical prompts (and stream mode) in flight at once share one
+#     upstream call; followers replay its (streamed) output.
+#   - pluggable backend: Gemini by default; LLM_BACKEND=http sends the calls to
+#     LLM_BACKEND_URL instead (see benchmarks/fake_llm_server.py), and
+#     set_backend() swaps in anything with async generate()/stream().
+#
+# Each call can pass an `info` dict, which is filled with its queueing delay,
+# retries and whether it was coalesced; callers put it in the trace under "llm".
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_BACKEND_URL = os.getenv("LLM_BACKEND_URL", "http://127.0.0.1:8100")
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+
+LLM_RPM = float(os.getenv("LLM_RPM", "600"))          # 0 = unlimited
+LLM_TPM = float(os.getenv("LLM_TPM", "1000000"))      # 0 = unlimited
+LLM_BURST_SECONDS = float(os.getenv("LLM_BURST_SECONDS", "10"))
+LLM_MAX_QUEUE_SECONDS = float(os.getenv("LLM_MAX_QUEUE_SECONDS", "20"))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "512"))
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1"
+
+# google.api_core exception names (matched by name so the SDK isn't imported here) and HTTP codes
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "TimeoutError"}
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMRateLimited(Exception):
+    """The call would have waited longer than LLM_MAX_QUEUE_SECONDS for rate-limit capacity."""
+
+
+class LLMBackendError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(f"HTTP {code}: {message}")
+        self.code = code
+
+
+def _retryable(error: Exception):
+    return type(error).__name__ in RETRYABLE_ERRORS or getattr(error, "code", None) in RETRYABLE_CODES
+
+
+# ---------- Backends ----------
+
+class GeminiBackend:
+    name = "gemini"
+
+    async def generate(self, contents):
+        from rag_state import get_synthesis_model
+
+        response = await get_synthesis_model().generate_content_async(contents)
+        return response.text
+
+    async def stream(self, contents):
+        from rag_state import get_synthesis_model
+
+        response = await get_synthesis_model().generate_content_async(contents, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class HTTPBackend:
+    """POST {"contents", "stream"} to <url>/generate; JSON {"text"} back, or NDJSON lines of {"text"} when streaming."""
+
+    name = "http"
+
+    def __init__(self, url: str = LLM_BACKEND_URL):
+        self.url = url.rstrip("/")
+
+    def _post(self, contents, stream: bool):
+        request = urllib.request.Request(
+            self.url + "/generate",
+            data=json.dumps({"contents": contents, "stream": stream}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=LLM_HTTP_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            raise LLMBackendError(e.code, e.read().decode("utf-8", "replace")[:200]) from None
+
+    async def generate(self, contents):
+        def call():
+            with self._post(contents, False) as response:
+                return json.loads(response.read())["text"]
+        return await run_blocking(call)
+
+    async def stream(self, contents):
+        response = await run_blocking(self._post, contents, True)
+        try:
+            while True:
+                line = await run_blocking(response.readline)
+                if not line:
+                    break
+                text = json.loads(line).get("text")
+                if text:
+                    yield text
+        finally:
+            response.close()
+
+
+_BACKEND = None
+
+
+def get_backend():
+    global _BACKEND
+    if _BACKEND is None:
+        _BACKEND = HTTPBackend() if LLM_BACKEND == "http" else GeminiBackend()
+    return _BACKEND
+
+
+def set_backend(backend):
+    """Replaces the backend (tests, benchmarks). Returns the previous one."""
+    global _BACKEND
+    previous, _BACKEND = _BACKEND, backend
+    return previous
+
+
+# ---------- Rate limiting ----------
+
+class TokenBucket:
+    """`per_minute` units refilled continuously, holding at most `burst_seconds` worth. 0 = unlimited."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float):
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        # A request larger than the bucket only has to wait for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, amount: float, now: float):
+        if self.rate > 0:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Request and token buckets behind one FIFO lock (bound to the running event loop)."""
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM):
+        self.rpm, self.tpm = rpm, tpm
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = None
+        self._loop = None
+
+    def _loop_lock(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock, self._loop = asyncio.Lock(), loop
+        return self._lock
+
+    async def acquire(self, tokens: int, max_wait: float = None):
+        """Waits for capacity for one request of `tokens` tokens. Returns seconds waited."""
+        max_wait = LLM_MAX_QUEUE_SECONDS if max_wait is None else max_wait
+        start = time.monotonic()
+        async with self._loop_lock():
+            while True:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    self.requests.take(1, now)
+                    self.tokens.take(tokens, now)
+                    return now - start
+                if now - start + wait > max_wait:
+                    raise LLMRateLimited(f"LLM rate limit: would wait {now - start + wait:.1f}s (max {max_wait:.0f}s)")
+                await asyncio.sleep(wait)
+
+    def stats(self):
+        now = time.monotonic()
+        self.requests._refill(now)
+        self.tokens._refill(now)
+        return {"rpm": self.rpm, "tpm": self.tpm, "requests_available": round(self.requests.level, 1),
+                "tokens_available": round(self.tokens.level)}
+
+
+LIMITER = RateLimiter()
+
+
+# ---------- Single-flight ----------
+
+class _Flight:
+    """One upstream call whose output fragments are replayed to every caller that joined it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.callers = 1
+        self.info = {"queue_ms": 0.0, "retries": 0, "backoff_ms": 0.0, "upstream_calls": 0, "errors": []}
+        self._changed = asyncio.Event()
+
+    def push(self, text: str):
+        self.chunks.append(text)
+        self._wake()
+
+    def finish(self, error: BaseException = None):
+        self.done, self.error = True, error
+        self._wake()
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+_FLIGHTS = {}
+_TASKS = set()  # strong references: the loop only keeps weak ones to running tasks
+_STATS_LOCK = threading.Lock()
+_STATS = {"calls": 0, "coalesced": 0, "upstream_calls": 0, "retries": 0, "rate_limited": 0, "errors": 0,
+          "queue_ms_total": 0.0, "queue_ms_max": 0.0}
+
+
+def _count(**deltas):
+    with _STATS_LOCK:
+        for name, value in deltas.items():
+            if name == "queue_ms_max":
+                _STATS[name] = max(_STATS[name], value)
+            else:
+                _STATS[name] += value
+
+
+async def _run_flight(key, flight: _Flight, backend, contents, stream: bool, tokens: int):
+    try:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                waited = await LIMITER.acquire(tokens)
+            except LLMRateLimited:
+                _count(rate_limited=1)
+                raise
+            flight.info["queue_ms"] += 1000 * waited
+            flight.info["upstream_calls"] += 1
+            _count(upstream_calls=1, queue_ms_total=1000 * waited, queue_ms_max=1000 * waited)
+            try:
+                if stream:
+                    async for text in backend.stream(contents):
+                        flight.push(text)
+                else:
+                    flight.push(await backend.generate(contents))
+                break
+            except Exception as e:
+                flight.info["errors"].append(f"{type(e).__name__}: {e}"[:200])
+                if flight.chunks or not _retryable(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                flight.info["retries"] += 1
+                flight.info["backoff_ms"] += 1000 * delay
+                _count(retries=1)
+                await asyncio.sleep(delay)
+        flight.finish()
+    except BaseException as e:
+        _count(errors=1)
+        flight.finish(e)
+        if not isinstance(e, Exception):
+            raise
+    finally:
+        if _FLIGHTS.get(key) is flight:
+            del _FLIGHTS[key]
+
+
+async def _call(contents, caller: str, stream: bool, info: dict):
+    start = time.perf_counter()
+    backend = get_backend()
+    prompt = json.dumps(contents, default=str)
+    key = hashlib.sha256(f"{backend.name}\0{int(stream)}\0{prompt}".encode("utf-8")).hexdigest()
+    flight = _FLIGHTS.get(key) if LLM_COALESCE else None
+    coalesced = flight is not None
+    if coalesced:
+        flight.callers += 1
+    else:
+        flight = _Flight()
+        _FLIGHTS[key] = flight
+        tokens = estimate_tokens(prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+        # A task of its own, so followers still get the answer if the first caller goes away
+        task = asyncio.ensure_future(_run_flight(key, flight, backend, contents, stream, tokens))
+        _TASKS.add(task)
+        task.add_done_callback(_TASKS.discard)
+    _count(calls=1, coalesced=int(coalesced))
+
+    prompt_chars = len(contents) if isinstance(contents, str) else sum(len(str(part)) for part in contents)
+    response_chars = 0
+    try:
+        async for text in flight.follow():
+            response_chars += len(text)
+            yield text
+    finally:
+        caller_label = caller or "other"
+        metrics.LLM_PROMPT_CHARS.observe(prompt_chars, caller=caller_label)
+        metrics.LLM_RESPONSE_CHARS.observe(response_chars, caller=caller_label)
+        metrics.record(f"llm.{caller_label}", time.perf_counter() - start, prompt_chars=prompt_chars,
+                       response_chars=response_chars, coalesced=coalesced, retries=flight.info["retries"],
+                       queue_ms=round(flight.info["queue_ms"], 1))
+        if info is not None:
+            info.update(
+                caller=caller,
+                backend=backend.name,
+                coalesced=coalesced,
+                queue_ms=round(flight.info["queue_ms"], 1),
+                retries=flight.info["retries"],
+                backoff_ms=round(flight.info["backoff_ms"], 1),
+                upstream_calls=flight.info["upstream_calls"],
+                seconds=round(time.perf_counter() - start, 3),
+            )
+            if flight.info["errors"]:
+                info["errors"] = list(flight.info["errors"])
+
+
+async def generate(contents, caller: str = "", info: dict = None):
+    """Returns the model's text for `contents` (a prompt string or list of parts)."""
+    return "".join([text async for text in _call(contents, caller, False, info)])
+
+
+async def generate_stream(contents, caller: str = "", info: dict = None):
+    """Yields the model's text fragments for `contents` as they arrive."""
+    async for text in _call(contents, caller, True, info):
+        yield text
+
+
+def stats():
+    with _STATS_LOCK:
+        counters = dict(_STATS)
+    counters["queue_ms_total"] = round(counters["queue_ms_total"], 1)
+    counters["queue_ms_max"] = round(counters["queue_ms_max"], 1)
+    return {"backend": get_backend().name, **counters, "in_flight": len(_FLIGHTS), "limiter": LIMITER.stats()}
@@ -1,16 +1,39 @@
-from fastapi import FastAPI, UploadFile, File
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware 
 import agents.controller as controller
+import ingest_queue
 import uvicorn
-import json, os 
+import json, os, asyncio, datetime, time, shutil, tempfile
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse
+import warmup
+import metrics
 
 load_dotenv()
 api_key = os.getenv("GOOGLE_API_KEY")
 
-app = FastAPI(title = "multi-agent-system")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Preload models, index and chunk store so the first query doesn't pay for them (see warmup.py)
+    warmup_task = None
+    if warmup.STARTUP_WARMUP == "blocking":
+        await warmup.warm_up()
+    elif warmup.STARTUP_WARMUP == "background":
+        warmup_task = asyncio.create_task(warmup.warm_up())
+
+    yield
+
+    from trace_store import TRACE_STORE
+
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    ingest_queue.shutdown()
+    TRACE_STORE.close()
+
+app = FastAPI(title = "multi-agent-system", lifespan = lifespan)
 
 #Enable CORS for frontend
 app.add_middleware(
@@ -21,6 +44,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # Labeled with the route template (/jobs/{job_id}), not the raw path, to keep the series count bounded
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or ("/frontend" if request.url.path.startswith("/frontend") else "other")
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method, path=path, status=status)
+
 # --- START Frontend Static Files Configuration ---
 
 # 1. Mount the 'frontend' directory to serve CSS, JS, etc. 
@@ -36,42 +73,219 @@ async def serve_frontend():
 
 # --- END Frontend Static Files Configuration ---
 
+@app.get("/healthz/ready")
+async def healthz_ready():
+    """200 once the startup warm-up has loaded every component, 503 (with per-component status) until then."""
+    ready, report = warmup.readiness()
+    return JSONResponse(report, status_code = 200 if ready else 503)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage, agent, HTTP and LLM latency histograms, cache hit counters and model load times (Prometheus text format)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _check_profile(profile: bool):
+    if profile and not metrics.PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled (set PROFILING_ENABLED=1)")
+
 @app.post("/ask")
-async def ask(query: str):
-    response, logs = await controller.route_query(query)
+async def ask(query: str, profile: bool = False):
+    _check_profile(profile)
+    response, logs = await controller.route_query(query, profile)
 
     return {"query": query, "response": response, "logs": logs}
 
+@app.post("/ask/stream")
+async def ask_stream(query: str, profile: bool = False):
+    """Same pipeline as /ask, streamed as NDJSON events (routing, agent progress, answer tokens, final)."""
+    _check_profile(profile)
+
+    async def events():
+        async for event in controller.route_query_events(query, profile):
+            yield json.dumps(event, default=str) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+# Upper bound on index records examined per /logs page (selective filters return
+# early with a next_cursor instead of scanning the whole log).
+LOGS_MAX_SCAN = 50000
+LOGS_PAGE_SIZE = 100  # when only a cursor is given
+
+UPLOAD_DIR = "pdfs"
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def _write_upload(src, file_path: str):
+    """
+    Copies an upload in fixed-size chunks to a temp file and renames it into place, so
+    an ingest job still reading an earlier upload of the same name never sees it truncated.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir = UPLOAD_DIR, prefix = ".upload-", suffix = ".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(src, f, UPLOAD_CHUNK_BYTES)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+async def _save_upload(file: UploadFile):
+    """Streams an upload to disk off the event loop instead of reading it into memory."""
+    os.makedirs(UPLOAD_DIR, exist_ok = True)
+    file_path = f"{UPLOAD_DIR}/{os.path.basename(file.filename)}"
+    try:
+        await asyncio.to_thread(_write_upload, file.file, file_path)
+    finally:
+        await file.close()
+    return file_path
+
 @app.post("/upload_pdf")
 async def upload_pdf(file: UploadFile = File(...)):
-    os.makedirs("pdfs", exist_ok = True)
-    file_path = f"pdfs/{file.filename}"
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-    
-    # Import the single, correct ingestion function
-    from agents.pdf_agent import ingest_pdf 
+    file_path = await _save_upload(file)
+    job_id = ingest_queue.submit_ingest_job([file_path])
+
+    return {"filename": file.filename, "job_id": job_id, "status": "PDF queued for indexing"}
+
+@app.post("/upload_pdfs")
+async def upload_pdfs(files: List[UploadFile] = File(...)):
+    # All files of one request share a job and a single embedding batch.
+    file_paths = [await _save_upload(file) for file in files]
+    job_id = ingest_queue.submit_ingest_job(file_paths)
 
-    ingest_pdf(file_path)
+    return {"filenames": [f.filename for f in files], "job_id": job_id, "status": "PDFs queued for indexing"}
 
-    return {"filename": file.filename, "status": "PDF processed and indexed"}
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingest_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+@app.delete("/pdfs/{source}")
+async def delete_pdf(source: str):
+    from agents.pdf_agent import delete_source
+
+    removed = await asyncio.to_thread(delete_source, source)
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"No indexed document named {source}")
+    return {"filename": source, "chunks_removed": removed, "status": "PDF removed from index"}
+
+@app.get("/pdfs/{source}/chunks")
+async def pdf_chunks(source: str, page: Optional[int] = None):
+    from chunk_store import open_chunk_store
+
+    rows = await asyncio.to_thread(open_chunk_store().by_source, source, page)
+    if not rows:
+        raise HTTPException(status_code=404, detail=f"No indexed chunks for {source}" + (f" page {page}" if page is not None else ""))
+    return {"filename": source, "page": page, "chunks": [{"id": i, "text": text, **meta} for i, text, meta in rows]}
     
-@app.get("/logs")
-async def get_logs():
-    log_path = "logs/trace.json"
+@app.get("/index/status")
+async def index_status():
+    from rag_state import get_index_handle
+    from vector_index import index_metadata
+
+    # A cold or reloading index can take a while to open; keep it off the event loop.
+    handle = await asyncio.to_thread(get_index_handle)
+    chunks = await asyncio.to_thread(handle.chunk_store.stats) if handle.chunk_store is not None else {}
+    return {
+        "generation": handle.generation,
+        "loaded_at": handle.loaded_at,
+        "load_seconds": handle.load_seconds,
+        "vectors": handle.index.ntotal if handle.index is not None else 0,
+        "documents": chunks.get("documents", 0),
+        "chunk_store": chunks,
+        "index": index_metadata(handle.index) if handle.index is not None else None,
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    from agents.pdf_agent import cache_stats
+    from response_cache import RESPONSE_CACHE
+    import fetch_layer
+
+    return {**cache_stats(), "responses": RESPONSE_CACHE.stats(), "search_results": fetch_layer.stats()}
+
+@app.get("/agents")
+async def agents_status():
+    """Per-agent limits, in-flight/queued/rejected counts and circuit breaker state."""
+    from agents.registry import agent_stats
+
+    return agent_stats()
 
-    #Ensure logs file exists
+@app.get("/llm/stats")
+async def llm_stats():
+    """LLM gateway counters: calls, coalesced calls, upstream requests, retries, rate-limit queueing."""
+    import llm_gateway
 
-    if not os.path.exists(log_path):
-        return {"logs": []}
+    return llm_gateway.stats()
 
+@app.get("/router/stats")
+async def router_stats():
+    from agents.router import ROUTER
+
+    return ROUTER.stats()
+
+def _project(entry: dict, fields, exclude):
+    if fields:
+        entry = {k: entry[k] for k in fields if k in entry}
+    for k in exclude:
+        entry.pop(k, None)
+    return entry
+
+def _to_epoch(value: Optional[str]):
+    if not value:
+        return None
     try:
-        with open(log_path, "r") as f:
-            data = json.load(f)
-    except json.JSONDecodeError:
-        data = []
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid time '{value}': expected ISO datetime or unix seconds")
+
+@app.get("/logs")
+async def get_logs(
+    cursor: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    since: Optional[str] = None,    # ISO datetime or unix seconds
+    until: Optional[str] = None,
+    agent: Optional[str] = None,
+    q: Optional[str] = None,        # case-insensitive substring of the query
+    fields: Optional[str] = None,   # comma-separated fields to keep
+    exclude: Optional[str] = None,  # comma-separated fields to drop, e.g. retrieved_docs
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    from trace_store import TRACE_STORE
+
+    keep = [f for f in fields.split(",") if f] if fields else None
+    drop = [f for f in exclude.split(",") if f] if exclude else []
+    filters = dict(cursor=cursor, order=order, since=_to_epoch(since), until=_to_epoch(until), agent=agent, contains=q)
+
+    if format == "ndjson":
+        # Streams every match; memory stays flat however large the log is.
+        def stream():
+            for seq, entry in TRACE_STORE.query(**filters):
+                if entry is not None:
+                    yield json.dumps({"seq": seq, **_project(entry, keep, drop)}, default=str) + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    if limit is None and cursor is None:
+        # Unpaged: every match, in the original {"logs": [...]} shape.
+        def everything():
+            return {"logs": [_project(entry, keep, drop) for _, entry in TRACE_STORE.query(**filters)]}
+        return await asyncio.to_thread(everything)
+
+    def page():
+        logs, next_cursor = [], None
+        for seq, entry in TRACE_STORE.query(**filters, limit=limit or LOGS_PAGE_SIZE, max_scan=LOGS_MAX_SCAN):
+            if entry is None:
+                next_cursor = seq
+            else:
+                logs.append({"seq": seq, **_project(entry, keep, drop)})
+        return {"logs": logs, "next_cursor": next_cursor}
 
-    return {"logs": data}
+    return await asyncio.to_thread(page)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host = "0.0.0.0", port = 8000, reload = True)
\ No newline at end of file
@@ -0,0 +1,275 @@
+import os, sys, time, threading, datetime
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Per-stage latency instrumentation.
+#
+# Code wraps each stage in `with metrics.span("stage"):` (or calls
+# metrics.record() for stages that cross a `yield`). Every span is
+#   - observed in the rag_stage_seconds histogram, exported at /metrics in the
+#     Prometheus text format, and
+#   - appended to the current request's trace (a contextvar set by
+#     start_trace()), which the controller stores in the trace entry under "spans".
+# Agent tasks inherit the request's context when they are created, and
+# run_blocking() runs its callable inside a copy of it, so spans recorded in
+# worker threads (FAISS search, encoding, DuckDuckGo, arXiv) land in the right
+# trace. Outside a request (warm-up, ingestion) spans only feed the histograms.
+#
+# A sampling profiler can be switched on for single requests
+# (PROFILING_ENABLED=1 and ?profile=true); see SamplingProfiler.
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "logs/profiles")
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CHARS_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+# ---------- Prometheus metric types ----------
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _label_str(names, values, le=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += [line for key, value in items for line in self._sample_lines(key, value)]
+        return lines
+
+    def _sample_lines(self, key, value):
+        return [f"{self.name}{_label_str(self.labels, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # per-bucket counts, sum, count
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _sample_lines(self, key, series):
+        counts, total, count = series
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{_label_str(self.labels, key, f'{bound:g}')} {cumulative}")
+        lines.append(f"{self.name}_bucket{_label_str(self.labels, key, '+Inf')} {count}")
+        lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {round(total, 6)}")
+        lines.append(f"{self.name}_count{_label_str(self.labels, key)} {count}")
+        return lines
+
+
+_REGISTRY = []
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duration of pipeline stages (spans).", ["stage"])
+AGENT_SECONDS = Histogram("rag_agent_seconds", "Duration of agent calls by outcome.", ["agent", "status"])
+HTTP_SECONDS = Histogram("rag_http_request_seconds", "HTTP request duration.", ["method", "path", "status"])
+LLM_PROMPT_CHARS = Histogram("rag_llm_prompt_chars", "Size of LLM prompts in characters.", ["caller"], CHARS_BUCKETS)
+LLM_RESPONSE_CHARS = Histogram("rag_llm_response_chars", "Size of LLM responses in characters.", ["caller"], CHARS_BUCKETS)
+CACHE_EVENTS = Counter("rag_cache_events_total", "Cache lookups by cache and outcome.", ["cache", "outcome"])
+MODEL_LOAD_SECONDS = Gauge("rag_model_load_seconds", "Time the last load of each model or index took.", ["component"])
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in _REGISTRY for line in metric.render()) + "\n"
+
+
+# ---------- Spans ----------
+
+class _Trace:
+    __slots__ = ("start", "spans")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+
+_TRACE = ContextVar("rag_trace", default=None)
+_PARENT = ContextVar("rag_span_parent", default=None)
+
+
+def start_trace():
+    """Starts collecting the spans of the current request (its task and everything it spawns)."""
+    trace = _Trace()
+    _TRACE.set(trace)
+    return trace
+
+
+def record(stage: str, seconds: float, **attrs):
+    """Records a finished stage that took `seconds`."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _TRACE.get()
+    if trace is not None:
+        end_ms = (time.perf_counter() - trace.start) * 1000
+        trace.spans.append({"stage": stage, "parent": _PARENT.get(), "start_ms": round(end_ms - seconds * 1000, 2),
+                            "ms": round(seconds * 1000, 2), **attrs})
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Times the block as `stage`. Yields a dict for attributes only known at the end (sizes, cache hits)."""
+    start = time.perf_counter()
+    token = _PARENT.set(stage)
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        _PARENT.reset(token)
+        record(stage, time.perf_counter() - start, **attrs)
+
+
+def spans(trace: _Trace):
+    """The trace's spans ordered by start time (a copy, safe to store)."""
+    return sorted(trace.spans, key=lambda s: s["start_ms"])
+
+
+def cache_event(cache: str, hit: bool, count: int = 1):
+    if count:
+        CACHE_EVENTS.inc(count, cache=cache, outcome="hit" if hit else "miss")
+
+
+def model_loaded(component: str, seconds: float):
+    """Records a model/index load: a load.<component> span plus the rag_model_load_seconds gauge."""
+    MODEL_LOAD_SECONDS.set(round(seconds, 4), component=component)
+    record(f"load.{component}", seconds)
+
+
+# ---------- Sampling profiler ----------
+
+# Leaf frames of threads that are just waiting (event loop idle, idle pool workers)
+_IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("thread.py", "_worker"),
+                ("queue.py", "get"), ("socketserver.py", "serve_forever")}
+_PROFILE_LOCK = threading.Lock()
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread every `interval_ms` while running.
+    It sees the whole process, so requests running at the same time show up too;
+    only one profile runs at a time. stop() returns a summary with the hottest
+    functions and stacks, and writes all stacks in the collapsed format used by
+    flamegraph.pl and speedscope to PROFILE_DIR.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+
+    def start(self):
+        """Returns False (and does nothing) if another profile is running."""
+        if not _PROFILE_LOCK.acquire(blocking=False):
+            return False
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                if not stack or stack[0][:2] in _IDLE_FRAMES:
+                    continue
+                key = ";".join(f"{name} ({file}:{line})" for file, name, line in reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self, label: str = "request", top: int = 15):
+        """Stops sampling and returns the summary (None if it was already stopped)."""
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        _PROFILE_LOCK.release()
+
+        leaf = {}
+        for stack, n in self.stacks.items():
+            name = stack.rsplit(";", 1)[-1].rsplit(":", 1)[0] + ")"  # leaf function, any line
+            leaf[name] = leaf.get(name, 0) + n
+        busy = sum(self.stacks.values())
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S-%f}-{label}.folded")
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {n}\n" for stack, n in self.stacks.items())
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "seconds": round(time.perf_counter() - self._start, 3),
+            "samples": self.samples,
+            "busy_samples": busy,
+            "top_functions": [{"function": name, "samples": n, "share": round(n / busy, 3)}
+                              for name, n in sorted(leaf.items(), key=lambda kv: -kv[1])[:top]],
+            "top_stacks": [{"stack": stack, "samples": n}
+                           for stack, n in sorted(self.stacks.items(), key=lambda kv: -kv[1])[:5]],
+            "folded_file": path,
+        }
@@ -1,55 +1,174 @@
-import os, pickle
+import os, threading, time, datetime
+from collections import namedtuple
 from dotenv import load_dotenv
-import google.generativeai as genai
-from sentence_transformers import SentenceTransformer
-import faiss
+
+from chunk_store import open_chunk_store
+import metrics
+
+# The Gemini SDK, sentence_transformers (torch) and FAISS are imported inside the
+# loaders below, so importing this module (and everything that imports it) stays cheap.
 
 # Load environment variables once
 load_dotenv()
 
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+RERANK_MODEL_NAME = os.getenv("PDF_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
 # --- Global State Dictionary ---
 RAG_STATE = {
     "embedding_model": None,
     "synthesis_model": None,
-    "faiss_index": None,
-    "data_store": None
+    "rerank_model": None,
+    "index_handle": None
 }
 
+# --- Versioned FAISS Index Handle ---
+# An IndexGeneration is immutable once published: readers grab the current handle
+# once per query and keep using it, while ingestion builds a modified copy and
+# publishes it as the next generation. Swapping the RAG_STATE reference is atomic,
+# so in-flight searches finish on the old generation and new ones see the new one.
+IndexGeneration = namedtuple(
+    "IndexGeneration",
+    ["generation", "index", "chunk_store", "loaded_at", "load_seconds", "source_mtime"],
+)
+
+_INDEX_LOCK = threading.Lock()
+
+# One lock per model: loaders run on pool and warm-up threads, and two threads
+# must not both load the same model (double the memory and the startup time).
+_MODEL_LOCKS = {name: threading.Lock() for name in ("embedding_model", "synthesis_model", "rerank_model")}
+
+# How often (seconds) a reader may stat the index file to pick up a generation
+# written by another worker process. Never reloads unless the file changed.
+INDEX_RELOAD_CHECK_SECONDS = float(os.getenv("INDEX_RELOAD_CHECK_SECONDS", "2"))
+_last_reload_check = 0.0
+
 # --- Lazy Loaders ---
 
 def get_synthesis_model():
     """Initializes and returns the Gemini Synthesis Model only once."""
     if RAG_STATE["synthesis_model"] is None:
-        print("--- RAG_STATE: Initializing Gemini Synthesis Model... ---")
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        RAG_STATE["synthesis_model"] = genai.GenerativeModel("gemini-2.5-flash")
-        print("--- RAG_STATE: Gemini Model loaded. ---")
+        with _MODEL_LOCKS["synthesis_model"]:
+            if RAG_STATE["synthesis_model"] is None:
+                print("--- RAG_STATE: Initializing Gemini Synthesis Model... ---")
+                start = time.perf_counter()
+                import google.generativeai as genai
+
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                RAG_STATE["synthesis_model"] = genai.GenerativeModel("gemini-2.5-flash")
+                metrics.model_loaded("synthesis_model", time.perf_counter() - start)
+                print("--- RAG_STATE: Gemini Model loaded. ---")
     return RAG_STATE["synthesis_model"]
 
 def get_embedding_model():
     """Initializes and returns the Sentence Transformer Model only once."""
     if RAG_STATE["embedding_model"] is None:
-        print("--- RAG_STATE: Initializing heavy SentenceTransformer model... ---")
-        RAG_STATE["embedding_model"] = SentenceTransformer('all-MiniLM-L6-v2')
-        print("--- RAG_STATE: Embedding Model loaded. ---")
+        with _MODEL_LOCKS["embedding_model"]:
+            if RAG_STATE["embedding_model"] is None:
+                print("--- RAG_STATE: Initializing heavy SentenceTransformer model... ---")
+                start = time.perf_counter()
+                from sentence_transformers import SentenceTransformer
+
+                RAG_STATE["embedding_model"] = SentenceTransformer(EMBEDDING_MODEL_NAME)
+                metrics.model_loaded("embedding_model", time.perf_counter() - start)
+                print("--- RAG_STATE: Embedding Model loaded. ---")
     return RAG_STATE["embedding_model"]
 
+def get_rerank_model():
+    """Initializes and returns the cross-encoder used by the optional rerank stage only once."""
+    if RAG_STATE["rerank_model"] is None:
+        with _MODEL_LOCKS["rerank_model"]:
+            if RAG_STATE["rerank_model"] is None:
+                print("--- RAG_STATE: Initializing cross-encoder rerank model... ---")
+                start = time.perf_counter()
+                from sentence_transformers import CrossEncoder
+
+                RAG_STATE["rerank_model"] = CrossEncoder(RERANK_MODEL_NAME, device="cpu")
+                metrics.model_loaded("rerank_model", time.perf_counter() - start)
+                print("--- RAG_STATE: Rerank Model loaded. ---")
+    return RAG_STATE["rerank_model"]
+
+def _index_mtime(db_path):
+    try:
+        return os.stat(f"{db_path}/index.faiss").st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _read_index_files(db_path):
+    """Opens the index and chunk store. Returns (index, chunk_store), or (None, None)."""
+    index_file = f"{db_path}/index.faiss"
+
+    if not os.path.exists(index_file):
+        print("--- RAG_STATE: FAISS files not found. They will be loaded/created upon PDF upload/query. ---")
+        return None, None
+
+    print("--- RAG_STATE: Loading FAISS Index and Chunk Store... ---")
+    try:
+        from vector_index import read_index
+
+        # Memory-mapped when PDF_INDEX_MMAP=1; nprobe/efSearch come from the environment
+        index = read_index(index_file)
+        # Chunk text stays on disk; queries read only the rows they retrieve
+        chunk_store = open_chunk_store(db_path)
+        print("--- RAG_STATE: FAISS and Chunk Store loaded successfully. ---")
+        return index, chunk_store
+    except Exception as e:
+        print(f"--- RAG_STATE ERROR: Failed to load FAISS/Chunk Store: {e} ---")
+        return None, None
+
+
+def _make_generation(previous, index, chunk_store, load_seconds, source_mtime):
+    return IndexGeneration(
+        generation=(previous.generation + 1) if previous is not None else 1,
+        index=index,
+        chunk_store=chunk_store,
+        loaded_at=datetime.datetime.now().isoformat(),
+        load_seconds=round(load_seconds, 4),
+        source_mtime=source_mtime,
+    )
+
+
+def get_index_handle(db_path="pdf_store", force_check=False):
+    """
+    Returns the current IndexGeneration, loading it from disk only on first use
+    or when another process has written a newer index file. `force_check` skips
+    the INDEX_RELOAD_CHECK_SECONDS throttle (writers need the latest file).
+    """
+    global _last_reload_check
+    handle = RAG_STATE["index_handle"]
+    now = time.monotonic()
+
+    if handle is not None and not force_check and now - _last_reload_check < INDEX_RELOAD_CHECK_SECONDS:
+        return handle
+
+    with _INDEX_LOCK:
+        _last_reload_check = now
+        handle = RAG_STATE["index_handle"]
+        mtime = _index_mtime(db_path)
+        if handle is None or (mtime is not None and mtime != handle.source_mtime):
+            start = time.perf_counter()
+            index, chunk_store = _read_index_files(db_path)
+            handle = _make_generation(handle, index, chunk_store, time.perf_counter() - start, mtime)
+            RAG_STATE["index_handle"] = handle
+            metrics.model_loaded("index", handle.load_seconds)
+    return handle
+
+
+def publish_index(index, chunk_store, db_path="pdf_store", load_seconds=0.0):
+    """
+    Atomically publishes a freshly built index (with its chunk store) as the next generation.
+    The caller must have already written them to `db_path` (so the recorded file
+    mtime matches and this process does not reload its own write).
+    """
+    with _INDEX_LOCK:
+        handle = _make_generation(RAG_STATE["index_handle"], index, chunk_store, load_seconds, _index_mtime(db_path))
+        RAG_STATE["index_handle"] = handle
+    print(f"--- RAG_STATE: Published FAISS index generation {handle.generation}. ---")
+    return handle
+
+
 def load_faiss_index_data(db_path="pdf_store"):
-    """Loads FAISS index and data (chunks/metadata) only if not loaded."""
-    if RAG_STATE["faiss_index"] is None or RAG_STATE["data_store"] is None:
-        index_file = f"{db_path}/index.faiss"
-        data_file = f"{db_path}/data.pkl"
-        
-        if os.path.exists(index_file) and os.path.exists(data_file):
-            print("--- RAG_STATE: Loading FAISS Index and Data Store... ---")
-            try:
-                RAG_STATE["faiss_index"] = faiss.read_index(index_file)
-                RAG_STATE["data_store"] = pickle.load(open(data_file, "rb"))
-                print("--- RAG_STATE: FAISS and Data loaded successfully. ---")
-            except Exception as e:
-                print(f"--- RAG_STATE ERROR: Failed to load FAISS/Data: {e} ---")
-        else:
-            print("--- RAG_STATE: FAISS files not found. They will be loaded/created upon PDF upload/query. ---")
-            
-    # Return the current state (can be None if files don't exist yet)
-    return RAG_STATE["faiss_index"], RAG_STATE["data_store"]
\ No newline at end of file
+    """Returns (index, chunk_store) of the current generation (either can be None if nothing is ingested yet)."""
+    handle = get_index_handle(db_path)
+    return handle.index, handle.chunk_store
@@ -0,0 +1,124 @@
+import os, time, threading
+from collections import OrderedDict
+import numpy as np
+
+# Semantic answer cache in front of controller.route_query.
+#
+# A new query whose embedding has cosine similarity >= RESPONSE_CACHE_THRESHOLD with
+# a cached query gets that query's final answer, skipping routing, agents and
+# synthesis. Entries are scoped to the set of agents that was available when they
+# were cached (an answer given while an agent was down is not reused once it is
+# back), and answers that used PDF_RAG are only valid for the PDF index generation
+# they were built from.
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+# Agents whose answers depend on the PDF index generation.
+GENERATION_SCOPED_AGENTS = {"PDF_RAG"}
+
+
+_UNRESOLVED = object()
+
+
+def _agent_set(agents):
+    return None if agents is None else tuple(sorted(agents))
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype="float32").reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticResponseCache:
+    def __init__(self, threshold=RESPONSE_CACHE_THRESHOLD, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # query -> entry dict (LRU order)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _is_valid(self, entry, now, available):
+        if entry["expires_at"] < now:
+            return False
+        if available is not None and entry["available"] != available:
+            return False
+        return True
+
+    def lookup(self, query_emb, available=None, generation=None):
+        """
+        Returns (entry, similarity) for the most similar valid cached query above the
+        threshold, or (None, best_similarity). `available`, if given, restricts the
+        match to entries cached while exactly that agent set was available.
+        `generation` is a callable returning the current PDF index generation; it is
+        only called when a match used PDF_RAG, so other lookups never load the index.
+        """
+        query_emb = _unit(query_emb)
+        now = time.monotonic()
+        available = _agent_set(available)
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e["expires_at"] < now]:
+                del self._entries[key]
+            candidates = [e for e in self._entries.values() if self._is_valid(e, now, available)]
+
+        best_similarity, current = 0.0, _UNRESOLVED
+        if candidates:
+            similarities = np.stack([e["embedding"] for e in candidates]) @ query_emb
+            best_similarity = float(similarities.max())
+            for i in np.argsort(-similarities):
+                similarity = float(similarities[i])
+                if similarity < self.threshold:
+                    break
+                entry = candidates[i]
+                if GENERATION_SCOPED_AGENTS & set(entry["agents"]):
+                    if current is _UNRESOLVED:
+                        current = generation() if generation is not None else None
+                    if entry["generation"] != current:
+                        continue
+                with self._lock:
+                    if entry["query"] in self._entries:
+                        self._entries.move_to_end(entry["query"])
+                    self.hits += 1
+                return entry, similarity
+
+        with self._lock:
+            self.misses += 1
+        return None, best_similarity
+
+    def store(self, query: str, query_emb, agents: list, available, generation, final_answer: str):
+        """`generation` only matters (and may be None otherwise) when `agents` include PDF_RAG."""
+        with self._lock:
+            self._entries.pop(query, None)
+            self._entries[query] = {
+                "query": query,
+                "embedding": _unit(query_emb),
+                "agents": tuple(agents),
+                "available": _agent_set(available),
+                "generation": generation,
+                "final_answer": final_answer,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+RESPONSE_CACHE = SemanticResponseCache()
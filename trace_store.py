@@ -0,0 +1,470 @@
+import os, re, json, gzip, time, queue, bisect, struct, atexit, datetime, threading
+
+# Append-only trace log.
+#
+# Entries are appended as JSON lines to the active segment logs/trace-<N>.jsonl by a
+# background writer thread, so /ask never waits on disk I/O. When the active
+# segment passes TRACE_ROTATE_BYTES or TRACE_ROTATE_SECONDS it is closed, gzipped to
+# trace-<N>.jsonl.gz and segment N+1 is started; only the newest TRACE_MAX_SEGMENTS
+# compressed segments are kept. Each batch is flushed and fsync'ed, and a torn last
+# line left by a crash is trimmed on startup, so a crash can lose at most the
+# entries still queued. A legacy logs/trace.json array is imported once.
+#
+# Every entry also gets a fixed-size record in logs/trace.idx (sequence number =
+# record number): segment id, byte offset in the uncompressed segment, timestamp and
+# an agent bitmask. /logs pages, filters and streams through this index with seeks,
+# so its memory use does not grow with the log. Compressed segments are written as a
+# series of independent gzip members, listed in trace-<N>.jsonl.gz.members, so a
+# read decompresses one member rather than the segment up to the offset.
+#
+# One writer per log directory: run multiple server processes with separate
+# TRACE_LOG_DIRs.
+
+TRACE_LOG_DIR = os.getenv("TRACE_LOG_DIR", "logs")
+TRACE_ROTATE_BYTES = int(os.getenv("TRACE_ROTATE_BYTES", str(16 * 1024 * 1024)))
+TRACE_ROTATE_SECONDS = float(os.getenv("TRACE_ROTATE_SECONDS", str(24 * 3600)))
+TRACE_MAX_SEGMENTS = int(os.getenv("TRACE_MAX_SEGMENTS", "100"))
+TRACE_FSYNC = os.getenv("TRACE_FSYNC", "1") == "1"
+
+TRACE_GZIP_MEMBER_BYTES = int(os.getenv("TRACE_GZIP_MEMBER_BYTES", str(256 * 1024)))
+
+LEGACY_LOG_FILE = "trace.json"
+INDEX_FILE = "trace.idx"
+MEMBERS_SUFFIX = ".members"
+
+# segment id, offset, unix timestamp, agent bitmask (+ padding) = 24 bytes per entry
+_INDEX_RECORD = struct.Struct("<IQdB3x")
+# uncompressed start, compressed start of one gzip member
+_MEMBER_RECORD = struct.Struct("<QQ")
+AGENT_BITS = {"PDF_RAG": 1, "Web_Search": 2, "Arxiv_Search": 4}
+_SCAN_BLOCK = 4096  # index records read per seek
+_SEGMENT_RE = re.compile(r"^trace-(\d{6})\.jsonl(\.gz)?$")
+
+
+def segment_name(segment_id: int, compressed: bool = False):
+    return f"trace-{segment_id:06d}.jsonl" + (".gz" if compressed else "")
+
+
+class TraceStore:
+    def __init__(self, log_dir=TRACE_LOG_DIR):
+        self.log_dir = log_dir
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()  # guards startup and segment switches
+        self._writer = None
+        self._file = None
+        self._segment_id = None
+        self._segment_started = None
+
+    # ---------- Segments ----------
+
+    def segments(self):
+        """Returns [(segment_id, path, compressed)] oldest first."""
+        try:
+            names = os.listdir(self.log_dir)
+        except FileNotFoundError:
+            return []
+        found = {}
+        for name in names:
+            match = _SEGMENT_RE.match(name)
+            if match:
+                segment_id, compressed = int(match.group(1)), bool(match.group(2))
+                # If both exist (crash mid-compression), the plain file is authoritative.
+                if segment_id not in found or not compressed:
+                    found[segment_id] = (segment_id, os.path.join(self.log_dir, name), compressed)
+        return [found[k] for k in sorted(found)]
+
+    def _open_active(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._import_legacy()
+
+        segments = self.segments()
+        if segments and not segments[-1][2]:
+            self._segment_id, path, _ = segments[-1]
+            _trim_torn_tail(path)
+        else:
+            self._segment_id = (segments[-1][0] + 1) if segments else 1
+            path = os.path.join(self.log_dir, segment_name(self._segment_id))
+        self._file = open(path, "ab")
+        self._sync_index()
+        # Segment age is counted from when this process opened it.
+        self._segment_started = time.time()
+
+    def _import_legacy(self):
+        legacy = os.path.join(self.log_dir, LEGACY_LOG_FILE)
+        if not os.path.exists(legacy) or self.segments():
+            return
+        try:
+            with open(legacy, "r") as f:
+                entries = json.load(f)
+        except json.JSONDecodeError:
+            entries = []
+        with open(os.path.join(self.log_dir, segment_name(1)), "ab") as f:
+            for entry in entries:
+                f.write(_encode(entry))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(legacy, legacy + ".migrated")
+        print(f"--- TRACE: Imported {len(entries)} entries from {legacy}. ---")
+
+    def _rotate(self):
+        path = self._file.name
+        self._file.close()
+        _compress(path)
+        self._segment_id += 1
+        self._file = open(os.path.join(self.log_dir, segment_name(self._segment_id)), "ab")
+        self._segment_started = time.time()
+
+        compressed = [s for s in self.segments() if s[2]]
+        for _, old_path, _ in compressed[:max(0, len(compressed) - TRACE_MAX_SEGMENTS)]:
+            os.remove(old_path)
+            if os.path.exists(old_path + MEMBERS_SUFFIX):
+                os.remove(old_path + MEMBERS_SUFFIX)
+
+    def _should_rotate(self):
+        return self._file.tell() > 0 and (
+            self._file.tell() >= TRACE_ROTATE_BYTES
+            or time.time() - self._segment_started >= TRACE_ROTATE_SECONDS
+        )
+
+    # ---------- Writer ----------
+
+    def start(self):
+        with self._lock:
+            if self._writer is None:
+                self._open_active()
+                self._writer = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                self._writer.start()
+
+    def append(self, entry: dict):
+        """Queues one entry for writing; never blocks on disk."""
+        if self._writer is None:
+            self.start()
+        self._queue.put(entry)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(item is None for item in batch)
+            entries = [item for item in batch if item is not None]
+            try:
+                with self._lock:
+                    self._write_batch(entries)
+            except Exception as e:
+                print(f"--- TRACE ERROR: Failed to write {len(entries)} entries: {e} ---")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, entries: list):
+        records = []
+        for entry in entries:
+            records.append(_index_record(self._segment_id, self._file.tell(), entry))
+            self._file.write(_encode(entry))
+        self._file.flush()
+        if TRACE_FSYNC:
+            os.fsync(self._file.fileno())
+        # The index can always be rebuilt from the segments, so it is written after them.
+        self._index.write(b"".join(records))
+        self._index.flush()
+        if self._should_rotate():
+            self._rotate()
+
+    def flush(self):
+        """Blocks until every queued entry has been written."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join(timeout=10)
+            self._writer = None
+            self._file.close()
+            self._index.close()
+
+    # ---------- Offset index ----------
+
+    def _index_path(self):
+        return os.path.join(self.log_dir, INDEX_FILE)
+
+    def _sync_index(self):
+        """
+        Opens the index for appending and indexes any entries it is missing: all of
+        them if it is absent, otherwise just the ones written after its last record
+        (a crash between the segment write and the index write).
+        """
+        path = self._index_path()
+        resume = None
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            size -= size % _INDEX_RECORD.size  # drop a torn record
+            with open(path, "rb+") as f:
+                f.truncate(size)
+                if size:
+                    f.seek(size - _INDEX_RECORD.size)
+                    resume = _INDEX_RECORD.unpack(f.read(_INDEX_RECORD.size))[:2]
+
+        self._index = open(path, "ab")
+        missing = 0
+        for segment_id, seg_path, compressed in self.segments():
+            if resume is not None and segment_id < resume[0]:
+                continue
+            opener = gzip.open if compressed else open
+            with opener(seg_path, "rb") as f:
+                if resume is not None and segment_id == resume[0]:
+                    f.seek(resume[1])
+                    f.readline()  # already indexed
+                records = []
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line:
+                        break
+                    entry = _decode(line)
+                    if entry is not None:
+                        records.append(_index_record(segment_id, offset, entry))
+                self._index.write(b"".join(records))
+                missing += len(records)
+        self._index.flush()
+        if missing:
+            print(f"--- TRACE: Indexed {missing} trace entries. ---")
+
+    def count(self):
+        """Number of indexed entries (= next sequence number)."""
+        try:
+            return os.path.getsize(self._index_path()) // _INDEX_RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def query(self, cursor=None, order="asc", since=None, until=None, agent=None, contains=None, limit=None, max_scan=None):
+        """
+        Yields (seq, entry) for entries matching the filters, starting at sequence
+        number `cursor` and walking forwards ("asc") or backwards ("desc").
+        Time range and agent are checked against the index before the entry is read.
+        A final (next_cursor, None) is yielded when `limit` or `max_scan` stops the
+        scan early, so callers can resume from there.
+        """
+        if self._writer is None:
+            self.start()
+        total = self.count()
+        step = 1 if order == "asc" else -1
+        seq = cursor if cursor is not None else (0 if step == 1 else total - 1)
+        agent_bit = AGENT_BITS.get(agent) if agent else None
+        contains = contains.lower() if contains else None
+        returned = scanned = 0
+        readers = _SegmentReaders(self)
+
+        try:
+            with open(self._index_path(), "rb") as idx:
+                while 0 <= seq < total:
+                    # Read the next block of index records in scan direction.
+                    lo, hi = (seq, min(seq + _SCAN_BLOCK, total)) if step == 1 else (max(seq - _SCAN_BLOCK + 1, 0), seq + 1)
+                    idx.seek(lo * _INDEX_RECORD.size)
+                    block = idx.read((hi - lo) * _INDEX_RECORD.size)
+                    positions = range(0, hi - lo) if step == 1 else range(hi - lo - 1, -1, -1)
+
+                    for i in positions:
+                        current = lo + i
+                        if (limit is not None and returned >= limit) or (max_scan is not None and scanned >= max_scan):
+                            yield current, None
+                            return
+                        scanned += 1
+                        segment_id, offset, ts, mask = _INDEX_RECORD.unpack_from(block, i * _INDEX_RECORD.size)
+                        if (since is not None and ts < since) or (until is not None and ts > until):
+                            continue
+                        if agent_bit is not None and not mask & agent_bit:
+                            continue
+
+                        entry = readers.read(segment_id, offset)
+                        if entry is None:
+                            continue  # segment removed by retention
+                        if agent and agent_bit is None and agent not in entry.get("agents_used", []):
+                            continue
+                        if contains and contains not in str(entry.get("query", "")).lower():
+                            continue
+                        returned += 1
+                        yield current, entry
+                    seq = hi if step == 1 else lo - 1
+        finally:
+            readers.close()
+
+    # ---------- Readers ----------
+
+    def iter_entries(self):
+        """Yields every stored entry, oldest first, streaming segment by segment."""
+        segments = self.segments()
+        legacy = os.path.join(self.log_dir, LEGACY_LOG_FILE)
+        if not segments and os.path.exists(legacy):
+            # Not migrated yet (the writer imports it on first start).
+            try:
+                with open(legacy, "r") as f:
+                    yield from json.load(f)
+            except json.JSONDecodeError:
+                pass
+            return
+
+        for _, path, compressed in segments:
+            opener = gzip.open if compressed else open
+            try:
+                with opener(path, "rb") as f:
+                    for line in f:
+                        entry = _decode(line)
+                        if entry is not None:
+                            yield entry
+            except FileNotFoundError:
+                continue  # rotated away while reading
+
+
+class _SegmentReaders:
+    """Keeps one open handle per segment during a scan."""
+
+    def __init__(self, store: TraceStore):
+        self._paths = {segment_id: (path, compressed) for segment_id, path, compressed in store.segments()}
+        self._open = {}
+
+    def read(self, segment_id: int, offset: int):
+        f = self._open.get(segment_id)
+        if f is None:
+            if segment_id not in self._paths:
+                return None
+            path, compressed = self._paths[segment_id]
+            try:
+                f = _CompressedSegment(path) if compressed else open(path, "rb")
+            except FileNotFoundError:
+                # Compressed (or removed) since the scan started.
+                if not compressed and os.path.exists(path + ".gz"):
+                    f = _CompressedSegment(path + ".gz")
+                else:
+                    return None
+            self._open[segment_id] = f
+        f.seek(offset)
+        return _decode(f.readline())
+
+    def close(self):
+        for f in self._open.values():
+            f.close()
+
+
+class _CompressedSegment:
+    """
+    Random access into a gzipped segment: seeks decompress only the gzip member
+    holding the offset (cached, so neighbouring entries in either direction are
+    free). Segments without a member table are one member, decompressed once.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._members = _read_members(path + MEMBERS_SUFFIX)
+        self._starts = [start for start, _ in self._members]
+        self._member = None
+        self._data = b""
+        self._pos = 0
+
+    def seek(self, offset: int):
+        i = bisect.bisect_right(self._starts, offset) - 1
+        if i != self._member:
+            start = self._members[i][1]
+            end = self._members[i + 1][1] if i + 1 < len(self._members) else None
+            self._file.seek(start)
+            raw = self._file.read() if end is None else self._file.read(end - start)
+            self._data = gzip.decompress(raw)
+            self._member = i
+        self._pos = offset - self._members[i][0]
+
+    def readline(self):
+        end = self._data.find(b"\n", self._pos)
+        return self._data[self._pos:] if end == -1 else self._data[self._pos:end + 1]
+
+    def close(self):
+        self._file.close()
+
+
+def _read_members(path: str):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [(0, 0)]
+    return [_MEMBER_RECORD.unpack_from(data, i) for i in range(0, len(data) - len(data) % _MEMBER_RECORD.size, _MEMBER_RECORD.size)] or [(0, 0)]
+
+
+def _entry_time(entry: dict):
+    try:
+        return datetime.datetime.fromisoformat(str(entry.get("timestamp"))).timestamp()
+    except ValueError:
+        return time.time()
+
+
+def _index_record(segment_id: int, offset: int, entry: dict):
+    mask = 0
+    for agent in entry.get("agents_used", []) or []:
+        mask |= AGENT_BITS.get(agent, 0)
+    return _INDEX_RECORD.pack(segment_id, offset, _entry_time(entry), mask)
+
+
+def _encode(entry: dict):
+    return (json.dumps(entry, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _decode(line: bytes):
+    try:
+        return json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None  # torn or corrupt line
+
+
+def _trim_torn_tail(path: str):
+    """Drops a partial last line (a write interrupted by a crash)."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the previous newline.
+        pos = size - 1
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            idx = block.rfind(b"\n")
+            if idx != -1:
+                f.truncate(pos - step + idx + 1)
+                return
+            pos -= step
+        f.truncate(0)
+
+
+def _compress(path: str):
+    """
+    Gzips a closed segment as independent members of ~TRACE_GZIP_MEMBER_BYTES,
+    each ending on a line boundary, and records where each one starts.
+    """
+    members = []
+    with open(path, "rb") as src, open(path + ".gz.tmp", "wb") as dst:
+        while True:
+            start = src.tell()
+            chunk = src.read(TRACE_GZIP_MEMBER_BYTES)
+            if not chunk:
+                break
+            chunk += src.readline()  # finish the last line
+            members.append(_MEMBER_RECORD.pack(start, dst.tell()))
+            dst.write(gzip.compress(chunk))
+    with open(path + ".gz" + MEMBERS_SUFFIX, "wb") as f:
+        f.write(b"".join(members))
+    os.replace(path + ".gz.tmp", path + ".gz")
+    os.remove(path)
+
+
+TRACE_STORE = TraceStore()
+atexit.register(TRACE_STORE.close)
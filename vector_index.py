@@ -0,0 +1,303 @@
+import os, math
+import numpy as np
+import faiss
+
+# FAISS index factory for the PDF store.
+#
+# Small corpora use an exact flat index. Past PDF_ANN_THRESHOLD vectors (or when
+# PDF_INDEX_TYPE names one explicitly) the store is rebuilt as an approximate index:
+#   ivf_flat - inverted lists over k-means cells, exact vectors inside a cell
+#   ivf_pq   - inverted lists with product-quantized vectors (much smaller, lossy)
+#   hnsw     - navigable small-world graph (fastest queries, no in-place delete)
+# Every type is addressed by the store's stable chunk IDs. Search breadth is set by
+# PDF_IVF_NPROBE / PDF_HNSW_EF_SEARCH; benchmarks/ann_recall.py helps pick them.
+#
+# Vectors are L2-normalized and searched by inner product (cosine similarity), and
+# can be stored as float16 or 8-bit scalar-quantized codes. Indexes are opened
+# memory-mapped where FAISS supports it, so uvicorn workers share one copy of the
+# vectors in the page cache instead of each holding its own.
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+PDF_INDEX_TYPE = os.getenv("PDF_INDEX_TYPE", "auto")              # "auto" or one of INDEX_TYPES
+PDF_ANN_INDEX_TYPE = os.getenv("PDF_ANN_INDEX_TYPE", "ivf_flat")  # what "auto" switches to
+PDF_ANN_THRESHOLD = int(os.getenv("PDF_ANN_THRESHOLD", "50000"))  # vectors
+
+IVF_NLIST = int(os.getenv("PDF_IVF_NLIST", "0"))  # 0 = 4 * sqrt(vectors)
+IVF_NPROBE = int(os.getenv("PDF_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("PDF_PQ_M", "48"))  # sub-quantizers; rounded down to a divisor of the dimension
+PQ_NBITS = int(os.getenv("PDF_PQ_NBITS", "8"))
+HNSW_M = int(os.getenv("PDF_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("PDF_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("PDF_HNSW_EF_SEARCH", "64"))
+TRAIN_SAMPLE_SIZE = int(os.getenv("PDF_INDEX_TRAIN_SAMPLE", "100000"))
+
+INDEX_METRIC = os.getenv("PDF_INDEX_METRIC", "cosine")    # "cosine" (normalized + inner product) or "l2"
+VECTOR_STORAGE = os.getenv("PDF_VECTOR_STORAGE", "fp32")  # fp32, fp16 or sq8 (ivf_pq has its own codes)
+INDEX_MMAP = os.getenv("PDF_INDEX_MMAP", "1") == "1"
+
+STORAGE_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+# Newer FAISS can map flat/HNSW codes (IO_FLAG_MMAP_IFC); IO_FLAG_MMAP maps IVF lists.
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+# k-means is unreliable with fewer training points per centroid (FAISS warns below 39).
+_MIN_POINTS_PER_CENTROID = 39
+_MIN_NLIST = 8
+
+
+def desired_type(n_vectors: int):
+    """The index type the configuration asks for at this corpus size."""
+    if PDF_INDEX_TYPE != "auto":
+        return PDF_INDEX_TYPE
+    return PDF_ANN_INDEX_TYPE if n_vectors >= PDF_ANN_THRESHOLD else "flat"
+
+
+def effective_type(kind: str, n_vectors: int):
+    """`kind`, or "flat" if there are too few vectors to train it yet."""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {kind!r}; expected one of {', '.join(INDEX_TYPES)}")
+    if kind in ("ivf_flat", "ivf_pq") and _nlist(n_vectors) < _MIN_NLIST:
+        return "flat"
+    if kind == "ivf_pq" and n_vectors < _MIN_POINTS_PER_CENTROID * 2 ** PQ_NBITS:
+        return "flat"
+    return kind
+
+
+def effective_storage(kind: str, n_vectors: int):
+    """VECTOR_STORAGE as it applies to `kind` ("pq" for ivf_pq; sq8 needs vectors to learn its range)."""
+    if VECTOR_STORAGE != "fp32" and VECTOR_STORAGE not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage {VECTOR_STORAGE!r}; expected fp32, fp16 or sq8")
+    if kind == "ivf_pq":
+        return "pq"
+    if VECTOR_STORAGE == "sq8" and n_vectors == 0:
+        return "fp32"
+    return VECTOR_STORAGE
+
+
+def _faiss_metric():
+    if INDEX_METRIC not in ("cosine", "l2"):
+        raise ValueError(f"Unknown index metric {INDEX_METRIC!r}; expected cosine or l2")
+    return faiss.METRIC_INNER_PRODUCT if INDEX_METRIC == "cosine" else faiss.METRIC_L2
+
+
+def _nlist(n_vectors: int):
+    nlist = IVF_NLIST or int(4 * math.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // _MIN_POINTS_PER_CENTROID))
+
+
+def _pq_m(dim: int):
+    return max(m for m in range(1, min(PQ_M, dim) + 1) if dim % m == 0)
+
+
+def _unwrap(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_type(index):
+    """Returns the INDEX_TYPES name of a store index."""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def index_metric(index):
+    return "cosine" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def vector_storage(index):
+    """How vectors are encoded: fp32, fp16, sq8 or pq."""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "pq"
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return next((name for name, qtype in STORAGE_TYPES.items() if qtype == inner.sq.qtype), "sq")
+    return "fp32"
+
+
+def normalize_for(index, vectors):
+    """float32 copy of `vectors`, L2-normalized if `index` searches by inner product."""
+    vectors = np.array(vectors, dtype="float32", copy=True).reshape(-1, index.d)
+    if index_metric(index) == "cosine":
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def build_index(kind: str, vectors: np.ndarray, ids: np.ndarray):
+    """
+    Builds an index of `kind` (falling back to flat when it can't be trained yet)
+    over `vectors` under `ids`. IVF types are trained on a random sample.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    ids = np.asarray(ids, dtype="int64")
+    n, dim = vectors.shape
+    kind = effective_type(kind, n)
+    metric = _faiss_metric()
+    qtype = STORAGE_TYPES.get(effective_storage(kind, n))
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+
+    if kind == "flat":
+        base = faiss.IndexFlat(dim, metric) if qtype is None else faiss.IndexScalarQuantizer(dim, qtype, metric)
+        index = faiss.IndexIDMap(base)
+    elif kind == "hnsw":
+        if qtype is None:
+            hnsw = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+        else:
+            hnsw = faiss.IndexHNSWSQ(dim, qtype, HNSW_M, metric)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        # IDMap2 keeps a reverse map so vectors can be reconstructed for rebuilds.
+        index = faiss.IndexIDMap2(hnsw)
+    else:
+        nlist = _nlist(n)
+        quantizer = faiss.IndexFlat(dim, metric)
+        if kind == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim), PQ_NBITS, metric)
+        elif qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, metric)
+        # IVF indexes take IDs natively; a hashtable direct map allows both
+        # remove_ids and reconstruct by ID.
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        print(f"--- INDEX: Training {kind} (nlist={nlist}) on {min(n, _train_size(nlist))} of {n} vectors... ---")
+        index.train(_training_sample(vectors, nlist))
+
+    if not index.is_trained:
+        # Scalar quantizers learn each dimension's value range.
+        index.train(_training_sample(vectors, 1))
+    if n:
+        index.add_with_ids(vectors, ids)
+    return configure_search(index)
+
+
+def _train_size(nlist: int):
+    return max(TRAIN_SAMPLE_SIZE, nlist * _MIN_POINTS_PER_CENTROID, _MIN_POINTS_PER_CENTROID * 2 ** PQ_NBITS)
+
+
+def _training_sample(vectors: np.ndarray, nlist: int):
+    size = _train_size(nlist)
+    if len(vectors) <= size:
+        return vectors
+    rows = np.random.default_rng(0).choice(len(vectors), size=size, replace=False)
+    return vectors[np.sort(rows)]
+
+
+def configure_search(index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """Applies the search-time breadth parameters (IVF nprobe, HNSW efSearch)."""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(nprobe, inner.nlist)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+    return index
+
+
+def read_index(path: str, mmap: bool = INDEX_MMAP):
+    """
+    Opens a saved store index with search parameters applied. With `mmap` the vectors
+    stay in the page cache and are shared between processes; falls back to a normal
+    read if this FAISS build or index type can't be mapped.
+    """
+    if mmap:
+        try:
+            return configure_search(faiss.read_index(path, _MMAP_FLAGS))
+        except RuntimeError as e:
+            print(f"--- INDEX: Memory-mapped load failed ({e}); reading into memory. ---")
+    return configure_search(faiss.read_index(path))
+
+
+def writable_copy(index, path: str):
+    """
+    A private in-memory copy of a published index for copy-on-write updates.
+    Memory-mapped indexes can't be cloned or grown, so they are re-read from their file.
+    """
+    if INDEX_MMAP and os.path.exists(path):
+        return read_index(path, mmap=False)
+    return faiss.clone_index(index)
+
+
+def all_vectors(index):
+    """Returns (ids, vectors) for everything in the index (lossy for ivf_pq)."""
+    if index.ntotal == 0:
+        return np.zeros(0, dtype="int64"), np.zeros((0, index.d), dtype="float32")
+
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+        return ids, _unwrap(index).reconstruct_n(0, index.ntotal)
+
+    invlists = index.invlists
+    ids = np.concatenate([
+        faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i)).copy()
+        for i in range(index.nlist) if invlists.list_size(i)
+    ]).astype("int64")
+    return ids, index.reconstruct_batch(ids)
+
+
+def remove_ids(index, ids: np.ndarray):
+    """
+    Removes `ids` and returns the resulting index. HNSW graphs can't delete in place,
+    so they are rebuilt from the remaining vectors (a new object is returned).
+    """
+    ids = np.asarray(ids, dtype="int64")
+    if index_type(index) != "hnsw":
+        index.remove_ids(ids)
+        return index
+
+    kept_ids, vectors = all_vectors(index)
+    keep = ~np.isin(kept_ids, ids)
+    return build_index("hnsw", vectors[keep], kept_ids[keep])
+
+
+def maybe_rebuild(index):
+    """
+    Rebuilds the index if its type, metric or vector storage differs from the
+    configuration, e.g. a flat index that has grown past PDF_ANN_THRESHOLD or an
+    older unnormalized L2 index. In "auto" mode an ANN
+    index is never downgraded back to flat after deletions.
+    Returns (index, rebuilt).
+    """
+    n = index.ntotal
+    current_kind = index_type(index)
+    kind = effective_type(desired_type(n), n)
+    if PDF_INDEX_TYPE == "auto" and current_kind != "flat":
+        kind = current_kind
+    current = (current_kind, index_metric(index), vector_storage(index))
+    wanted = (kind, INDEX_METRIC, effective_storage(kind, n))
+    if wanted == current:
+        return index, False
+
+    print(f"--- INDEX: Rebuilding {'/'.join(current)} index as {'/'.join(wanted)} ({n} vectors)... ---")
+    ids, vectors = all_vectors(index)
+    return build_index(kind, vectors, ids), True
+
+
+def index_metadata(index):
+    """Describes the index type and parameters (stored as pdf_store/index_meta.json)."""
+    inner = _unwrap(index)
+    meta = {
+        "type": index_type(index),
+        "metric": index_metric(index),
+        "storage": vector_storage(index),
+        "dim": index.d,
+        "vectors": index.ntotal,
+    }
+    if isinstance(inner, faiss.IndexIVF):
+        meta.update(nlist=inner.nlist, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        meta.update(pq_m=inner.pq.M, pq_nbits=inner.pq.nbits)
+    if isinstance(inner, faiss.IndexHNSW):
+        meta.update(hnsw_m=inner.hnsw.nb_neighbors(1), ef_construction=inner.hnsw.efConstruction, ef_search=inner.hnsw.efSearch)
+    return meta
@@ -0,0 +1,165 @@
+import os, time, asyncio, datetime, threading
+
+# Startup warm-up for the serving process.
+#
+# Everything heavy is still lazy-loaded (rag_state, agents/registry.py), so without
+# this the first PDF query or upload pays for the agent imports, the
+# SentenceTransformer load, the FAISS index read and torch's first-call initialization. warm_up() runs those loads in parallel
+# threads from the FastAPI lifespan hook, then one warm-up encode and one search so
+# the first real query takes the same path as the hundredth. Each component's
+# load time is logged and reported by /healthz/ready.
+#
+# STARTUP_WARMUP:
+#   background - (default) the server accepts requests at once; /healthz/ready
+#                answers 503 until every component is warm
+#   blocking   - startup waits for the warm-up before serving anything
+#   off        - nothing is preloaded; /healthz/ready is always ready
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+_STATE_LOCK = threading.Lock()
+WARMUP_STATE = {
+    "mode": STARTUP_WARMUP,
+    "started_at": None,
+    "finished_at": None,
+    "seconds": None,
+    "components": {},
+}
+
+
+def _record(name: str, status: str, seconds: float = None, error: str = None):
+    entry = {"status": status}
+    if seconds is not None:
+        entry["seconds"] = round(seconds, 3)
+    if error is not None:
+        entry["error"] = error
+    with _STATE_LOCK:
+        WARMUP_STATE["components"][name] = entry
+
+
+def _timed(name: str, fn):
+    """Blocking: runs one warm-up step, recording its status and duration."""
+    _record(name, "loading")
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        seconds = time.perf_counter() - start
+        print(f"--- WARMUP ERROR: {name} failed after {seconds:.2f}s: {e} ---")
+        _record(name, "error", seconds, f"{type(e).__name__}: {e}")
+        return False
+    seconds = time.perf_counter() - start
+    print(f"--- WARMUP: {name} ready in {seconds:.2f}s ---")
+    _record(name, "ok", seconds)
+    return True
+
+
+# ---------- Components ----------
+
+def _load_agents():
+    from agents.registry import load_all
+
+    load_all()
+
+
+def _load_embedding_model():
+    from rag_state import get_embedding_model
+
+    # The first encode initializes torch kernels and the tokenizer; do it now, not on a user's query.
+    get_embedding_model().encode(["warm-up"], convert_to_numpy=True)
+
+
+def _load_index(db_path: str):
+    from rag_state import get_index_handle
+
+    get_index_handle(db_path, force_check=True)
+
+
+def _load_chunk_store(db_path: str):
+    from chunk_store import open_chunk_store
+
+    store = open_chunk_store(db_path)
+    store.stats()                     # opens the connection and creates/backfills the FTS index
+    store.keyword_search("warm-up", 1)
+
+
+def _load_rerank_model():
+    from rag_state import get_rerank_model
+
+    get_rerank_model().predict([("warm-up", "warm-up")])
+
+
+def _train_router():
+    from agents.router import ensure_trained
+    from trace_store import TRACE_STORE
+
+    ensure_trained(TRACE_STORE)
+
+
+def _warm_search(db_path: str):
+    """One query through the loaded index, so its pages and search buffers are touched."""
+    from rag_state import get_index_handle, get_embedding_model
+    from vector_index import normalize_for
+
+    handle = get_index_handle(db_path)
+    if handle.index is not None and handle.index.ntotal:
+        query = get_embedding_model().encode(["warm-up"], convert_to_numpy=True).astype("float32")
+        handle.index.search(normalize_for(handle.index, query), 1)
+
+
+def _components(db_path: str):
+    from agents import reranker
+    from agents.router import ROUTER_ENABLED
+
+    components = {
+        "agents": _load_agents,
+        "embedding_model": _load_embedding_model,
+        "index": lambda: _load_index(db_path),
+        "chunk_store": lambda: _load_chunk_store(db_path),
+    }
+    if reranker.RERANK_ENABLED:
+        components["rerank_model"] = _load_rerank_model
+    return components, ROUTER_ENABLED
+
+
+async def warm_up(db_path: str = "pdf_store"):
+    """Loads every component in parallel, then runs the steps that need several of them."""
+    started = time.perf_counter()
+    with _STATE_LOCK:
+        WARMUP_STATE["started_at"] = datetime.datetime.now().isoformat()
+    print(f"--- WARMUP: Preloading models and index ({STARTUP_WARMUP})... ---")
+
+    try:
+        components, router_enabled = await asyncio.to_thread(_components, db_path)
+    except Exception as e:
+        components, router_enabled = {}, False
+        _record("imports", "error", time.perf_counter() - started, f"{type(e).__name__}: {e}")
+    for name in components:
+        _record(name, "pending")
+
+    results = await asyncio.gather(*(asyncio.to_thread(_timed, name, fn) for name, fn in components.items()))
+    loaded = dict(zip(components, results))
+
+    # Both need the embedding model (the router embeds its examples, the search a query)
+    followups = []
+    if loaded.get("embedding_model") and router_enabled:
+        followups.append(asyncio.to_thread(_timed, "router", _train_router))
+    if loaded.get("embedding_model") and loaded.get("index"):
+        followups.append(asyncio.to_thread(_timed, "warm_search", lambda: _warm_search(db_path)))
+    await asyncio.gather(*followups)
+
+    seconds = time.perf_counter() - started
+    with _STATE_LOCK:
+        WARMUP_STATE["finished_at"] = datetime.datetime.now().isoformat()
+        WARMUP_STATE["seconds"] = round(seconds, 3)
+    print(f"--- WARMUP: Done in {seconds:.2f}s. ---")
+
+
+def readiness():
+    """Returns (ready, report). Ready once the warm-up finished with every component loaded."""
+    with _STATE_LOCK:
+        report = {**WARMUP_STATE, "components": dict(WARMUP_STATE["components"])}
+    if STARTUP_WARMUP == "off":
+        return True, dict(report, ready=True)
+    ready = report["finished_at"] is not None and all(c["status"] == "ok" for c in report["components"].values())
+    return ready, dict(report, ready=ready)